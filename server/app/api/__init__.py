@@ -1,6 +1,7 @@
 from .auth import (
     auth_router,
     get_current_user,
+    get_token_user,
     authenticate_user,
     create_accesstoken,
     get_hash_password,
@@ -10,10 +11,13 @@ from .auth import (
 from .friends import friends_router
 from .websocket import websocket_router
 from .message import get_messages
+from .metrics import metrics_router
+from .rooms import rooms_router
 
 __all__ = [
     "auth_router",
     "get_current_user",
+    "get_token_user",
     "authenticate_user",
     "create_accesstoken",
     "get_hash_password",
@@ -22,4 +26,6 @@ __all__ = [
     "websocket_router",
     "friends_router",
     "get_messages",
+    "metrics_router",
+    "rooms_router",
 ]
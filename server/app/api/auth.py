@@ -2,7 +2,6 @@ from datetime import datetime, timedelta, timezone
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, Response, Request
 from starlette import status
-from pwdlib import PasswordHash
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from models.users_model import CreateUserRequest, User, Token, TokenData
 from db.database import get_user_by_email, get_user_by_username, db_connection
@@ -14,19 +13,20 @@ from core.config import (
     REFRESH_TOKEN_EXPIRE_DAYS,
 )
 from jwt.exceptions import InvalidTokenError
+from core.user_cache import user_cache
+from core.hashing import password_hasher
 
 auth_router = APIRouter(prefix="/auth", tags=["auth"])
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
-password_hash = PasswordHash.recommended()
 
 
-def get_hash_password(password: str):
-    return password_hash.hash(password)
+async def get_hash_password(password: str):
+    return await password_hasher.hash(password)
 
 
-def verify_password(plain_pw: str, hashed_pw):
-    return password_hash.verify(plain_pw, hashed_pw)
+async def verify_password(plain_pw: str, hashed_pw):
+    return await password_hasher.verify(plain_pw, hashed_pw)
 
 
 async def authenticate_user(username: str, password: str):
@@ -35,7 +35,7 @@ async def authenticate_user(username: str, password: str):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="user does not exist"
         )
-    if not verify_password(password, user_dict["hashed_password"]):
+    if not await verify_password(password, user_dict["hashed_password"]):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="wrong password",
@@ -66,7 +66,7 @@ def create_refreshtoken(data: dict, expires_delta: timedelta | None):
     return encoded_jwt
 
 
-def verify_refreshtoken(refresh_token: str):
+def verify_refreshtoken(refresh_token: str) -> TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate the refresh token",
@@ -79,12 +79,12 @@ def verify_refreshtoken(refresh_token: str):
 
         if username is None or token_type != "refresh":
             raise credentials_exception
-        return username
+        return TokenData(username=username, user_id=payload.get("uid"))
     except InvalidTokenError:
         raise credentials_exception
 
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+def decode_access_token(token: str) -> TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -95,15 +95,46 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
         username = payload.get("sub")
         if username is None:
             raise credentials_exception
-        token_data = TokenData(username=username)
+        # "uid" is missing from tokens issued before it was added to the claims
+        return TokenData(username=username, user_id=payload.get("uid"))
     except InvalidTokenError:
         raise credentials_exception
-    user = await get_user_by_username(token_data.username)
+
+
+async def resolve_user(token_data: TokenData):
+    """Look up the user a token belongs to, through the user cache"""
+    if token_data.user_id is not None:
+        user = await user_cache.get_by_id(token_data.user_id)
+    else:
+        user = await user_cache.get_by_username(token_data.username)
+    if not user or user["username"] != token_data.username:
+        return None
+    return user
+
+
+async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    token_data = decode_access_token(token)
+    user = await resolve_user(token_data)
     if not user:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
     return user
 
 
+async def get_token_user(token: Annotated[str, Depends(oauth2_scheme)]):
+    """
+    Caller identity straight from the token claims, without a user lookup.
+    Only carries "id" and "username"; use get_current_user for the full row.
+    """
+    token_data = decode_access_token(token)
+    if token_data.user_id is None:
+        return await get_current_user(token)
+    return {"id": token_data.user_id, "username": token_data.username}
+
+
 @auth_router.post("/register", response_model=User)
 async def register(user: CreateUserRequest):
     if await get_user_by_username(user.username):
@@ -116,7 +147,7 @@ async def register(user: CreateUserRequest):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="user already exists with this email",
         )
-    hash_password = get_hash_password(user.password)
+    hash_password = await get_hash_password(user.password)
     query = """
         INSERT INTO users (email, username, hashed_password)
         VALUES (:email, :username, :hashed_password)
@@ -143,12 +174,11 @@ async def login(
 ) -> Token:
     user = await authenticate_user(form_data.username, form_data.password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_accesstoken({"sub": user["username"]}, access_token_expires)
+    claims = {"sub": user["username"], "uid": user["id"]}
+    access_token = create_accesstoken(claims, access_token_expires)
 
     refresh_token_expires = timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
-    refresh_token = create_refreshtoken(
-        {"sub": user["username"]}, refresh_token_expires
-    )
+    refresh_token = create_refreshtoken(claims, refresh_token_expires)
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -169,13 +199,19 @@ async def refresh_access_token(request: Request, response: Response):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="refresh token not found"
         )
-    username = verify_refreshtoken(refresh_token)
+    token_data = verify_refreshtoken(refresh_token)
+    user = await resolve_user(token_data)
+    if not user:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="user does not exist"
+        )
+    claims = {"sub": user["username"], "uid": user["id"]}
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    new_access_token = create_accesstoken({"sub": username}, access_token_expires)
+    new_access_token = create_accesstoken(claims, access_token_expires)
 
     # Rotate refresh token
     new_refresh_token = create_refreshtoken(
-        {"sub": username}, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
+        claims, timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS)
     )
     response.set_cookie(
         key="refresh_token",
@@ -1,17 +1,36 @@
-from fastapi import APIRouter, Depends, HTTPException
-from typing import Annotated
-from models.friends import FriendShipResponse, FriendRequest, FriendsProfile
-from api.auth import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import Annotated, Optional
+from models.friends import (
+    FriendShipResponse,
+    FriendRequest,
+    FriendsProfile,
+    PeopleYouMayKnow,
+)
+from api.auth import get_token_user
 from core.logger import logger
 from db.database import db_connection
+from core.friend_cache import friend_cache
+from core.replicas import read_router
+from core.presence import presence_registry
+from core.pagination import encode_cursor, decode_cursor
+from db.suggestions import (
+    lock_friendship_pair,
+    add_friendship_suggestions,
+    remove_friendship_suggestions,
+    get_suggestions,
+    get_fallback_suggestions,
+)
 
 friends_router = APIRouter(prefix="/friends", tags=["friends"])
 
+# people you may know is paged, and never deeper than this many suggestions
+MAX_SUGGESTIONS = 200
+
 
 @friends_router.post("/send_friend_request", response_model=FriendShipResponse)
 async def send_friend_request(
     friend_request: FriendRequest,
-    current_user: Annotated[dict, Depends(get_current_user)],
+    current_user: Annotated[dict, Depends(get_token_user)],
 ):
     try:
         if current_user["id"] == friend_request.id:
@@ -63,6 +82,7 @@ async def send_friend_request(
                 query=query,
                 values={"user_id": current_user["id"], "friend_id": friend_request.id},
             )
+            await read_router.note_writes([current_user["id"], friend_request.id])
             return FriendShipResponse(**dict(db_res))
         except Exception as e:
             logger.error(f"Failed to Insert {e}", exc_info=True)
@@ -75,7 +95,7 @@ async def send_friend_request(
 
 @friends_router.patch("/accept/{friend_id}")  # note: path parameters must be scalar hai
 async def accept_friendrequest(
-    current_user: Annotated[dict, Depends(get_current_user)], friend_id: int
+    current_user: Annotated[dict, Depends(get_token_user)], friend_id: int
 ):
     try:
         if not current_user or not friend_id:
@@ -91,11 +111,17 @@ async def accept_friendrequest(
                 AND status = 'pending'
                 RETURNING id
                 """
-        res = await db_connection.fetch_one(
-            query=query,
-            values={"user_id": current_user["id"], "friend_id": friend_id},
-        )
+        async with db_connection.transaction():
+            await lock_friendship_pair(current_user["id"], friend_id)
+            res = await db_connection.fetch_one(
+                query=query,
+                values={"user_id": current_user["id"], "friend_id": friend_id},
+            )
+            if res:
+                await add_friendship_suggestions(current_user["id"], friend_id)
         if res:
+            await friend_cache.invalidate(current_user["id"], friend_id)
+            await read_router.note_writes([current_user["id"], friend_id])
             return {"success": True, "message": "Friend Request Accepted"}
         else:
             raise HTTPException(status_code=404, detail="Friend request not found")
@@ -108,7 +134,7 @@ async def accept_friendrequest(
 
 @friends_router.patch("/reject/{friend_id}")  # note: path parameters must be scalar hai
 async def reject_friend_request(
-    current_user: Annotated[dict, Depends(get_current_user)], friend_id: int
+    current_user: Annotated[dict, Depends(get_token_user)], friend_id: int
 ):
     try:
         if not current_user or not friend_id:
@@ -128,6 +154,8 @@ async def reject_friend_request(
             values={"user_id": current_user["id"], "friend_id": friend_id},
         )
         if res:
+            await friend_cache.invalidate(current_user["id"], friend_id)
+            await read_router.note_writes([current_user["id"], friend_id])
             return {"success": True, "message": "Friend Request Rejected"}
         else:
             raise HTTPException(status_code=404, detail="Friend request not found")
@@ -140,7 +168,7 @@ async def reject_friend_request(
 
 @friends_router.patch("/block/{friend_id}")
 async def block_friend(
-    current_user: Annotated[dict, Depends(get_current_user)], friend_id: int
+    current_user: Annotated[dict, Depends(get_token_user)], friend_id: int
 ):
     try:
         query = """
@@ -151,15 +179,21 @@ async def block_friend(
                     AND status='accepted'
                     RETURNING id
                 """
-        response = await db_connection.fetch_one(
-            query=query,
-            values={"user_id": current_user["id"], "friend_id": friend_id},
-        )
+        async with db_connection.transaction():
+            await lock_friendship_pair(current_user["id"], friend_id)
+            response = await db_connection.fetch_one(
+                query=query,
+                values={"user_id": current_user["id"], "friend_id": friend_id},
+            )
+            if response:
+                await remove_friendship_suggestions(current_user["id"], friend_id)
         if not response:
             raise HTTPException(
                 status_code=404, detail="No accepted friendship found to block"
             )
         else:
+            await friend_cache.invalidate(current_user["id"], friend_id)
+            await read_router.note_writes([current_user["id"], friend_id])
             return {"success": True, "message": f"sucessfully blocked"}
     except Exception as e:
         logger.error(f"Error Blocking friend {e}", exc_info=True)
@@ -167,28 +201,10 @@ async def block_friend(
 
 
 @friends_router.get("/allfriends", response_model=list[FriendsProfile])
-async def get_all_friends(current_user: Annotated[dict, Depends(get_current_user)]):
+async def get_all_friends(current_user: Annotated[dict, Depends(get_token_user)]):
     try:
-        query = """
-                    SELECT
-                        u.id,
-                        u.username,
-                        f.status as friendship_status,
-                        f.created_at as friendship_created_at
-                    FROM friendships f 
-                    JOIN users u ON (
-                        CASE 
-                            WHEN f.user_id = :user_id THEN u.id = f.friend_id
-                            ELSE u.id = f.user_id
-                        END
-                    )
-                    WHERE (f.user_id = :user_id OR f.friend_id = :user_id) 
-                    AND f.status = 'accepted'
-                """
-        friends = await db_connection.fetch_all(
-            query=query, values={"user_id": current_user["id"]}
-        )
-        return [FriendsProfile(**friend) for friend in friends]
+        graph = await friend_cache.get(current_user["id"])
+        return [FriendsProfile(**friend) for friend in graph.friends.values()]
 
     except Exception as e:
         logger.error(f"Error fetching friends {e}", exc_info=True)
@@ -197,7 +213,7 @@ async def get_all_friends(current_user: Annotated[dict, Depends(get_current_user
 
 @friends_router.delete("/removefriend/{friend_id}")
 async def remove_friend(
-    current_user: Annotated[dict, Depends(get_current_user)], friend_id: int
+    current_user: Annotated[dict, Depends(get_token_user)], friend_id: int
 ):
     try:
         query = """
@@ -205,15 +221,22 @@ async def remove_friend(
                     WHERE ((user_id =:user_id AND friend_id = :friend_id)
                     OR (user_id = :friend_id AND friend_id = :user_id))
                     AND status IN ('pending','blocked','accepted')
-                    RETURNING id
+                    RETURNING id, status
                 """
-        response = await db_connection.fetch_one(
-            query=query, values={"user_id": current_user["id"], "friend_id": friend_id}
-        )
+        async with db_connection.transaction():
+            await lock_friendship_pair(current_user["id"], friend_id)
+            response = await db_connection.fetch_one(
+                query=query,
+                values={"user_id": current_user["id"], "friend_id": friend_id},
+            )
+            if response and response["status"] == "accepted":
+                await remove_friendship_suggestions(current_user["id"], friend_id)
         if not response:
             logger.error("Error deleting friend", exc_info=True)
             raise HTTPException(status_code=400, detail="Error in removing friend")
         else:
+            await friend_cache.invalidate(current_user["id"], friend_id)
+            await read_router.note_writes([current_user["id"], friend_id])
             return {"success": True, "message": "Friend Removed"}
 
     except Exception as e:
@@ -221,25 +244,57 @@ async def remove_friend(
         raise HTTPException(status_code=500, detail="Failed to Remove friend")
 
 
-@friends_router.get("/peopleyoumayknow", response_model=list[FriendsProfile])
-async def people_you_may_know(current_user: Annotated[dict, Depends(get_current_user)]):
+@friends_router.get("/online")
+async def online_friends(current_user: Annotated[dict, Depends(get_token_user)]):
+    """Ids of the caller's friends that are connected to any backend"""
     try:
-        query = """
-                    SELECT id, username, 'none' as friendship_status, NOW() as friendship_created_at 
-                    FROM users
-                    WHERE id != :user_id
-                    AND id NOT IN (
-                        SELECT friend_id FROM friendships WHERE user_id = :user_id
-                        UNION
-                        SELECT user_id FROM friendships WHERE friend_id = :user_id
-                    )
-                    
-                    
-                """
-        people = await db_connection.fetch_all(
-            query=query, values={"user_id": current_user["id"]}
-        )
-        return [FriendsProfile(**person) for person in people]
+        friend_ids = await friend_cache.friend_ids(current_user["id"])
+        online = await presence_registry.online_users(friend_ids)
+        return {"online": sorted(online)}
+    except Exception as e:
+        logger.error(f"Error fetching online friends {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch online friends")
+
+
+@friends_router.get("/peopleyoumayknow", response_model=list[PeopleYouMayKnow])
+async def people_you_may_know(
+    response: Response,
+    current_user: Annotated[dict, Depends(get_token_user)],
+    limit: int = Query(default=20, gt=0, le=50),
+    cursor: Optional[str] = None,
+):
+    """
+    Users ranked by friends in common. Pass the X-Next-Cursor header back as
+    `cursor` for the next page; at most MAX_SUGGESTIONS are served in total.
+    """
+    user_id = current_user["id"]
+    after = None
+    served = 0
+    if cursor:
+        mutual_count, candidate_id, served = decode_cursor(cursor, 3)
+        try:
+            after = (int(mutual_count), int(candidate_id))
+            served = int(served)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+    limit = min(limit, MAX_SUGGESTIONS - served)
+    if limit <= 0:
+        return []
+
+    try:
+        pool = await read_router.pool_for(user_id)
+        people = await get_suggestions(pool, user_id, limit, after)
+        if len(people) == limit:
+            last = people[-1]
+            response.headers["X-Next-Cursor"] = encode_cursor(
+                last["mutual_count"], last["id"], served + limit
+            )
+        elif not cursor:
+            # too few friends to rank anyone: fill the only page with new users
+            people += await get_fallback_suggestions(
+                pool, user_id, limit - len(people), [person["id"] for person in people]
+            )
+        return [PeopleYouMayKnow(**person) for person in people]
 
     except Exception as e:
         logger.error(f"Something went wrong in fetching people you may know{e}")
@@ -250,7 +305,7 @@ async def people_you_may_know(current_user: Annotated[dict, Depends(get_current_
 
 
 @friends_router.get("/friendrequests", response_model=list[FriendsProfile])
-async def all_friend_requests(current_user: Annotated[dict, Depends(get_current_user)]):
+async def all_friend_requests(current_user: Annotated[dict, Depends(get_token_user)]):
     try:
         query = """
                     SELECT 
@@ -260,13 +315,12 @@ async def all_friend_requests(current_user: Annotated[dict, Depends(get_current_
                         f.created_at as friendship_created_at
                     FROM friendships f
                     JOIN users u ON u.id = f.user_id
-                    WHERE f.friend_id = :user_id
+                    WHERE f.friend_id = $1
                     AND f.status = 'pending'
                     ORDER BY f.created_at DESC
                """
-        friend_requests = await db_connection.fetch_all(
-            query=query, values={"user_id": current_user["id"]}
-        )
+        pool = await read_router.pool_for(current_user["id"])
+        friend_requests = await pool.fetch(query, current_user["id"])
         return [FriendsProfile(**friend_request) for friend_request in friend_requests]
     except Exception as e:
         logger.error(f"Error fetching friend requests {e}", exc_info=True)
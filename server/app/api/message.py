@@ -1,48 +1,231 @@
-from fastapi import APIRouter, Depends, HTTPException
-from api.auth import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from typing import Optional
+from api.auth import get_token_user
 from core.logger import logger
-from models.messages import Message_Response
+from core.config import settings
+from core.pagination import encode_cursor, decode_cursor, decode_time_cursor
+from models.messages import (
+    Message_Response,
+    Message_Read,
+    Message_Sync,
+    Conversation_Sync,
+    Message_Search_Result,
+)
+from core.read_receipts import read_receipts
 from db import db_connection
+from core.replicas import read_router
+from db.inbox import delete_conversation_summaries
 
 message_router = APIRouter(prefix="/messages", tags=["messages"])
 
+MAX_SYNC_CONVERSATIONS = 200
+
 
 @message_router.get(
     "/conversations/{other_user_id}", response_model=list[Message_Response]
 )
 async def get_messages(
     other_user_id: int,
+    response: Response,
     limit: int = 50,
     offset: int = 0,
-    current_user: dict = Depends(get_current_user),
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    current_user: dict = Depends(get_token_user),
 ):
+    """
+    Newest-first page of a conversation.
+
+    Pass the X-Before-Cursor header of a page as `before` to scroll back, or
+    X-After-Cursor as `after` to fetch newer messages. Without a cursor the
+    legacy `offset` paging is used.
+    """
+    if before and after:
+        raise HTTPException(status_code=400, detail="Use either before or after")
+    cursor = decode_time_cursor(before or after) if (before or after) else None
+
+    user_id = current_user["id"]
     try:
-        user_id = current_user["id"]
-        query = """
-                    SELECT id, sender_id, reciever_id, content, created_at, is_read FROM messages
-                    WHERE (sender_id= :user_id AND reciever_id= :other_user_id)
-                    OR ((sender_id= :other_user_id AND reciever_id= :user_id))
-                    ORDER BY created_at DESC
-                    LIMIT :limit OFFSET :offset
-                """
-        messages = await db_connection.fetch_all(
-            query=query,
-            values={
-                "user_id": user_id,
-                "other_user_id": other_user_id,
-                "limit": limit,
-                "offset": offset,
-            },
+        # prepared statements over idx_messages_conversation, see db/pool.py
+        pool = await read_router.pool_for(user_id)
+        messages = await pool.conversation_page(
+            min(user_id, other_user_id),
+            max(user_id, other_user_id),
+            limit,
+            offset=offset,
+            before=cursor if before else None,
+            after=cursor if after else None,
         )
-        return [Message_Response(**message) for message in messages]
     except Exception as e:
         logger.error(f"Error while retrieving messages or conv {e}")
-        HTTPException(status_code=404, detail=f"Error retrieving messages {e}")
+        raise HTTPException(status_code=404, detail=f"Error retrieving messages {e}")
+
+    if after:
+        messages = list(reversed(messages))
+    if messages:
+        newest, oldest = messages[0], messages[-1]
+        response.headers["X-Before-Cursor"] = encode_cursor(
+            oldest["created_at"], oldest["id"]
+        )
+        response.headers["X-After-Cursor"] = encode_cursor(
+            newest["created_at"], newest["id"]
+        )
+    return [Message_Response(**message) for message in messages]
+
+
+@message_router.post("/conversations/{other_user_id}/read")
+async def mark_conversation_read(
+    other_user_id: int,
+    read: Message_Read,
+    current_user: dict = Depends(get_token_user),
+):
+    """Mark messages from other_user_id up to last_read_id as read"""
+    read_receipts.mark_read(current_user["id"], other_user_id, read.last_read_id)
+    return {"success": True}
+
+
+@message_router.get("/search", response_model=list[Message_Search_Result])
+async def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(default=20, gt=0, le=100),
+    cursor: Optional[str] = None,
+    other_user_id: Optional[int] = None,
+    current_user: dict = Depends(get_token_user),
+):
+    """
+    Full-text search over the user's conversations, best match first.
+    Pass the X-Next-Cursor header back as `cursor` for the next page.
+    Messages are searchable once the background indexer has processed them.
+    """
+    user_id = current_user["id"]
+    values = {
+        "user_id": user_id,
+        "q": q,
+        "config": settings.search_text_config,
+        "limit": limit,
+    }
+    scope = "(m.sender_id = :user_id OR m.reciever_id = :user_id)"
+    if other_user_id is not None:
+        scope = """LEAST(m.sender_id, m.reciever_id) = :low_id
+            AND GREATEST(m.sender_id, m.reciever_id) = :high_id"""
+        values["low_id"] = min(user_id, other_user_id)
+        values["high_id"] = max(user_id, other_user_id)
+    page_filter = ""
+    if cursor:
+        rank, row_id = decode_cursor(cursor, 2)
+        try:
+            values["cursor_rank"], values["cursor_id"] = float(rank), int(row_id)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        page_filter = "WHERE (rank, id) < (:cursor_rank, :cursor_id)"
+
+    # headlines are built only for the rows of the page
+    query = f"""
+        WITH query AS (
+            SELECT websearch_to_tsquery(CAST(:config AS regconfig), :q) AS tsq
+        ), ranked AS (
+            SELECT m.id, m.sender_id, m.reciever_id, m.content, m.created_at,
+                   m.is_read, m.seq,
+                   CAST(ts_rank(m.search_vector, query.tsq) AS DOUBLE PRECISION) AS rank
+            FROM messages m, query
+            WHERE m.search_vector @@ query.tsq
+            AND {scope}
+        ), page AS (
+            SELECT * FROM ranked
+            {page_filter}
+            ORDER BY rank DESC, id DESC
+            LIMIT :limit
+        )
+        SELECT page.*,
+               ts_headline(
+                   CAST(:config AS regconfig), page.content, query.tsq,
+                   'StartSel=<mark>, StopSel=</mark>, MaxFragments=2, MaxWords=20'
+               ) AS snippet
+        FROM page, query
+        ORDER BY page.rank DESC, page.id DESC
+    """
+    try:
+        results = await db_connection.fetch_all(query=query, values=values)
+    except Exception as e:
+        logger.error(f"Error searching messages for user {user_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to search messages")
+
+    if len(results) == limit:
+        last = results[-1]
+        response.headers["X-Next-Cursor"] = encode_cursor(last["rank"], last["id"])
+    return [Message_Search_Result(**result) for result in results]
+
+
+@message_router.post("/sync", response_model=dict[int, Conversation_Sync])
+async def sync_messages(
+    sync: Message_Sync, current_user: dict = Depends(get_token_user)
+):
+    """
+    Messages newer than the given seq of each conversation, in seq order.
+    Conversations without new messages are left out; those with has_more set
+    should be synced again from their last_seq.
+    """
+    if len(sync.conversations) > MAX_SYNC_CONVERSATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {MAX_SYNC_CONVERSATIONS} conversations per sync",
+        )
+    if not sync.conversations:
+        return {}
+
+    user_id = current_user["id"]
+    rows = []
+    values = {"user_id": user_id, "limit": sync.limit + 1}
+    for i, (other_user_id, last_seq) in enumerate(sync.conversations.items()):
+        rows.append(
+            f"(CAST(:other_user_id_{i} AS INTEGER), CAST(:last_seq_{i} AS INTEGER))"
+        )
+        values[f"other_user_id_{i}"] = other_user_id
+        values[f"last_seq_{i}"] = last_seq
+    # one query for every conversation; each lateral probe is a range scan
+    # of idx_messages_conversation_seq
+    query = f"""
+        SELECT c.other_user_id, m.id, m.sender_id, m.reciever_id, m.content,
+               m.created_at, m.is_read, m.seq
+        FROM (VALUES {", ".join(rows)}) AS c(other_user_id, last_seq)
+        CROSS JOIN LATERAL (
+            SELECT id, sender_id, reciever_id, content, created_at, is_read, seq
+            FROM messages
+            WHERE LEAST(sender_id, reciever_id) = LEAST(CAST(:user_id AS INTEGER), c.other_user_id)
+            AND GREATEST(sender_id, reciever_id) = GREATEST(CAST(:user_id AS INTEGER), c.other_user_id)
+            AND seq > c.last_seq
+            ORDER BY seq
+            LIMIT :limit
+        ) m
+    """
+    try:
+        messages = await db_connection.fetch_all(query=query, values=values)
+    except Exception as e:
+        logger.error(f"Error syncing messages for user {user_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to sync messages")
+
+    by_conversation = {other_user_id: [] for other_user_id in sync.conversations}
+    for message in messages:
+        by_conversation[message["other_user_id"]].append(message)
+
+    result = {}
+    for other_user_id, conversation in by_conversation.items():
+        has_more = len(conversation) > sync.limit
+        conversation = conversation[: sync.limit]
+        if not conversation and not has_more:
+            continue
+        result[other_user_id] = Conversation_Sync(
+            messages=[Message_Response(**message) for message in conversation],
+            last_seq=conversation[-1]["seq"],
+            has_more=has_more,
+        )
+    return result
 
 
 @message_router.delete("/conversations/{other_user_id}")
 async def delete_conversation(
-    other_user_id: int, current_user: dict = Depends(get_current_user)
+    other_user_id: int, current_user: dict = Depends(get_token_user)
 ):
     try:
         user_id = current_user["id"]
@@ -54,6 +237,8 @@ async def delete_conversation(
         result = await db_connection.execute(
             query=query, values={"user_id": user_id, "other_user_id": other_user_id}
         )
+        await delete_conversation_summaries(user_id, other_user_id)
+        await read_router.note_writes([user_id, other_user_id])
         return {
             "message": "Conversation deleted successfully",
             "deleted_messages": result,
@@ -66,49 +251,13 @@ async def delete_conversation(
 
 @message_router.get("/conversations")
 async def get_conversations(
-    limit: int = 50, offset: int = 0, current_user: dict = Depends(get_current_user)
+    limit: int = 50, offset: int = 0, current_user: dict = Depends(get_token_user)
 ):
     user_id = current_user["id"]
 
     try:
-        query = """
-            WITH last_messages AS (
-                SELECT 
-                    CASE 
-                        WHEN sender_id = :user_id THEN reciever_id
-                        ELSE sender_id
-                    END AS other_user_id,
-                    content AS last_message,
-                    created_at AS last_message_time,
-                    ROW_NUMBER() OVER (
-                        PARTITION BY 
-                            LEAST(sender_id, reciever_id),
-                            GREATEST(sender_id, reciever_id)
-                        ORDER BY created_at DESC
-                    ) AS rn
-                FROM messages
-                WHERE sender_id = :user_id OR reciever_id = :user_id
-            )
-            SELECT
-                lm.other_user_id,
-                lm.last_message,
-                lm.last_message_time,
-                u.username
-            FROM last_messages lm
-            JOIN users u ON u.id = lm.other_user_id
-            WHERE rn = 1
-            ORDER BY last_message_time DESC
-            LIMIT :limit OFFSET :offset;
-        """
-
-        rows = await db_connection.fetch_all(
-            query=query,
-            values={
-                "user_id": user_id,
-                "limit": limit,
-                "offset": offset,
-            },
-        )
+        pool = await read_router.pool_for(user_id)
+        rows = await pool.inbox(user_id, limit, offset)
 
         return [
             {
@@ -116,6 +265,7 @@ async def get_conversations(
                 "username": r["username"],
                 "last_message": r["last_message"],
                 "last_message_time": r["last_message_time"],
+                "unread_count": r["unread_count"],
             }
             for r in rows
         ]
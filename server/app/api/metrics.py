@@ -0,0 +1,157 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from core.metrics import registry
+from core.websocket_engine import manager
+from core.redis_service import redis_service
+from core.message_writer import message_writer
+from core.hashing import password_hasher
+from core.rooms import room_service
+from core.user_cache import user_cache
+from core.friend_cache import friend_cache
+from db.database import db_connection
+from db.pool import pg_pool
+from core.replicas import read_router
+
+metrics_router = APIRouter(tags=["metrics"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _db_pool():
+    # databases does not expose pool stats; read them off the asyncpg pool
+    return getattr(db_connection._backend, "_pool", None)
+
+
+def _db_pool_size():
+    pool = _db_pool()
+    return pool.get_size() if pool else None
+
+
+def _db_pool_in_use():
+    pool = _db_pool()
+    return pool.get_size() - pool.get_idle_size() if pool else None
+
+
+# state owned by other components is read at scrape time, not mirrored
+registry.gauge_callback(
+    "chat_ws_connections",
+    "Open WebSocket connections on this node",
+    lambda: manager.session_count,
+)
+registry.gauge_callback(
+    "chat_ws_users",
+    "Users with at least one connection on this node",
+    lambda: len(manager.active_connections),
+)
+registry.gauge_callback(
+    "chat_ws_queued_frames",
+    "Frames waiting in per-socket send queues",
+    lambda: manager.queued_frames,
+)
+registry.gauge_callback(
+    "chat_ws_frames_sent_total",
+    "Frames written to WebSockets",
+    lambda: manager.frames_sent,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_ws_high_water_total",
+    "Times a socket send queue crossed its high-water mark",
+    lambda: manager.high_water_events,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_ws_evicted_total",
+    "Slow consumers disconnected",
+    lambda: manager.evicted,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_redis_subscribed_channels",
+    "Redis channels this node listens on",
+    lambda: len(redis_service.subscribers),
+)
+registry.gauge_callback(
+    "chat_dispatch_queue_depth",
+    "Inbound Redis messages waiting for a worker",
+    lambda: redis_service.dispatcher.queue_depth,
+)
+registry.gauge_callback(
+    "chat_dispatch_dropped_total",
+    "Inbound Redis messages dropped on overflow",
+    lambda: redis_service.dispatcher.dropped,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_room_fanout_queue_depth",
+    "Room messages waiting to be fanned out",
+    lambda: room_service.fanout.queue_depth,
+)
+registry.gauge_callback(
+    "chat_message_writer_queue_depth",
+    "Messages waiting for the batch writer",
+    lambda: message_writer.queue.qsize() if message_writer.queue else 0,
+)
+registry.gauge_callback(
+    "chat_user_cache_hits_total",
+    "User lookups served from the cache",
+    lambda: user_cache.hits,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_user_cache_misses_total",
+    "User lookups that missed the cache",
+    lambda: user_cache.misses,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_friend_cache_hits_total",
+    "Friend graph lookups served from the cache",
+    lambda: friend_cache.hits,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_friend_cache_misses_total",
+    "Friend graph lookups that missed the cache",
+    lambda: friend_cache.misses,
+    kind="counter",
+)
+registry.gauge_callback(
+    "chat_db_pool_size", "Connections open in the database pool", _db_pool_size
+)
+registry.gauge_callback(
+    "chat_db_pool_in_use", "Database connections checked out", _db_pool_in_use
+)
+registry.gauge_callback(
+    "chat_db_hot_pool_size",
+    "Connections open in the hot-path asyncpg pool",
+    lambda: pg_pool.pool.get_size() if pg_pool.pool else None,
+)
+registry.gauge_callback(
+    "chat_db_hot_pool_in_use",
+    "Hot-path pool connections checked out",
+    lambda: (
+        pg_pool.pool.get_size() - pg_pool.pool.get_idle_size() if pg_pool.pool else None
+    ),
+)
+registry.gauge_callback(
+    "chat_db_replica_lag_seconds",
+    "Last measured replay lag of the read replica",
+    lambda: read_router.lag,
+)
+registry.gauge_callback(
+    "chat_password_hash_pending",
+    "Password hashes in flight",
+    lambda: password_hasher.pending,
+)
+registry.gauge_callback(
+    "chat_password_hash_rejected_total",
+    "Password hashes rejected as saturated",
+    lambda: password_hasher.rejected,
+    kind="counter",
+)
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry.render(), media_type=PROMETHEUS_CONTENT_TYPE)
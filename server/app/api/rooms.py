@@ -0,0 +1,163 @@
+from fastapi import APIRouter, Depends, HTTPException, Response
+from typing import Annotated, Optional
+from asyncpg.exceptions import ForeignKeyViolationError
+from models.rooms import (
+    RoomCreate,
+    RoomResponse,
+    RoomMemberAdd,
+    RoomMessageCreate,
+    RoomMessageResponse,
+)
+from api.auth import get_token_user
+from core.config import settings
+from core.logger import logger
+from core.pagination import encode_cursor, decode_time_cursor
+from core.rooms import room_service
+from db.database import db_connection
+from db.rooms import (
+    create_room,
+    get_room,
+    get_user_rooms,
+    count_room_members,
+    add_room_member,
+    remove_room_member,
+)
+
+rooms_router = APIRouter(prefix="/rooms", tags=["rooms"])
+
+
+async def require_membership(room_id: int, user_id: int):
+    if not await room_service.is_member(room_id, user_id):
+        raise HTTPException(status_code=404, detail="Room not found")
+
+
+@rooms_router.post("", response_model=RoomResponse)
+async def create_new_room(
+    room: RoomCreate, current_user: Annotated[dict, Depends(get_token_user)]
+):
+    if len(set(room.member_ids) | {current_user["id"]}) > settings.room_max_members:
+        raise HTTPException(
+            status_code=400,
+            detail=f"A room can have at most {settings.room_max_members} members",
+        )
+    try:
+        created = await create_room(room.name, current_user["id"], room.member_ids)
+        return RoomResponse(**created)
+    except ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="One of the users does not exist")
+    except Exception as e:
+        logger.error(f"Failed to create room: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to create room")
+
+
+@rooms_router.get("", response_model=list[RoomResponse])
+async def list_rooms(current_user: Annotated[dict, Depends(get_token_user)]):
+    try:
+        return [
+            RoomResponse(**room) for room in await get_user_rooms(current_user["id"])
+        ]
+    except Exception as e:
+        logger.error(f"Failed to fetch rooms: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to fetch rooms")
+
+
+@rooms_router.get("/{room_id}/members")
+async def list_room_members(
+    room_id: int, current_user: Annotated[dict, Depends(get_token_user)]
+):
+    await require_membership(room_id, current_user["id"])
+    return {"member_ids": sorted(await room_service.get_members(room_id))}
+
+
+@rooms_router.post("/{room_id}/members")
+async def add_member(
+    room_id: int,
+    member: RoomMemberAdd,
+    current_user: Annotated[dict, Depends(get_token_user)],
+):
+    await require_membership(room_id, current_user["id"])
+    try:
+        if await count_room_members(room_id) >= settings.room_max_members:
+            raise HTTPException(status_code=400, detail="Room is full")
+        added = await add_room_member(room_id, member.user_id)
+    except HTTPException:
+        raise
+    except ForeignKeyViolationError:
+        raise HTTPException(status_code=404, detail="The user does not exist")
+    except Exception as e:
+        logger.error(f"Failed to add member to room {room_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to add member")
+    if added:
+        await room_service.invalidate(room_id)
+    return {"success": True, "added": added}
+
+
+@rooms_router.delete("/{room_id}/members/{user_id}")
+async def remove_member(
+    room_id: int, user_id: int, current_user: Annotated[dict, Depends(get_token_user)]
+):
+    """Leave a room, or remove someone from a room you own"""
+    room = await get_room(room_id)
+    if not room or not await room_service.is_member(room_id, current_user["id"]):
+        raise HTTPException(status_code=404, detail="Room not found")
+    if user_id != current_user["id"] and room["owner_id"] != current_user["id"]:
+        raise HTTPException(
+            status_code=403, detail="Only the owner can remove other members"
+        )
+    try:
+        removed = await remove_room_member(room_id, user_id)
+    except Exception as e:
+        logger.error(f"Failed to remove member from room {room_id}: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to remove member")
+    if removed:
+        await room_service.invalidate(room_id)
+    return {"success": True, "removed": removed}
+
+
+@rooms_router.post("/{room_id}/messages", response_model=RoomMessageResponse)
+async def send_room_message(
+    room_id: int,
+    message: RoomMessageCreate,
+    current_user: Annotated[dict, Depends(get_token_user)],
+):
+    await require_membership(room_id, current_user["id"])
+    try:
+        return await room_service.send_message(
+            room_id, current_user["id"], message.content
+        )
+    except Exception as e:
+        logger.error(f"Failed to send room message: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail="Failed to send message")
+
+
+@rooms_router.get("/{room_id}/messages", response_model=list[RoomMessageResponse])
+async def get_room_messages(
+    room_id: int,
+    response: Response,
+    current_user: Annotated[dict, Depends(get_token_user)],
+    limit: int = 50,
+    before: Optional[str] = None,
+):
+    """Newest-first page of a room; pass X-Before-Cursor as `before` to scroll back"""
+    await require_membership(room_id, current_user["id"])
+    values = {"room_id": room_id, "limit": limit}
+    query = """
+            SELECT id, room_id, sender_id, content, created_at FROM room_messages
+            WHERE room_id = :room_id
+        """
+    if before:
+        values["cursor_created_at"], values["cursor_id"] = decode_time_cursor(before)
+        query += " AND (created_at, id) < (:cursor_created_at, :cursor_id)"
+    query += " ORDER BY created_at DESC, id DESC LIMIT :limit"
+    try:
+        messages = await db_connection.fetch_all(query=query, values=values)
+    except Exception as e:
+        logger.error(f"Error retrieving messages of room {room_id}: {e}")
+        raise HTTPException(status_code=500, detail="Error retrieving messages")
+
+    if messages:
+        oldest = messages[-1]
+        response.headers["X-Before-Cursor"] = encode_cursor(
+            oldest["created_at"], oldest["id"]
+        )
+    return [RoomMessageResponse(**message) for message in messages]
@@ -1,14 +1,61 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends
-from core.websocket_engine import manager
+from core.websocket_engine import manager, ClientConnection
 import jwt
-from core.config import SECRET_KEY, ALGORITHM
-from db.database import get_user_by_username, db_connection
+from core.config import SECRET_KEY, ALGORITHM, settings
+from api.auth import resolve_user
+from models.users_model import TokenData
 from core.logger import logger
 import asyncio
-from core.redis_service import redis_service
+import math
+import time
+from core.presence import presence_registry
+from core.presence_notifier import presence_notifier
+from core.delivery import deliver_frame, deliver_to_user
+from core.message_writer import message_writer
+from core.read_receipts import read_receipts
+from core.rooms import room_service
+from core.friend_cache import friend_cache
+from core.streams import stream_delivery
+from core.codec import dumps, loads
+from core.metrics import rate_limited, ws_messages_received
+from core.rate_limit import rate_limiter
 
 websocket_router = APIRouter()
 
+PONG_FRAME = dumps({"type": "pong"})
+
+# frames that each cost a database insert and a publish
+RATE_LIMITED_TYPES = ("message", "room_message")
+
+
+async def admit_frame(connection: ClientConnection, user_id: int) -> bool:
+    """Whether a rate limited frame may be handled now; throttling waits here"""
+    wait = await rate_limiter.acquire(user_id)
+    throttled = False
+    if wait and settings.ws_rate_limit_action == "throttle":
+        throttled = True
+        # not reading the socket meanwhile pushes back on the client
+        deadline = time.monotonic() + settings.ws_rate_limit_max_wait_ms / 1000
+        while wait and time.monotonic() + wait <= deadline:
+            await asyncio.sleep(wait)
+            wait = await rate_limiter.acquire(user_id)
+    if wait:
+        rate_limited.inc(1, "rejected")
+        connection.enqueue(
+            {
+                "type": "error",
+                "code": "rate_limited",
+                "content": "Too many messages, slow down",
+                "retry_after_ms": math.ceil(wait * 1000),
+            }
+        )
+        return False
+    if throttled:
+        # only frames that waited and then went through
+        rate_limited.inc(1, "throttled")
+    return True
+
+
 # WebSockets do not use standard HTTP headers for continuous connection.
 # You typically pass the access token as a query parameter (e.g., /ws/connect?token=...) or handle it within the connection logic.
 
@@ -20,9 +67,12 @@ async def websocket_endpoint(websocket: WebSocket):
     logger.info("Websocket connection accepted.")
 
     user_id: int | None = None
+    connection: ClientConnection | None = None
     try:
 
-        auth_message = await asyncio.wait_for(websocket.receive_json(), timeout=10)
+        auth_message = loads(
+            await asyncio.wait_for(websocket.receive_text(), timeout=10)
+        )
         if auth_message.get("type") != "auth":
             logger.error("First message is not a token")
             await websocket.send_json(
@@ -44,6 +94,7 @@ async def websocket_endpoint(websocket: WebSocket):
             #   "sub": "john_doe",
             #   "exp": 1716400000,
             #   "iat": 1716390000,
+            #   "uid": 42,
             #   "role": "admin"
             # }
 
@@ -53,7 +104,9 @@ async def websocket_endpoint(websocket: WebSocket):
                 await websocket.close(code=1008, reason="Invalid token")
                 return
 
-            user = await get_user_by_username(username)
+            user = await resolve_user(
+                TokenData(username=username, user_id=payload.get("uid"))
+            )
             if not user:
                 logger.error(f"Websocket User not found {username}")
                 await websocket.send_json(
@@ -62,16 +115,19 @@ async def websocket_endpoint(websocket: WebSocket):
                 await websocket.close(code=1008, reason="User not found")
                 return
             user_id = user["id"]
-            await manager.connect(user_id, websocket)
-            user_channel = redis_service.get_user_channel(user_id)
-            await redis_service.subscribe_to_channel(
-                user_channel, manager.handle_redis_message
-            )
-            logger.info(f"user {user_id} subscribed to Redis channel: {user_channel}")
+            connection = await manager.connect(user_id, websocket)
+            # further tabs/devices on this node are covered by the first one
+            if len(manager.active_connections[user_id]) == 1:
+                if await presence_registry.register(user_id):
+                    presence_notifier.notify(user_id, "online")
+                logger.info(
+                    f"user {user_id} registered on node {presence_registry.node_id}"
+                )
 
-            await websocket.send_json(
+            connection.enqueue(
                 {
                     "type": "auth_success",
+                    "session_id": connection.session_id,
                     "user": {
                         "id": user["id"],
                         "username": user["username"],
@@ -81,6 +137,17 @@ async def websocket_endpoint(websocket: WebSocket):
             )
             logger.info(f" WebSocket authenticated: {username} (ID: {user_id})")
 
+            # resend what the client missed while it was away
+            last_stream_id = auth_message.get("last_stream_id")
+            if settings.delivery_backend == "streams" and last_stream_id:
+                frames, truncated = await stream_delivery.replay(
+                    user_id, str(last_stream_id)
+                )
+                for frame in frames:
+                    connection.enqueue(frame)
+                if truncated:
+                    connection.enqueue({"type": "replay_truncated"})
+
         except jwt.ExpiredSignatureError:
             logger.warning("WebSocket: Token expired")
             await websocket.send_json({"type": "error", "content": "Token expired"})
@@ -92,39 +159,54 @@ async def websocket_endpoint(websocket: WebSocket):
             await websocket.close(code=1008, reason="Invalid token")
             return
 
+        rejected_in_row = 0
         while True:
-            data = await websocket.receive_json()
+            data = loads(await websocket.receive_text())
+
+            if (
+                settings.ws_rate_limit_enabled
+                and data.get("type") in RATE_LIMITED_TYPES
+            ):
+                if await admit_frame(connection, user_id):
+                    rejected_in_row = 0
+                else:
+                    rejected_in_row += 1
+                    if rejected_in_row == settings.ws_rate_limit_disconnect_after:
+                        rate_limited.inc(1, "disconnected")
+                        logger.warning(f"Closing flooding connection of user {user_id}")
+                        await connection.close(
+                            settings.ws_rate_limit_close_code, "Rate limit exceeded"
+                        )
+                        raise WebSocketDisconnect(settings.ws_rate_limit_close_code)
+                    continue
 
             if data.get("type") == "ping":
-                await websocket.send_json({"type": "pong"})
+                connection.enqueue(PONG_FRAME)
                 logger.debug(f"Ping from user {user_id}")
             elif data.get("type") == "message":
+                ws_messages_received.inc()
                 content = data.get("content")
                 reciever_id = data.get("reciever_id")
                 logger.info(f"message from user {user_id} to {reciever_id}")
 
                 if not content or not reciever_id:
-                    await websocket.send_json(
+                    connection.enqueue(
                         {"type": "error", "content": "Missing content or reciever_id"}
                     )
                     continue
 
+                denied = await friend_cache.message_denied(user_id, reciever_id)
+                if denied:
+                    connection.enqueue({"type": "error", "content": denied})
+                    continue
+
                 try:
-                    query = """INSERT INTO messages (sender_id,reciever_id,content,created_at,is_read)
-                                VALUES (:sender_id,:reciever_id,:content,NOW(),FALSE)
-                                RETURNING id,sender_id,reciever_id,content,created_at,is_read"""
-
-                    saved_message = await db_connection.fetch_one(
-                        query=query,
-                        values={
-                            "sender_id": user_id,
-                            "reciever_id": reciever_id,
-                            "content": content,
-                        },
+                    saved_message = await message_writer.submit(
+                        user_id, reciever_id, content
                     )
                 except Exception as e:
                     logger.error(f"Error saving message: {e}", exc_info=True)
-                    await websocket.send_json(
+                    connection.enqueue(
                         {"type": "error", "content": "Failed to save message"}
                     )
                     continue
@@ -136,34 +218,63 @@ async def websocket_endpoint(websocket: WebSocket):
                     "content": saved_message["content"],
                     "created_at": saved_message["created_at"].isoformat(),
                     "is_read": saved_message["is_read"],
+                    "seq": saved_message["seq"],
                 }
 
-                local_delivered = await manager.send_private_message(
-                    reciever_id, message_data
-                )
-                reciever_channel = redis_service.get_user_channel(reciever_id)
-                redis_published = await redis_service.publish_message(
-                    reciever_channel,
-                    {"type": "new_message", "user_id": reciever_id, **message_data},
-                )
-                delivery_status = (
-                    "delivered"
-                    if local_delivered
-                    else ("published" if redis_published else "failed")
-                )
-                if local_delivered:
-                    logger.info("message delivered locally")
-                elif redis_published:
-                    logger.info(f"message published to redis for user {reciever_id}")
-                else:
-                    logger.info("message delivery failed")
-                await websocket.send_json(
-                    {
-                        "type": "message_sent",
-                        "delivered": delivery_status,
-                        **message_data,
-                    }
+                delivery_status = await deliver_to_user(reciever_id, message_data)
+                logger.info(f"message to user {reciever_id}: {delivery_status}")
+                # one frame acks this session and echoes to the sender's other devices
+                await deliver_frame(
+                    user_id,
+                    dumps(
+                        {
+                            "type": "message_sent",
+                            "delivered": delivery_status,
+                            "session_id": connection.session_id,
+                            **message_data,
+                        }
+                    ),
                 )
+            elif data.get("type") == "room_message":
+                ws_messages_received.inc()
+                room_id = data.get("room_id")
+                content = data.get("content")
+                if not content or not isinstance(room_id, int):
+                    connection.enqueue(
+                        {"type": "error", "content": "Missing content or room_id"}
+                    )
+                    continue
+                try:
+                    if not await room_service.is_member(room_id, user_id):
+                        connection.enqueue(
+                            {"type": "error", "content": "Not a member of this room"}
+                        )
+                        continue
+                    # fan-out runs in the background; only the insert is awaited
+                    saved_message = await room_service.send_message(
+                        room_id, user_id, content
+                    )
+                except Exception as e:
+                    logger.error(f"Error saving room message: {e}", exc_info=True)
+                    connection.enqueue(
+                        {"type": "error", "content": "Failed to save message"}
+                    )
+                    continue
+                connection.enqueue({"type": "room_message_sent", **saved_message})
+            elif data.get("type") == "mark_read":
+                other_user_id = data.get("other_user_id")
+                last_read_id = data.get("last_read_id")
+                if not isinstance(other_user_id, int) or not isinstance(
+                    last_read_id, int
+                ):
+                    connection.enqueue(
+                        {
+                            "type": "error",
+                            "content": "Missing other_user_id or last_read_id",
+                        }
+                    )
+                    continue
+                read_receipts.mark_read(user_id, other_user_id, last_read_id)
             else:
                 logger.warning(f"Unknown message type {data.get('type')}")
     except asyncio.TimeoutError:
@@ -174,19 +285,19 @@ async def websocket_endpoint(websocket: WebSocket):
         await websocket.close(code=1008, reason="Authentication timeout")
 
     except WebSocketDisconnect:
-        if user_id:
-            user_channel = redis_service.get_user_channel(user_id)
-            await redis_service.unsubscribe_from_channel(user_channel)
-            await manager.disconnect(user_id)
+        if connection:
+            if await manager.disconnect(user_id, connection.session_id):
+                if await presence_registry.unregister(user_id):
+                    presence_notifier.notify(user_id, "offline")
             logger.info(f"websocket disconnected by user {user_id}")
         else:
             logger.info("WebSocket disconnected before authentication")
     except Exception as e:
         logger.error(f"WebSocket error: {e}", exc_info=True)
-        if user_id:
-            user_channel = redis_service.get_user_channel(user_id)
-            await redis_service.unsubscribe_from_channel(user_channel)
-            await manager.disconnect(user_id)
+        if connection:
+            if await manager.disconnect(user_id, connection.session_id):
+                if await presence_registry.unregister(user_id):
+                    presence_notifier.notify(user_id, "offline")
         try:
             await websocket.close(code=1011, reason="Internal error")
         except:
@@ -0,0 +1,71 @@
+"""
+JSON codec and the node-to-node delivery envelope.
+
+Frames are serialized exactly once, by whichever node first produces them.
+The envelope keeps the routing metadata in a small header line, ahead of the
+pre-serialized frames, so a receiving node parses only the header and writes
+the frame text to the socket untouched.
+
+Envelope layout (newline separated; compact JSON never contains a raw newline):
+
+    {"u": [[recipient ids of frame 1], [recipient ids of frame 2], ...]}
+    <frame 1>
+    <frame 2>
+"""
+
+import json
+from datetime import datetime
+from typing import Any, List, Sequence, Tuple, Union
+
+from core.config import settings
+from core.logger import logger
+
+try:
+    import orjson
+except ImportError:  # optional fast codec
+    orjson = None
+
+
+def _default(value: Any):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if settings.json_codec == "orjson" and orjson is None:
+    logger.warning("json_codec is 'orjson' but orjson is not installed, using json")
+
+if settings.json_codec != "json" and orjson is not None:
+    CODEC = "orjson"
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_default).decode("utf-8")
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+else:
+    CODEC = "json"
+
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, separators=(",", ":"), default=_default)
+
+    def loads(data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+def encode_envelope(deliveries: Sequence[Tuple[Sequence[int], str]]) -> str:
+    """Pack (recipient ids, frame) pairs into one publishable string"""
+    header = dumps({"u": [list(user_ids) for user_ids, _ in deliveries]})
+    return "\n".join([header, *(frame for _, frame in deliveries)])
+
+
+def decode_envelope(data: Union[str, bytes]) -> List[Tuple[List[int], str]]:
+    """Split an envelope back into (recipient ids, frame) pairs"""
+    if isinstance(data, bytes):
+        data = data.decode("utf-8")
+    header, *frames = data.split("\n")
+    recipients = loads(header)["u"]
+    if len(recipients) != len(frames):
+        raise ValueError("Envelope header does not match its frames")
+    return list(zip(recipients, frames))
@@ -1,9 +1,11 @@
 from dotenv import load_dotenv
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from pydantic import Field
+from typing import Literal
 
 load_dotenv()
 import os
+import socket
 
 # SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
 # ALGORITHM = "HS256"
@@ -47,6 +49,227 @@ class Settings(BaseSettings):
     redis_port: int = Field(default=6379, description="redis port")
     redis_db: int = Field(default=1, description="redis db name")
 
+    # cluster routing
+    node_id: str = Field(
+        default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}",
+        description="unique id of this backend node, used for its inbound channel; "
+        "must be set, and kept across restarts, with the streams backend",
+    )
+    presence_ttl_seconds: int = Field(
+        default=60, description="how long a presence entry lives without a refresh"
+    )
+    presence_refresh_seconds: int = Field(
+        default=20, description="interval between presence heartbeats"
+    )
+    presence_notify_window_ms: int = Field(
+        default=500, description="window over which presence changes are coalesced"
+    )
+
+    # redis listener dispatch
+    dispatch_workers: int = Field(
+        default=16, description="worker tasks delivering pub/sub messages"
+    )
+    dispatch_queue_size: int = Field(
+        default=1000, description="max queued messages per dispatch worker"
+    )
+    dispatch_overflow_policy: Literal["drop_newest", "drop_oldest"] = Field(
+        default="drop_oldest", description="what to drop when a worker queue is full"
+    )
+
+    # delivery backend
+    delivery_backend: Literal["pubsub", "streams"] = Field(
+        default="pubsub",
+        description="pubsub is fire-and-forget; streams keeps a replayable log per user",
+    )
+    user_stream_maxlen: int = Field(
+        default=1000, description="frames retained per user for replay"
+    )
+    user_stream_ttl_seconds: int = Field(
+        default=604800, description="how long the stream of an inactive user is kept"
+    )
+    node_stream_maxlen: int = Field(
+        default=100000, description="envelopes retained in a node's inbound stream"
+    )
+    node_stream_ttl_seconds: int = Field(
+        default=3600, description="how long the stream of a dead node is kept"
+    )
+    stream_read_count: int = Field(
+        default=100, description="entries read per XREADGROUP call"
+    )
+    stream_replay_max: int = Field(
+        default=500, description="max frames replayed to a reconnecting client"
+    )
+    stream_claim_idle_ms: int = Field(
+        default=60000,
+        description="pending entries idle this long are claimed from other consumers",
+    )
+
+    json_codec: Literal["auto", "orjson", "json"] = Field(
+        default="auto", description="JSON codec for frames; auto prefers orjson"
+    )
+
+    # per-connection outbound queues
+    ws_send_queue_size: int = Field(
+        default=256, description="max frames queued per socket before eviction"
+    )
+    ws_send_queue_high_water: int = Field(
+        default=64, description="queue depth at which a socket is reported as slow"
+    )
+    ws_slow_consumer_close_code: int = Field(
+        default=4008, description="close code sent to evicted slow consumers"
+    )
+
+    # websocket flood control
+    ws_rate_limit_enabled: bool = Field(
+        default=True, description="rate limit message and room_message frames"
+    )
+    ws_message_rate: float = Field(
+        default=10.0, description="messages per second a user may send on average"
+    )
+    ws_message_burst: int = Field(
+        default=20, description="messages a user may send at once after being idle"
+    )
+    ws_rate_limit_backend: Literal["local", "redis"] = Field(
+        default="local", description="per-node buckets, or one shared bucket in redis"
+    )
+    ws_rate_limit_action: Literal["reject", "throttle"] = Field(
+        default="reject",
+        description="answer frames over the limit with an error, or delay them",
+    )
+    ws_rate_limit_max_wait_ms: int = Field(
+        default=2000,
+        description="longest a throttled frame is delayed before rejection",
+    )
+    ws_rate_limit_disconnect_after: int = Field(
+        default=50, description="consecutive rejected frames before closing; 0 never"
+    )
+    ws_rate_limit_close_code: int = Field(
+        default=4029, description="close code sent to clients that keep flooding"
+    )
+
+    # raw asyncpg pool for the hot paths (db/pool.py), next to the databases pool
+    db_pool_min_size: int = Field(
+        default=2, description="connections kept open in the hot-path pool"
+    )
+    db_pool_max_size: int = Field(
+        default=10, description="max connections of the hot-path pool"
+    )
+
+    # read replica (same credentials and database name as the primary)
+    replica_host: str = Field(
+        default="",
+        description="streaming replica for read-only queries; empty disables",
+    )
+    replica_port: int = Field(default=5432, description="replica port")
+    replica_max_lag_ms: int = Field(
+        default=2000, description="reads fall back to the primary above this lag"
+    )
+    replica_lag_check_interval_ms: int = Field(
+        default=1000, description="how often replica lag is measured"
+    )
+    replica_max_receipt_age_ms: int = Field(
+        default=60000,
+        description="replica is unusable if its WAL receiver heard nothing for this long",
+    )
+    read_your_writes_ms: int = Field(
+        default=5000,
+        description="how long a user's reads stay on the primary after a write",
+    )
+
+    # message persistence (group commit)
+    message_batch_max_size: int = Field(
+        default=256, description="max messages written by one INSERT"
+    )
+    message_batch_max_delay_ms: int = Field(
+        default=5, description="how long a batch waits for more messages"
+    )
+    message_writer_workers: int = Field(
+        default=2, description="concurrent batch writers sharing the db pool"
+    )
+    read_receipt_window_ms: int = Field(
+        default=250, description="window over which read marks are coalesced"
+    )
+
+    # user cache
+    user_cache_size: int = Field(default=10000, description="max users cached per node")
+    user_cache_ttl_seconds: int = Field(
+        default=300, description="in-process user cache ttl"
+    )
+    user_cache_redis: bool = Field(
+        default=False, description="share cached users between nodes through redis"
+    )
+    user_cache_redis_ttl_seconds: int = Field(
+        default=3600, description="ttl of users cached in redis"
+    )
+
+    # friend graph cache
+    friend_cache_size: int = Field(
+        default=10000, description="max users whose friends are cached per node"
+    )
+    friend_cache_ttl_seconds: int = Field(
+        default=300, description="in-process friend cache ttl"
+    )
+    require_friendship_for_messages: bool = Field(
+        default=False, description="only accepted friends may message each other"
+    )
+
+    # password hashing
+    password_hash_executor: Literal["thread", "process"] = Field(
+        default="thread", description="pool type running argon2"
+    )
+    password_hash_workers: int = Field(
+        default=4, description="concurrent argon2 operations"
+    )
+    password_hash_max_pending: int = Field(
+        default=64, description="in-flight hashes before requests get a 503"
+    )
+
+    # rooms
+    room_max_members: int = Field(default=5000, description="members allowed per room")
+    room_member_cache_ttl_seconds: int = Field(
+        default=60, description="how long a room's member list is cached per node"
+    )
+    room_fanout_workers: int = Field(
+        default=4, description="tasks fanning room messages out to members"
+    )
+
+    # message search
+    search_text_config: str = Field(
+        default="english", description="postgres text search configuration"
+    )
+    search_index_batch_size: int = Field(
+        default=500, description="messages indexed per UPDATE"
+    )
+    search_index_interval_ms: int = Field(
+        default=1000, description="max delay before new messages are indexed"
+    )
+
+    # schema
+    auto_migrate: bool = Field(
+        default=False,
+        description="apply pending migrations on startup instead of refusing to start",
+    )
+
+    # message partitions and retention
+    message_partitions_ahead: int = Field(
+        default=3, description="monthly message partitions created in advance"
+    )
+    message_retention_months: int = Field(
+        default=0, description="full months of messages kept; 0 keeps everything"
+    )
+    message_retention_action: Literal["detach", "drop"] = Field(
+        default="detach",
+        description="detach expired partitions for archival, or drop them",
+    )
+    partition_maintenance_interval_seconds: int = Field(
+        default=3600, description="how often partitions and retention are checked"
+    )
+
+    # metrics
+    metrics_enabled: bool = Field(
+        default=True, description="serve prometheus metrics on /metrics"
+    )
+
 
 settings = Settings()
 
@@ -0,0 +1,76 @@
+"""
+Routing of outbound chat messages to the node(s) holding the recipient.
+
+A frame is serialized once here; local sockets get that string and remote
+nodes get it inside a delivery envelope, which they forward without decoding.
+With the streams backend the frame is first logged to the user's stream, and
+envelopes go to the nodes' inbound streams instead of their channels.
+"""
+
+from core.codec import dumps, encode_envelope
+from core.config import settings
+from core.logger import logger
+from core.metrics import messages_delivered
+from core.presence import presence_registry
+from core.redis_service import redis_service
+from core.streams import stream_delivery, splice_stream_id
+from core.websocket_engine import manager
+
+
+async def deliver_frame(user_id: int, frame: str) -> str:
+    """
+    Deliver a serialized frame to a user wherever they are connected.
+
+    Local sockets are written directly; every other node that holds the user
+    gets one publish on its inbound channel. Returns "delivered", "published",
+    "offline" or "failed".
+    """
+    status = await _route_frame(user_id, frame)
+    messages_delivered.inc(1, status)
+    return status
+
+
+async def _route_frame(user_id: int, frame: str) -> str:
+    use_streams = settings.delivery_backend == "streams"
+    if use_streams:
+        stream_id = await stream_delivery.append(user_id, frame)
+        if stream_id:
+            frame = splice_stream_id(frame, stream_id)
+
+    local_delivered = False
+    if manager.is_user_online(user_id):
+        local_delivered = manager.send_frame(user_id, frame)
+
+    remote_nodes = await presence_registry.lookup(user_id)
+    remote_nodes.discard(presence_registry.node_id)
+
+    published = False
+    if remote_nodes:
+        envelope = encode_envelope([([user_id], frame)])
+        for node_id in remote_nodes:
+            if use_streams:
+                sent = await stream_delivery.publish(node_id, envelope)
+            else:
+                sent = await redis_service.publish_message(
+                    presence_registry.get_node_channel(node_id), envelope
+                )
+            published = published or sent
+
+    if local_delivered:
+        return "delivered"
+    if published:
+        return "published"
+    if not remote_nodes:
+        logger.debug(f"User {user_id} is not connected to any node")
+        return "offline"
+    return "failed"
+
+
+async def deliver_to_user(user_id: int, msg: dict) -> str:
+    """Deliver a chat message as a new_message frame"""
+    return await deliver_frame(user_id, dumps({"type": "new_message", **msg}))
+
+
+async def deliver_event(user_id: int, payload: dict) -> str:
+    """Deliver an arbitrary frame (e.g. a read receipt) the same way as a message"""
+    return await deliver_frame(user_id, dumps(payload))
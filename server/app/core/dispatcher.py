@@ -0,0 +1,90 @@
+"""
+Keyed fan-out of incoming pub/sub messages to a pool of worker tasks.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, List, Optional
+
+from core.logger import logger
+
+Handler = Callable[[Any], Awaitable[Any]]
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest")
+
+
+class KeyedDispatcher:
+    """
+    Messages with the same key always land on the same worker, so delivery
+    order per recipient is preserved while different recipients are handled
+    in parallel. Each worker owns a bounded queue; when it is full the
+    overflow policy decides whether the incoming or the oldest message is dropped.
+    """
+
+    def __init__(self, workers: int, queue_size: int, overflow_policy: str):
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy: {overflow_policy}")
+        self.worker_count = max(1, workers)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.queues: List[asyncio.Queue] = []
+        self.tasks: List[asyncio.Task] = []
+        self.dropped: int = 0
+
+    @property
+    def is_running(self) -> bool:
+        return bool(self.tasks)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(queue.qsize() for queue in self.queues)
+
+    def start(self):
+        if self.is_running:
+            return
+        self.queues = [
+            asyncio.Queue(maxsize=self.queue_size) for _ in range(self.worker_count)
+        ]
+        self.tasks = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+        logger.info(
+            f"Dispatcher started with {self.worker_count} workers "
+            f"(queue size {self.queue_size}, policy {self.overflow_policy})"
+        )
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        self.queues = []
+
+    def submit(self, key: Optional[Hashable], handler: Handler, payload: Any) -> bool:
+        """Queue a message for its key's worker. Returns False if it was dropped."""
+        if not self.is_running:
+            self.start()
+        queue = self.queues[hash(key) % self.worker_count]
+        try:
+            queue.put_nowait((handler, payload))
+            return True
+        except asyncio.QueueFull:
+            pass
+
+        self.dropped += 1
+        if self.overflow_policy == "drop_newest":
+            logger.warning(f"Dispatcher queue full, dropped message for key {key}")
+            return False
+
+        queue.get_nowait()
+        queue.task_done()
+        queue.put_nowait((handler, payload))
+        logger.warning(f"Dispatcher queue full, dropped oldest message for key {key}")
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            handler, payload = await queue.get()
+            try:
+                await handler(payload)
+            except Exception as e:
+                logger.error(f"Error handling message: {e}", exc_info=True)
+            finally:
+                queue.task_done()
@@ -0,0 +1,140 @@
+"""
+Cached friend graph, used for the friends list, presence fan-out and the
+per-message block/friendship check.
+
+Each user's accepted friends and blocked relations are kept in an in-process
+TTL + LRU cache. Friendship changes must go through `invalidate` for both
+users, which evicts them on every node via pub/sub. Blocks are stored without
+a direction, so either side of a blocked pair can no longer message the other.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from core.config import settings
+from core.redis_service import redis_service
+from db.friends import get_relations
+
+FRIEND_INVALIDATION_CHANNEL = "friends:invalidate"
+
+
+class FriendGraph:
+    __slots__ = ("friends", "blocked")
+
+    def __init__(self, relations: List[dict]):
+        # friend id -> {id, username, friendship_status, friendship_created_at}
+        self.friends: Dict[int, dict] = {}
+        blocked = set()
+        for relation in relations:
+            if relation["status"] == "blocked":
+                blocked.add(relation["id"])
+            else:
+                self.friends[relation["id"]] = {
+                    "id": relation["id"],
+                    "username": relation["username"],
+                    "friendship_status": relation["status"],
+                    "friendship_created_at": relation["created_at"],
+                }
+        self.blocked: FrozenSet[int] = frozenset(blocked)
+
+
+class FriendCache:
+    def __init__(self, max_size: int, ttl: int, require_friendship: bool):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.require_friendship = require_friendship
+        self.entries: "OrderedDict[int, Tuple[float, FriendGraph]]" = OrderedDict()
+        # user id -> claim of the latest load in flight; invalidate drops it,
+        # so a load that read the graph before a change is not cached
+        self.loading: Dict[int, object] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_local(self, user_id: int) -> Optional[FriendGraph]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, graph = entry
+        if expires_at < time.monotonic():
+            self.entries.pop(user_id, None)
+            return None
+        self.entries.move_to_end(user_id)
+        return graph
+
+    def put(self, user_id: int, graph: FriendGraph):
+        self.entries[user_id] = (time.monotonic() + self.ttl, graph)
+        self.entries.move_to_end(user_id)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    async def get_many(self, user_ids: Iterable[int]) -> Dict[int, FriendGraph]:
+        """Graphs of several users, loading every miss in one query"""
+        graphs: Dict[int, FriendGraph] = {}
+        missing = []
+        for user_id in set(user_ids):
+            graph = self.get_local(user_id)
+            if graph is None:
+                missing.append(user_id)
+            else:
+                graphs[user_id] = graph
+        self.hits += len(graphs)
+        self.misses += len(missing)
+        if missing:
+            claims = {user_id: object() for user_id in missing}
+            self.loading.update(claims)
+            try:
+                relations_by_user = await get_relations(missing)
+            finally:
+                for user_id, claim in claims.items():
+                    if self.loading.get(user_id) is claim:
+                        del self.loading[user_id]
+                    else:
+                        claims[user_id] = None
+            for user_id, relations in relations_by_user.items():
+                graphs[user_id] = FriendGraph(relations)
+                if claims[user_id] is not None:
+                    self.put(user_id, graphs[user_id])
+        return graphs
+
+    async def get(self, user_id: int) -> FriendGraph:
+        return (await self.get_many([user_id]))[user_id]
+
+    async def friend_ids(self, user_id: int) -> FrozenSet[int]:
+        return frozenset((await self.get(user_id)).friends)
+
+    async def message_denied(self, sender_id: int, reciever_id: int) -> Optional[str]:
+        """Why sender may not message reciever, or None if allowed"""
+        if sender_id == reciever_id:
+            return None
+        # only the sender's graph is needed: blocks are recorded on both sides
+        graph = await self.get(sender_id)
+        if reciever_id in graph.blocked:
+            return "You cannot message this user"
+        if self.require_friendship and reciever_id not in graph.friends:
+            return "You can only message your friends"
+        return None
+
+    async def invalidate(self, *user_ids: int):
+        """Evict users on every node; call after changing their friendships"""
+        for user_id in user_ids:
+            self.entries.pop(user_id, None)
+            self.loading.pop(user_id, None)
+        if not redis_service.is_connected or not redis_service.redis_client:
+            return
+        await redis_service.publish_message(
+            FRIEND_INVALIDATION_CHANNEL,
+            {"type": "friends_invalidated", "user_ids": list(user_ids)},
+        )
+
+    async def handle_invalidation(self, message_data: dict):
+        for user_id in message_data.get("user_ids", ()):
+            self.entries.pop(user_id, None)
+            self.loading.pop(user_id, None)
+
+
+friend_cache = FriendCache(
+    max_size=settings.friend_cache_size,
+    ttl=settings.friend_cache_ttl_seconds,
+    require_friendship=settings.require_friendship_for_messages,
+)
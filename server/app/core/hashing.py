@@ -0,0 +1,90 @@
+"""
+Argon2 password hashing off the event loop.
+
+Hashing and verification run on a bounded thread or process pool. When more
+than `max_pending` operations are in flight the request fails fast with a 503,
+so a login storm queues up here instead of stalling every WebSocket.
+"""
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+from pwdlib import PasswordHash
+from starlette import status
+
+from core.config import settings
+from core.logger import logger
+
+password_hash = PasswordHash.recommended()
+
+
+# module level so they can be pickled into a process pool
+def _hash(password: str) -> str:
+    return password_hash.hash(password)
+
+
+def _verify(plain_pw: str, hashed_pw: str) -> bool:
+    return password_hash.verify(plain_pw, hashed_pw)
+
+
+class PasswordHasherPool:
+    def __init__(self, kind: str, workers: int, max_pending: int):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.executor: Optional[Executor] = None
+        self.pending: int = 0
+        self.completed: int = 0
+        self.rejected: int = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Operations waiting for a free worker"""
+        return max(0, self.pending - self.workers)
+
+    def _get_executor(self) -> Executor:
+        if self.executor is None:
+            if self.kind == "process":
+                self.executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self.executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="argon2"
+                )
+        return self.executor
+
+    async def run(self, fn: Callable, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            logger.warning(f"Password hashing saturated ({self.pending} pending)")
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, please retry",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+
+    async def hash(self, password: str) -> str:
+        return await self.run(_hash, password)
+
+    async def verify(self, plain_pw: str, hashed_pw: str) -> bool:
+        return await self.run(_verify, plain_pw, hashed_pw)
+
+    def shutdown(self):
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+password_hasher = PasswordHasherPool(
+    kind=settings.password_hash_executor,
+    workers=settings.password_hash_workers,
+    max_pending=settings.password_hash_max_pending,
+)
@@ -0,0 +1,97 @@
+"""
+Upkeep of the monthly messages partitions.
+
+migrate.py creates the first partitions; each node then runs this in the
+background, on startup and periodically, and an advisory lock lets only one
+of them do the work at a time. It creates the partitions of the
+next MESSAGE_PARTITIONS_AHEAD months and, with MESSAGE_RETENTION_MONTHS set,
+detaches or drops the partitions that fell out of the retention window.
+"""
+
+import asyncio
+from datetime import date
+from typing import Optional
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import partitions_created, partitions_expired
+from db.database import db_connection
+from db.partitions import (
+    ensure_message_partitions,
+    expire_message_partitions,
+    messages_partitioned,
+)
+
+# (namespace, key) of the advisory lock; the two-key form never collides
+# with the per-user locks taken through pg_advisory_xact_lock(bigint)
+MAINTENANCE_LOCK = (1, 21)
+
+
+class PartitionMaintainer:
+    def __init__(
+        self, months_ahead: int, retention_months: int, action: str, interval: int
+    ):
+        self.months_ahead = months_ahead
+        self.retention_months = retention_months
+        self.action = action
+        self.interval = interval
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def run_once(self, today: Optional[date] = None, wait: bool = False):
+        """
+        Create upcoming partitions and apply retention. Unless wait is set, a
+        run is skipped while another node holds the maintenance lock; startup
+        waits, so this month's partition exists before the first insert.
+        """
+        today = today or date.today()
+        if not await messages_partitioned():
+            logger.warning(
+                "messages is not partitioned yet; run migrate.py to convert it"
+            )
+            return
+        async with db_connection.transaction():
+            lock_values = dict(zip(("namespace", "key"), MAINTENANCE_LOCK))
+            if wait:
+                await db_connection.execute(
+                    query="SELECT pg_advisory_xact_lock(:namespace, :key)",
+                    values=lock_values,
+                )
+            elif not await db_connection.fetch_val(
+                query="SELECT pg_try_advisory_xact_lock(:namespace, :key)",
+                values=lock_values,
+            ):
+                return
+            partitions_created.inc(
+                await ensure_message_partitions(today, self.months_ahead)
+            )
+            if self.retention_months > 0:
+                expired = await expire_message_partitions(
+                    today, self.retention_months, self.action
+                )
+                partitions_expired.inc(len(expired))
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Partition maintenance failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+
+partition_maintainer = PartitionMaintainer(
+    months_ahead=settings.message_partitions_ahead,
+    retention_months=settings.message_retention_months,
+    action=settings.message_retention_action,
+    interval=settings.partition_maintenance_interval_seconds,
+)
@@ -0,0 +1,146 @@
+"""
+Group-commit persistence for chat messages.
+
+Messages from every socket are collected for a few milliseconds and written
+with one prepared INSERT over arrays; each sender awaits a future that resolves to its
+saved row. Per-conversation sequence numbers are reserved in the same
+transaction, and the inbox summaries are updated in it too.
+"""
+
+import asyncio
+from typing import List, Optional, Tuple
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import db_insert_latency, db_insert_batch_size
+from core.replicas import read_router
+from core.search_indexer import search_indexer
+from db.inbox import update_conversation_summaries
+from db.pool import pg_pool, INSERT_MESSAGES
+from db.sequences import reserve_seqs
+
+PendingMessage = Tuple[Tuple[int, int, str], asyncio.Future]
+
+# queued once per worker by stop(); a worker flushes what it holds and exits
+_STOP = None
+
+
+class MessageBatchWriter:
+    def __init__(self, max_batch: int, max_delay_ms: int, workers: int):
+        self.max_batch = max_batch
+        self.max_delay = max_delay_ms / 1000
+        self.worker_count = max(1, workers)
+        self.queue: Optional[asyncio.Queue] = None
+        self.tasks: List[asyncio.Task] = []
+
+    def start(self):
+        if self.tasks:
+            return
+        self.queue = asyncio.Queue()
+        self.tasks = [
+            asyncio.create_task(self._run()) for _ in range(self.worker_count)
+        ]
+        logger.info(
+            f"Message writer started ({self.worker_count} workers, "
+            f"batch {self.max_batch}, delay {self.max_delay * 1000:.0f}ms)"
+        )
+
+    async def stop(self):
+        if not self.tasks:
+            return
+        for _ in self.tasks:
+            self.queue.put_nowait(_STOP)
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        # flush whatever was submitted after the stop markers
+        remaining: List[PendingMessage] = []
+        while self.queue and not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        if remaining:
+            await self._flush(remaining)
+
+    async def submit(self, sender_id: int, reciever_id: int, content: str):
+        """Queue a message for the next batch and wait for its saved row"""
+        if not self.tasks:
+            self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait(((sender_id, reciever_id, content), future))
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            entry = await self.queue.get()
+            if entry is _STOP:
+                return
+            batch = [entry]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    entry = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if entry is _STOP:
+                    stopping = True
+                    break
+                batch.append(entry)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[PendingMessage]):
+        try:
+            rows = await self._insert([values for values, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                _, future = batch[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+            # one bad row (e.g. unknown reciever_id) must not fail the others
+            logger.warning(
+                f"Batch insert of {len(batch)} messages failed, retrying one by one: {e}"
+            )
+            for entry in batch:
+                await self._flush([entry])
+            return
+
+        # before anyone is acked, so their next history read sees the message
+        await read_router.note_writes(
+            user_id
+            for row in rows
+            for user_id in (row["sender_id"], row["reciever_id"])
+        )
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(row)
+        search_indexer.wake()
+
+    async def _insert(self, messages: List[Tuple[int, int, str]]):
+        db_insert_batch_size.observe(len(messages))
+        with db_insert_latency.time():
+            async with pg_pool.pool.acquire() as conn:
+                async with conn.transaction():
+                    seqs = await reserve_seqs(conn, messages)
+                    rows = await conn.fetch(
+                        INSERT_MESSAGES,
+                        [sender_id for sender_id, _, _ in messages],
+                        [reciever_id for _, reciever_id, _ in messages],
+                        [content for _, _, content in messages],
+                        seqs,
+                    )
+                    await update_conversation_summaries(conn, rows)
+        # line the returned rows up with the submitted messages
+        ordered = [None] * len(messages)
+        for row in rows:
+            ordered[row["ord"] - 1] = row
+        return ordered
+
+
+message_writer = MessageBatchWriter(
+    max_batch=settings.message_batch_max_size,
+    max_delay_ms=settings.message_batch_max_delay_ms,
+    workers=settings.message_writer_workers,
+)
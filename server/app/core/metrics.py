@@ -0,0 +1,232 @@
+"""
+In-process metrics with Prometheus text exposition.
+
+Everything here is updated from the event loop thread only, so counters and
+histograms are plain integer/float updates with no locks. Histograms use fixed
+buckets chosen up front; observing a value is one bisect and two additions.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+# seconds; covers sub-millisecond Redis calls up to multi-second slow queries
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(str(v))}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1, *labels: str):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> Iterable[str]:
+        for labels, value in self.values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+
+
+class CallbackMetric:
+    """A gauge or counter whose value is read from the app when scraped"""
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        callback: Callable[[], Optional[float]],
+        kind: str = "gauge",
+    ):
+        self.name = name
+        self.help = help_text
+        self.callback = callback
+        self.kind = kind
+
+    def samples(self) -> Iterable[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            value = None
+        if value is not None:
+            yield f"{self.name} {value}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [per-bucket counts (+Inf last), sum, count]
+        self.series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *labels: str):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def time(self, *labels: str) -> "_Timer":
+        return _Timer(self, labels)
+
+    def samples(self) -> Iterable[str]:
+        bucket_names = self.labelnames + ("le",)
+        for labels, (counts, total, count) in self.series.items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_format_labels(bucket_names, labels + (le,))} {cumulative}"
+                )
+            label_text = _format_labels(self.labelnames, labels)
+            yield f"{self.name}_sum{label_text} {total}"
+            yield f"{self.name}_count{label_text} {count}"
+
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: LabelValues):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: List = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        help_text: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+    ):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge_callback(
+        self, name: str, help_text: str, callback: Callable, kind: str = "gauge"
+    ):
+        return self.register(CallbackMetric(name, help_text, callback, kind))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+# hot-path metrics, updated where the work happens
+ws_messages_received = registry.counter(
+    "chat_ws_messages_received_total", "Chat messages received over WebSockets"
+)
+messages_delivered = registry.counter(
+    "chat_messages_delivered_total",
+    "Outbound frames routed to a user, by delivery status",
+    ("status",),
+)
+db_insert_latency = registry.histogram(
+    "chat_db_message_insert_seconds", "Latency of one batched message INSERT"
+)
+db_insert_batch_size = registry.histogram(
+    "chat_db_message_insert_batch_size",
+    "Messages written per INSERT",
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500),
+)
+redis_publish_latency = registry.histogram(
+    "chat_redis_publish_seconds", "Latency of Redis PUBLISH"
+)
+redis_publish_receivers = registry.counter(
+    "chat_redis_publish_receivers_total", "Subscribers reached by Redis PUBLISH"
+)
+http_request_latency = registry.histogram(
+    "chat_http_request_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status"),
+)
+stream_frames_replayed = registry.counter(
+    "chat_stream_frames_replayed_total", "Frames replayed to reconnecting clients"
+)
+stream_entries_acked = registry.counter(
+    "chat_stream_entries_acked_total", "Inbound stream entries delivered and acked"
+)
+messages_indexed = registry.counter(
+    "chat_search_messages_indexed_total", "Messages added to the search index"
+)
+partitions_created = registry.counter(
+    "chat_message_partitions_created_total", "Monthly message partitions created"
+)
+partitions_expired = registry.counter(
+    "chat_message_partitions_expired_total",
+    "Message partitions detached or dropped by retention",
+)
+rate_limited = registry.counter(
+    "chat_ws_rate_limited_total",
+    "Frames over the per-user rate limit, by what was done with them",
+    ("action",),
+)
+reads_routed = registry.counter(
+    "chat_db_reads_total",
+    "Read-only queries by the server they were sent to",
+    ("target",),
+)
@@ -0,0 +1,40 @@
+"""
+Opaque keyset pagination cursors.
+
+A cursor is the sort key of a row (e.g. created_at + id) packed into a
+url-safe string, so clients pass it back without knowing its contents.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*parts: Any) -> str:
+    values = [p.isoformat() if isinstance(p, datetime) else p for p in parts]
+    raw = json.dumps(values, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Unpack a cursor into its parts, raising a 400 if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if not isinstance(parts, list) or len(parts) != size:
+            raise ValueError("wrong cursor size")
+        return parts
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def decode_time_cursor(cursor: str):
+    """Decode a (created_at, id) cursor"""
+    created_at, row_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
@@ -0,0 +1,163 @@
+"""
+Cluster presence registry.
+
+Tracks which backend node holds each connected user so that messages are
+published to that node's inbound channel instead of a per-user channel, and
+answers "who is online" for any set of users across the whole cluster.
+"""
+
+import asyncio
+import time
+from typing import Callable, Dict, Iterable, Set
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.logger import logger
+from core.redis_service import redis_service
+
+
+class PresenceRegistry:
+    """
+    Presence is stored as one Redis hash per user: ``presence:{user_id}`` maps
+    node id -> expiry timestamp. The key TTL is refreshed by every heartbeat,
+    the per-field expiry lets a lookup ignore nodes that died without cleaning up.
+    """
+
+    def __init__(self, node_id: str, ttl: int, refresh_interval: int):
+        self.node_id = node_id
+        self.ttl = ttl
+        self.refresh_interval = refresh_interval
+
+    @property
+    def node_channel(self) -> str:
+        """Inbound channel of this node"""
+        return self.get_node_channel(self.node_id)
+
+    def get_node_channel(self, node_id: str) -> str:
+        return f"node:{node_id}"
+
+    def get_presence_key(self, user_id: int) -> str:
+        return f"presence:{user_id}"
+
+    def _available(self) -> bool:
+        if not redis_service.is_connected or not redis_service.redis_client:
+            logger.error("Redis is not connected")
+            return False
+        return True
+
+    def _live_nodes(self, entries: dict, now: float) -> Set[str]:
+        nodes = set()
+        for node_id, expires_at in entries.items():
+            if isinstance(node_id, bytes):
+                node_id = node_id.decode("utf-8")
+            if int(expires_at) > now:
+                nodes.add(node_id)
+        return nodes
+
+    async def register(self, user_id: int) -> bool:
+        """
+        Record that this node holds the user. Returns True if the user was not
+        online on any node before, i.e. they just came online cluster-wide.
+        """
+        if not self._available():
+            return False
+        key = self.get_presence_key(user_id)
+        now = time.time()
+        try:
+            async with redis_service.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hgetall(key)
+                pipe.hset(key, self.node_id, int(now) + self.ttl)
+                pipe.expire(key, self.ttl)
+                entries, _, _ = await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to register presence for user {user_id}: {e}")
+            return False
+        return not self._live_nodes(entries, now)
+
+    async def unregister(self, user_id: int) -> bool:
+        """
+        Drop this node from the user's presence. Returns True if no other node
+        still holds them, i.e. they just went offline cluster-wide.
+        """
+        if not self._available():
+            return False
+        key = self.get_presence_key(user_id)
+        try:
+            async with redis_service.redis_client.pipeline(transaction=True) as pipe:
+                pipe.hdel(key, self.node_id)
+                pipe.hgetall(key)
+                _, entries = await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to clear presence for user {user_id}: {e}")
+            return False
+        return not self._live_nodes(entries, time.time())
+
+    async def refresh(self, user_ids: Iterable[int]) -> bool:
+        """Mark the given users as held by this node, in one pipelined round trip"""
+        user_ids = list(user_ids)
+        if not user_ids or not self._available():
+            return False
+        expires_at = int(time.time()) + self.ttl
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    key = self.get_presence_key(user_id)
+                    pipe.hset(key, self.node_id, expires_at)
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+            return True
+        except RedisError as e:
+            logger.error(f"Failed to refresh presence for {len(user_ids)} users: {e}")
+            return False
+
+    async def lookup(self, user_id: int) -> Set[str]:
+        """Return the ids of the nodes currently holding a socket for the user"""
+        return (await self.lookup_many([user_id])).get(user_id, set())
+
+    async def lookup_many(self, user_ids: Iterable[int]) -> Dict[int, Set[str]]:
+        """Nodes holding each of the given users, in one pipelined round trip.
+        Users that are offline everywhere are left out."""
+        user_ids = list(user_ids)
+        if not user_ids or not self._available():
+            return {}
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.hgetall(self.get_presence_key(user_id))
+                results = await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to look up presence for {len(user_ids)} users: {e}")
+            return {}
+
+        now = time.time()
+        nodes_by_user = {}
+        for user_id, entries in zip(user_ids, results):
+            nodes = self._live_nodes(entries, now)
+            if nodes:
+                nodes_by_user[user_id] = nodes
+        return nodes_by_user
+
+    async def online_users(self, user_ids: Iterable[int]) -> Set[int]:
+        """Which of the given users are online on any node"""
+        return set(await self.lookup_many(user_ids))
+
+    async def run_heartbeat(self, get_user_ids: Callable[[], Iterable[int]]):
+        """Refresh presence for every locally connected user until cancelled"""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                user_ids = list(get_user_ids())
+                if user_ids:
+                    await self.refresh(user_ids)
+                    logger.debug(f"Presence refreshed for {len(user_ids)} users")
+            except Exception as e:
+                # keep going: a dead heartbeat lets every local user expire
+                logger.error(f"Presence heartbeat failed: {e}", exc_info=True)
+
+
+presence_registry = PresenceRegistry(
+    node_id=settings.node_id,
+    ttl=settings.presence_ttl_seconds,
+    refresh_interval=settings.presence_refresh_seconds,
+)
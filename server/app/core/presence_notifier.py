@@ -0,0 +1,87 @@
+"""
+Coalesced online/offline notifications pushed to friends.
+
+Status changes are collected for a short window; a user who drops and
+reconnects inside it produces no notification at all. At flush time each
+friend gets one "presence" frame listing every change relevant to them, and
+each remote node gets a single publish for all of its recipients.
+"""
+
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from core.codec import dumps, encode_envelope
+from core.config import settings
+from core.logger import logger
+from core.presence import presence_registry
+from core.redis_service import redis_service
+from core.websocket_engine import manager
+from core.friend_cache import friend_cache
+
+
+class PresenceNotifier:
+    def __init__(self, window_ms: int):
+        self.window = window_ms / 1000
+        # user id -> (status before the window, latest status)
+        self.pending: Dict[int, Tuple[str, str]] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+
+    def notify(self, user_id: int, status: str):
+        if user_id in self.pending:
+            before, _ = self.pending[user_id]
+        else:
+            before = "offline" if status == "online" else "online"
+        self.pending[user_id] = (before, status)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        # changes arriving while this flush publishes schedule the next one
+        self.flush_task = None
+        changes = {
+            user_id: latest
+            for user_id, (before, latest) in self.pending.items()
+            if before != latest
+        }
+        self.pending = {}
+        if changes:
+            try:
+                await self.publish(changes)
+            except Exception as e:
+                logger.error(f"Failed to publish presence changes: {e}", exc_info=True)
+
+    async def publish(self, changes: Dict[int, str]):
+        graphs = await friend_cache.get_many(changes)
+        updates_by_recipient: Dict[int, List[dict]] = {}
+        for user_id, status in changes.items():
+            for friend_id in graphs[user_id].friends:
+                updates_by_recipient.setdefault(friend_id, []).append(
+                    {"user_id": user_id, "status": status}
+                )
+        if not updates_by_recipient:
+            return
+
+        nodes_by_recipient = await presence_registry.lookup_many(updates_by_recipient)
+        remote: Dict[str, List[Tuple[List[int], str]]] = {}
+        for recipient_id, updates in updates_by_recipient.items():
+            frame = dumps({"type": "presence", "updates": updates})
+            if manager.is_user_online(recipient_id):
+                manager.send_frame(recipient_id, frame)
+            for node_id in nodes_by_recipient.get(recipient_id, ()):
+                if node_id != presence_registry.node_id:
+                    remote.setdefault(node_id, []).append(([recipient_id], frame))
+
+        # one publish per node, carrying every frame for its recipients
+        for node_id, deliveries in remote.items():
+            await redis_service.publish_message(
+                presence_registry.get_node_channel(node_id),
+                encode_envelope(deliveries),
+            )
+        logger.debug(
+            f"Presence changes for {len(changes)} users sent to "
+            f"{len(updates_by_recipient)} friends"
+        )
+
+
+presence_notifier = PresenceNotifier(window_ms=settings.presence_notify_window_ms)
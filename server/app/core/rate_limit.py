@@ -0,0 +1,91 @@
+"""
+Per-user token buckets for frames that cost a database write.
+
+Each user may send WS_MESSAGE_RATE messages per second on average, with
+bursts of up to WS_MESSAGE_BURST. With WS_RATE_LIMIT_BACKEND=redis the
+bucket lives in Redis and is updated by a Lua script, so the limit holds
+across all of a user's connections on every node; if Redis is unavailable
+the node falls back to its own buckets.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Tuple
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.logger import logger
+from core.redis_service import redis_service
+
+# buckets kept per node; a forgotten bucket simply starts full again
+MAX_LOCAL_BUCKETS = 100000
+
+# returns the seconds to wait before a token is available, 0 if one was
+# taken; as a string, since Lua numbers come back as truncated integers
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class RateLimiter:
+    def __init__(self, rate: float, burst: int, backend: str):
+        self.rate = rate
+        self.burst = burst
+        self.backend = backend
+        self.buckets: "OrderedDict[int, Tuple[float, float]]" = OrderedDict()
+        self.script = None
+
+    def _acquire_local(self, user_id: int) -> float:
+        now = time.monotonic()
+        tokens, last = self.buckets.get(user_id, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[user_id] = (tokens, now)
+        self.buckets.move_to_end(user_id)
+        if len(self.buckets) > MAX_LOCAL_BUCKETS:
+            self.buckets.popitem(last=False)
+        return wait
+
+    async def acquire(self, user_id: int) -> float:
+        """Take a token for user_id; returns 0, or how long until one is free"""
+        client = redis_service.redis_client
+        if self.backend == "redis" and redis_service.is_connected and client:
+            try:
+                # re-registered after a reconnect replaced the client
+                if self.script is None or self.script.registered_client is not client:
+                    self.script = client.register_script(TOKEN_BUCKET_SCRIPT)
+                wait = await self.script(
+                    keys=[f"ratelimit:{user_id}"], args=[self.rate, self.burst]
+                )
+                return float(wait)
+            except RedisError as e:
+                logger.error(f"Redis rate limiter unavailable, using local: {e}")
+        return self._acquire_local(user_id)
+
+
+rate_limiter = RateLimiter(
+    rate=settings.ws_message_rate,
+    burst=settings.ws_message_burst,
+    backend=settings.ws_rate_limit_backend,
+)
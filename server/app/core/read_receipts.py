@@ -0,0 +1,130 @@
+"""
+Coalesced read receipts.
+
+Clients report a high-water mark per conversation ("I have read everything
+from this user up to message id N"). Marks are merged for a short window and
+applied as one range UPDATE, then the receipt is pushed to the other side.
+Receipts are only sent for messages the UPDATE actually marked, carrying the
+highest id it marked, so a mark for someone else's or a non-existent message
+reaches nobody.
+"""
+
+import asyncio
+from typing import Dict, Optional, Set, Tuple
+
+from core.config import settings
+from core.delivery import deliver_event
+from core.logger import logger
+from core.replicas import read_router
+from db.database import db_connection
+
+
+class ReadReceiptCoalescer:
+    def __init__(self, window_ms: int):
+        self.window = window_ms / 1000
+        # (reader id, other user id) -> highest message id read
+        self.pending: Dict[Tuple[int, int], int] = {}
+        self.flush_task: Optional[asyncio.Task] = None
+        # scheduled flushes, including ones already applying their marks
+        self.tasks: Set[asyncio.Task] = set()
+
+    def mark_read(self, reader_id: int, other_user_id: int, last_read_id: int):
+        key = (reader_id, other_user_id)
+        if last_read_id > self.pending.get(key, 0):
+            self.pending[key] = last_read_id
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_later())
+            self.tasks.add(self.flush_task)
+            self.flush_task.add_done_callback(self.tasks.discard)
+
+    async def stop(self):
+        # let running flushes finish; their marks are already out of pending
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.flush()
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.window)
+        # marks arriving while this flush runs schedule the next one
+        self.flush_task = None
+        await self.flush()
+
+    async def flush(self):
+        marks, self.pending = self.pending, {}
+        if not marks:
+            return
+        try:
+            applied = await self._apply(marks)
+        except Exception as e:
+            logger.error(f"Failed to apply {len(marks)} read marks: {e}", exc_info=True)
+            return
+
+        for (reader_id, other_user_id), last_read_id in applied.items():
+            await deliver_event(
+                other_user_id,
+                {
+                    "type": "read_receipt",
+                    "reader_id": reader_id,
+                    "last_read_id": last_read_id,
+                },
+            )
+
+    async def _apply(
+        self, marks: Dict[Tuple[int, int], int]
+    ) -> Dict[Tuple[int, int], int]:
+        """Mark messages read; returns the highest id marked per pair"""
+        rows = []
+        values = {}
+        for i, ((reader_id, other_user_id), last_read_id) in enumerate(
+            sorted(marks.items())
+        ):
+            rows.append(
+                f"(CAST(:reader_id_{i} AS INTEGER), CAST(:other_user_id_{i} AS INTEGER), "
+                f"CAST(:last_read_id_{i} AS INTEGER))"
+            )
+            values[f"reader_id_{i}"] = reader_id
+            values[f"other_user_id_{i}"] = other_user_id
+            values[f"last_read_id_{i}"] = last_read_id
+        marks_table = (
+            f"(VALUES {', '.join(rows)}) AS r(reader_id, other_user_id, last_read_id)"
+        )
+
+        # subtract exactly the rows this statement flipped: a message is
+        # counted once by its insert (same transaction as the message) and
+        # uncounted once here, in whichever order the two commit
+        flipped = await db_connection.fetch_all(
+            query=f"""
+                WITH flipped AS (
+                    UPDATE messages m SET is_read = TRUE
+                    FROM {marks_table}
+                    WHERE m.reciever_id = r.reader_id
+                    AND m.sender_id = r.other_user_id
+                    AND m.id <= r.last_read_id
+                    AND NOT m.is_read
+                    RETURNING m.id, m.reciever_id, m.sender_id
+                ), counts AS (
+                    SELECT reciever_id, sender_id, COUNT(*) AS total
+                    FROM flipped
+                    WHERE reciever_id <> sender_id
+                    GROUP BY reciever_id, sender_id
+                ), summaries AS (
+                    UPDATE conversation_summaries s
+                    SET unread_count = GREATEST(s.unread_count - c.total, 0)
+                    FROM counts c
+                    WHERE s.user_id = c.reciever_id AND s.other_user_id = c.sender_id
+                )
+                SELECT reciever_id, sender_id, MAX(id) AS last_read_id
+                FROM flipped
+                GROUP BY reciever_id, sender_id
+            """,
+            values=values,
+        )
+        applied = {
+            (row["reciever_id"], row["sender_id"]): row["last_read_id"]
+            for row in flipped
+        }
+        # is_read changed on the other side's messages too
+        await read_router.note_writes(user_id for pair in applied for user_id in pair)
+        return applied
+
+
+read_receipts = ReadReceiptCoalescer(window_ms=settings.read_receipt_window_ms)
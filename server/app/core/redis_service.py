@@ -1,10 +1,12 @@
-from typing import Optional, Dict, Callable
+from typing import Optional, Dict, Callable, Set, Union
 import redis.asyncio as redis
 from core.config import settings
 from core.logger import logger
+from core.dispatcher import KeyedDispatcher
+from core.codec import dumps, loads, decode_envelope
+from core.metrics import redis_publish_latency, redis_publish_receivers
 from redis.exceptions import ConnectionError, RedisError, TimeoutError
 import asyncio
-import json
 
 
 class RedisServer:
@@ -12,9 +14,16 @@ class RedisServer:
         self.redis_client: Optional[redis.Redis] = None
         self.pubsub: Optional[redis.client.PubSub] = None
         self.subscribers: Dict[str, Callable] = {}
+        # channels carrying delivery envelopes instead of JSON objects
+        self.envelope_channels: Set[str] = set()
         self.is_connected: bool = False
         self.pool: Optional[redis.ConnectionPool] = None
         self._reconnecting: bool = False
+        self.dispatcher = KeyedDispatcher(
+            workers=settings.dispatch_workers,
+            queue_size=settings.dispatch_queue_size,
+            overflow_policy=settings.dispatch_overflow_policy,
+        )
 
     async def connect(self, auto_reconnect: bool = True):
         try:
@@ -84,19 +93,24 @@ class RedisServer:
         except Exception as e:
             logger.error(f"Error disconnecting Redis: {e}")
 
-    async def publish_message(self, channel: str, message: dict):
+    async def publish_message(self, channel: str, message: Union[dict, str]):
+        """Publish a JSON object, or an already encoded envelope string"""
         if not self.is_connected or not self.redis_client:
             logger.error("Redis is not connected")
             return False
 
         try:
-            message_json = json.dumps(message)
-            subscribers_count = await self.redis_client.publish(channel, message_json)
+            message_json = message if isinstance(message, str) else dumps(message)
+            with redis_publish_latency.time():
+                subscribers_count = await self.redis_client.publish(
+                    channel, message_json
+                )
+            redis_publish_receivers.inc(subscribers_count)
             logger.info(
                 f"📤 Published to {channel} (reached {subscribers_count} subscribers)"
             )
             return True
-        except json.JSONEncodeError as e:
+        except (TypeError, ValueError) as e:
             logger.error(f"Failed to serialize message for channel '{channel}': {e}")
             return False
         except RedisError as e:
@@ -106,7 +120,15 @@ class RedisServer:
             logger.error(f"Failed to publish message: {e}")
             return False
 
-    async def subscribe_to_channel(self, channel: str, handler: Callable):
+    async def subscribe_to_channel(
+        self, channel: str, handler: Callable, envelope: bool = False
+    ):
+        """
+        Subscribe a handler to a channel. JSON channels call handler(dict);
+        envelope channels call handler((user_ids, frame)) once per frame.
+        """
+        if envelope:
+            self.envelope_channels.add(channel)
         if not self.is_connected or not self.redis_client:
             logger.error("Redis is not connected")
             return False
@@ -140,6 +162,7 @@ class RedisServer:
         try:
             await self.pubsub.unsubscribe(channel)
             self.subscribers.pop(channel, None)
+            self.envelope_channels.discard(channel)
             return True
         except RedisError as e:
             logger.error(f"Failed to unsubscribe from channel due to: {e}")
@@ -152,6 +175,7 @@ class RedisServer:
         if not self.pubsub:
             logger.error("PubSub not initialized")
             return False
+        self.dispatcher.start()
         try:
             async for message in self.pubsub.listen():
                 if message["type"] == "message":
@@ -161,18 +185,37 @@ class RedisServer:
                         channel = channel.decode("utf-8")
 
                     data = message["data"]
-                    if channel in self.subscribers:
-                        try:
-                            message_data = json.loads(data)
-                            await self.subscribers[channel](message_data)
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Invalid JSON in message: {e}")
-                        except Exception as e:
-                            logger.error(f"Error handling message: {e}", exc_info=True)
-                    else:
+                    if channel not in self.subscribers:
                         logger.warning(
                             f"⚠️ No handler for channel: {channel} (Available: {list(self.subscribers.keys())})"
                         )
+                        continue
+                    handler = self.subscribers[channel]
+
+                    if channel in self.envelope_channels:
+                        # only the header is parsed; frames are forwarded as-is
+                        try:
+                            deliveries = decode_envelope(data)
+                        except (ValueError, KeyError) as e:
+                            logger.error(f"Invalid envelope on {channel}: {e}")
+                            continue
+                        for user_ids, frame in deliveries:
+                            # key by recipient: ordered per user, parallel across users
+                            self.dispatcher.submit(
+                                user_ids[0] if user_ids else channel,
+                                handler,
+                                (user_ids, frame),
+                            )
+                        continue
+
+                    try:
+                        message_data = loads(data)
+                    except ValueError as e:
+                        logger.error(f"Invalid JSON in message: {e}")
+                        continue
+                    self.dispatcher.submit(
+                        message_data.get("user_id", channel), handler, message_data
+                    )
         except RedisError as e:
             logger.error(f"Redis error: {e}")
             if await self.reconnect():
@@ -188,6 +231,8 @@ class RedisServer:
             return False
 
         self._reconnecting = True
+        # disconnect() clears the handler map, keep it for resubscribing
+        subscribers = dict(self.subscribers)
         max_retries = 5
         retry_delay = 1
         try:
@@ -202,9 +247,12 @@ class RedisServer:
                     # auto_reconnect=False to prevent infinite recursion
                     if await self.connect(auto_reconnect=False):
                         # Resubscribe to channels
-                        if self.subscribers:
-                            for channel, handler in list(self.subscribers.items()):
-                                await self.subscribe_to_channel(channel, handler)
+                        for channel, handler in subscribers.items():
+                            await self.subscribe_to_channel(
+                                channel,
+                                handler,
+                                envelope=channel in self.envelope_channels,
+                            )
                         logger.info("Redis reconnected successfully")
                         return True
                 except Exception as e:
@@ -0,0 +1,173 @@
+"""
+Routing of read-only queries to the replica (REPLICA_HOST).
+
+A read goes to the replica only when its measured replay lag is known and
+below REPLICA_MAX_LAG_MS, and the user it is for has not written anything
+in the last READ_YOUR_WRITES_MS. Otherwise it goes to the primary, so
+someone who just sent a message, marked a conversation read or changed a
+friendship always sees that change. Recent writers are remembered locally
+and in Redis, so the window holds whichever node serves the next request.
+"""
+
+import asyncio
+import time
+from typing import Dict, Iterable, Optional
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import reads_routed
+from core.redis_service import redis_service
+from db.pool import PgPool, pg_pool, replica_pool
+
+# replay lag; 0 when everything received has been replayed, since the
+# last replayed commit time alone would grow while the primary is idle.
+# "Everything received" only means caught up while the WAL receiver is
+# streaming and still hearing from the primary (an idle primary sends a
+# keepalive every wal_sender_timeout / 2); otherwise the lag is unknown.
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT EXISTS (
+            SELECT 1 FROM pg_stat_wal_receiver
+            WHERE status = 'streaming'
+            AND last_msg_receipt_time > now() - make_interval(secs => $1)
+        ) THEN NULL
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+# a lag reading older than this many check intervals is not trusted
+STALE_CHECKS = 3
+MAX_LOCAL_WRITERS = 10000
+
+
+class ReplicaRouter:
+    def __init__(
+        self,
+        primary: PgPool,
+        replica: Optional[PgPool],
+        max_lag_ms: int,
+        check_interval_ms: int,
+        window_ms: int,
+        max_receipt_age_ms: int,
+    ):
+        self.primary = primary
+        self.replica = replica
+        self.max_lag = max_lag_ms / 1000
+        self.check_interval = check_interval_ms / 1000
+        self.window_ms = window_ms
+        self.max_receipt_age = max_receipt_age_ms / 1000
+        # user id -> monotonic time their window ends
+        self.recent_writers: Dict[int, float] = {}
+        self.lag: Optional[float] = None
+        self.lag_measured_at = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica is not None
+
+    def replica_usable(self) -> bool:
+        return (
+            self.lag is not None
+            and self.lag <= self.max_lag
+            and time.monotonic() - self.lag_measured_at
+            < self.check_interval * STALE_CHECKS
+        )
+
+    def _writer_key(self, user_id: int) -> str:
+        return f"ryw:{user_id}"
+
+    async def note_writes(self, user_ids: Iterable[int]):
+        """Keep these users' reads on the primary for the next window"""
+        if not self.enabled:
+            return
+        user_ids = set(user_ids)
+        now = time.monotonic()
+        if len(self.recent_writers) > MAX_LOCAL_WRITERS:
+            self.recent_writers = {
+                user_id: until
+                for user_id, until in self.recent_writers.items()
+                if until > now
+            }
+        until = now + self.window_ms / 1000
+        for user_id in user_ids:
+            self.recent_writers[user_id] = until
+        if not redis_service.is_connected or not redis_service.redis_client:
+            return
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                for user_id in user_ids:
+                    pipe.set(self._writer_key(user_id), 1, px=self.window_ms)
+                await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to record recent writes: {e}")
+
+    async def _wrote_recently(self, user_id: int) -> bool:
+        if self.recent_writers.get(user_id, 0) > time.monotonic():
+            return True
+        if not redis_service.is_connected or not redis_service.redis_client:
+            return False
+        try:
+            return bool(
+                await redis_service.redis_client.exists(self._writer_key(user_id))
+            )
+        except RedisError as e:
+            logger.error(f"Failed to check recent writes of user {user_id}: {e}")
+            return True
+
+    async def pool_for(self, user_id: int) -> PgPool:
+        """The pool to run a read-only query on behalf of user_id on"""
+        if (
+            self.enabled
+            and self.replica_usable()
+            and not await self._wrote_recently(user_id)
+        ):
+            reads_routed.inc(1, "replica")
+            return self.replica
+        reads_routed.inc(1, "primary")
+        return self.primary
+
+    def start(self):
+        if self.enabled and self.task is None:
+            self.task = asyncio.create_task(self._monitor_lag())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    async def _monitor_lag(self):
+        while True:
+            try:
+                lag = await self.replica.pool.fetchval(LAG_QUERY, self.max_receipt_age)
+                if lag is None:
+                    if self.lag is not None:
+                        logger.warning(
+                            "Replica is not streaming from the primary, "
+                            "reading from the primary"
+                        )
+                    self.lag = None
+                else:
+                    self.lag = float(lag)
+                    self.lag_measured_at = time.monotonic()
+                    if self.lag > self.max_lag:
+                        logger.warning(
+                            f"Replica lag {self.lag:.1f}s, reading from the primary"
+                        )
+            except Exception as e:
+                logger.error(f"Failed to measure replica lag: {e}")
+            await asyncio.sleep(self.check_interval)
+
+
+read_router = ReplicaRouter(
+    primary=pg_pool,
+    replica=replica_pool,
+    max_lag_ms=settings.replica_max_lag_ms,
+    check_interval_ms=settings.replica_lag_check_interval_ms,
+    window_ms=settings.read_your_writes_ms,
+    max_receipt_age_ms=settings.replica_max_receipt_age_ms,
+)
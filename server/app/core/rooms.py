@@ -0,0 +1,110 @@
+"""
+Room message fan-out.
+
+A room message is persisted once, acknowledged to the sender, and then fanned
+out by a background worker keyed by room, so room order is kept and the
+sender's socket loop never waits on delivery. The frame is serialized once:
+local members get the same string queued on their sockets (each socket's
+writer task sends it concurrently), and each remote node holding members gets
+a single envelope listing its recipients.
+"""
+
+import time
+from typing import Dict, FrozenSet, List, Tuple
+
+from core.codec import dumps, encode_envelope
+from core.config import settings
+from core.dispatcher import KeyedDispatcher
+from core.logger import logger
+from core.presence import presence_registry
+from core.redis_service import redis_service
+from core.websocket_engine import manager
+from db.rooms import get_room_member_ids, insert_room_message
+
+ROOM_INVALIDATION_CHANNEL = "rooms:invalidate"
+
+
+class RoomService:
+    def __init__(self, member_cache_ttl: int, fanout_workers: int):
+        self.member_cache_ttl = member_cache_ttl
+        # room id -> (expires at, member ids)
+        self.members: Dict[int, Tuple[float, FrozenSet[int]]] = {}
+        self.fanout = KeyedDispatcher(
+            workers=fanout_workers,
+            queue_size=settings.dispatch_queue_size,
+            overflow_policy=settings.dispatch_overflow_policy,
+        )
+
+    async def get_members(self, room_id: int) -> FrozenSet[int]:
+        entry = self.members.get(room_id)
+        if entry and entry[0] > time.monotonic():
+            return entry[1]
+        members = frozenset(await get_room_member_ids(room_id))
+        self.members[room_id] = (time.monotonic() + self.member_cache_ttl, members)
+        return members
+
+    async def is_member(self, room_id: int, user_id: int) -> bool:
+        return user_id in await self.get_members(room_id)
+
+    async def invalidate(self, room_id: int):
+        """Drop a room's cached member list on every node after a membership change"""
+        self.members.pop(room_id, None)
+        await redis_service.publish_message(
+            ROOM_INVALIDATION_CHANNEL, {"type": "room_invalidated", "room_id": room_id}
+        )
+
+    async def handle_invalidation(self, message_data: dict):
+        room_id = message_data.get("room_id")
+        if room_id is not None:
+            self.members.pop(room_id, None)
+
+    async def send_message(self, room_id: int, sender_id: int, content: str) -> dict:
+        """Persist a room message and queue its fan-out; returns the saved message"""
+        saved = await insert_room_message(room_id, sender_id, content)
+        message_data = {
+            "id": saved["id"],
+            "room_id": saved["room_id"],
+            "sender_id": saved["sender_id"],
+            "content": saved["content"],
+            "created_at": saved["created_at"].isoformat(),
+        }
+        frame = dumps({"type": "room_message", **message_data})
+        if not self.fanout.submit(room_id, self.broadcast, (room_id, frame)):
+            logger.warning(f"Room {room_id} fan-out dropped message {saved['id']}")
+        return message_data
+
+    async def broadcast(self, delivery: Tuple[int, str]):
+        room_id, frame = delivery
+        members = await self.get_members(room_id)
+
+        local = 0
+        for user_id in members:
+            if manager.is_user_online(user_id) and manager.send_frame(user_id, frame):
+                local += 1
+
+        nodes_by_user = await presence_registry.lookup_many(members)
+        recipients_by_node: Dict[str, List[int]] = {}
+        for user_id, nodes in nodes_by_user.items():
+            for node_id in nodes:
+                if node_id != presence_registry.node_id:
+                    recipients_by_node.setdefault(node_id, []).append(user_id)
+
+        # one publish per node, not per member
+        for node_id, user_ids in recipients_by_node.items():
+            await redis_service.publish_message(
+                presence_registry.get_node_channel(node_id),
+                encode_envelope([(user_ids, frame)]),
+            )
+        logger.debug(
+            f"Room {room_id} message sent to {local} local members and "
+            f"{len(recipients_by_node)} other nodes"
+        )
+
+    async def stop(self):
+        await self.fanout.stop()
+
+
+room_service = RoomService(
+    member_cache_ttl=settings.room_member_cache_ttl_seconds,
+    fanout_workers=settings.room_fanout_workers,
+)
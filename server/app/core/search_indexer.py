@@ -0,0 +1,90 @@
+"""
+Background maintenance of messages.search_vector.
+
+The send path only inserts rows; this task fills in the tsvector of new
+messages shortly afterwards, in batches, so full-text indexing never adds
+latency to a WebSocket send. The message writer wakes it after each batch and
+it also polls, which picks up rows left behind by a restart.
+"""
+
+import asyncio
+from typing import Optional
+
+from core.config import settings
+from core.logger import logger
+from core.metrics import messages_indexed
+from db.database import db_connection
+
+# fallback poll for rows nobody woke the indexer for (e.g. other nodes' writes)
+POLL_SECONDS = 30
+
+
+class SearchIndexer:
+    def __init__(self, text_config: str, batch_size: int, interval_ms: int):
+        self.text_config = text_config
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.pending = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+            self.task = None
+
+    def wake(self):
+        """New messages were saved"""
+        self.pending.set()
+
+    async def index_batch(self) -> int:
+        """Index up to one batch of unindexed messages; returns how many"""
+        # SKIP LOCKED lets several nodes run an indexer without contending
+        return await db_connection.fetch_val(
+            query="""
+                WITH batch AS (
+                    SELECT id, created_at FROM messages
+                    WHERE search_vector IS NULL
+                    ORDER BY id
+                    LIMIT :batch_size
+                    FOR UPDATE SKIP LOCKED
+                ), indexed AS (
+                    UPDATE messages m
+                    SET search_vector = to_tsvector(CAST(:config AS regconfig), m.content)
+                    FROM batch
+                    WHERE m.id = batch.id AND m.created_at = batch.created_at
+                    RETURNING 1
+                )
+                SELECT COUNT(*) FROM indexed
+            """,
+            values={"batch_size": self.batch_size, "config": self.text_config},
+        )
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.pending.wait(), POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self.pending.clear()
+            try:
+                while True:
+                    count = await self.index_batch()
+                    messages_indexed.inc(count)
+                    if count < self.batch_size:
+                        break
+            except Exception as e:
+                logger.error(f"Search indexing failed: {e}", exc_info=True)
+            # sends arriving meanwhile are picked up together in the next round
+            await asyncio.sleep(self.interval)
+
+
+search_indexer = SearchIndexer(
+    text_config=settings.search_text_config,
+    batch_size=settings.search_index_batch_size,
+    interval_ms=settings.search_index_interval_ms,
+)
@@ -0,0 +1,300 @@
+"""
+Redis Streams delivery backend (DELIVERY_BACKEND=streams).
+
+Every frame for a user is appended to that user's stream, capped at
+USER_STREAM_MAXLEN entries and dropped after USER_STREAM_TTL_SECONDS without a
+new one, and the entry id is spliced into the frame as ``stream_id``. A client remembers the last stream_id it saw and sends it as
+``last_stream_id`` in its auth message; the gap is replayed from the stream.
+
+Instead of a pub/sub channel, each node reads an inbound stream through a
+consumer group. An entry is XACKed only after its frames were written to the
+local sockets, so anything published while the reader was down or restarting,
+or that a socket failed to send, stays pending. Entries pending for longer
+than STREAM_CLAIM_IDLE_MS are claimed and delivered again, on startup and
+every claim interval after that. The consumer is named after NODE_ID, which
+must be set and stay the same across restarts, so a restarted node picks up
+its own stream and pending entries instead of leaving them to expire.
+"""
+
+import asyncio
+from typing import Callable, List, Optional, Set, Tuple
+
+from redis.exceptions import RedisError, ResponseError
+
+from core.codec import decode_envelope
+from core.config import settings
+from core.logger import logger
+from core.metrics import stream_entries_acked, stream_frames_replayed
+from core.redis_service import redis_service
+
+GROUP = "delivery"
+BLOCK_MS = 5000
+
+# queues a delivery on local sockets, returning a future per socket that
+# resolves to whether the frame was written (ConnectionManager.handle_stream_envelope)
+StreamHandler = Callable[[Tuple[List[int], str]], List[asyncio.Future]]
+
+
+def splice_stream_id(frame: str, stream_id: str) -> str:
+    """Add stream_id to a serialized JSON object without decoding it"""
+    return f'{frame[:-1]},"stream_id":"{stream_id}"}}'
+
+
+def parse_stream_id(stream_id: str) -> Tuple[int, int]:
+    millis, _, seq = stream_id.partition("-")
+    return int(millis), int(seq or 0)
+
+
+def _text(value) -> str:
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+class StreamDelivery:
+    def __init__(
+        self,
+        node_id: str,
+        user_maxlen: int,
+        user_ttl: int,
+        node_maxlen: int,
+        node_ttl: int,
+        read_count: int,
+        replay_max: int,
+        claim_idle_ms: int,
+    ):
+        self.node_id = node_id
+        self.user_maxlen = user_maxlen
+        self.user_ttl = user_ttl
+        self.node_maxlen = node_maxlen
+        self.node_ttl = node_ttl
+        self.read_count = read_count
+        self.replay_max = replay_max
+        self.claim_idle_ms = claim_idle_ms
+        # waits for frames to be written before their entries are acked
+        self.ack_tasks: Set[asyncio.Task] = set()
+
+    @property
+    def node_stream(self) -> str:
+        return self.get_node_stream(self.node_id)
+
+    def get_node_stream(self, node_id: str) -> str:
+        return f"stream:node:{node_id}"
+
+    def get_user_stream(self, user_id: int) -> str:
+        return f"stream:user:{user_id}"
+
+    def _available(self) -> bool:
+        if not redis_service.is_connected or not redis_service.redis_client:
+            logger.error("Redis is not connected")
+            return False
+        return True
+
+    async def append(self, user_id: int, frame: str) -> Optional[str]:
+        """Log a frame for a user; returns its stream id"""
+        if not self._available():
+            return None
+        key = self.get_user_stream(user_id)
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xadd(key, {"f": frame}, maxlen=self.user_maxlen, approximate=True)
+                # the stream of a user who stopped getting messages is dropped
+                pipe.expire(key, self.user_ttl)
+                stream_id, _ = await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to append to stream of user {user_id}: {e}")
+            return None
+        return _text(stream_id)
+
+    async def publish(self, node_id: str, envelope: str) -> bool:
+        """Queue an envelope on a node's inbound stream"""
+        if not self._available():
+            return False
+        key = self.get_node_stream(node_id)
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xadd(
+                    key, {"d": envelope}, maxlen=self.node_maxlen, approximate=True
+                )
+                # the stream of a node that died is dropped eventually
+                pipe.expire(key, self.node_ttl)
+                await pipe.execute()
+            return True
+        except RedisError as e:
+            logger.error(f"Failed to publish to stream {key}: {e}")
+            return False
+
+    async def replay(self, user_id: int, last_stream_id: str) -> Tuple[List[str], bool]:
+        """
+        Frames logged for a user after last_stream_id, with their stream ids.
+        The flag is True when part of the gap is no longer retained (trimmed
+        or beyond STREAM_REPLAY_MAX), so the client should reload history.
+        """
+        try:
+            last_seen = parse_stream_id(last_stream_id)
+        except ValueError:
+            logger.warning(f"Invalid last_stream_id from user {user_id}")
+            return [], True
+        if not self._available():
+            return [], True
+        key = self.get_user_stream(user_id)
+        try:
+            async with redis_service.redis_client.pipeline(transaction=False) as pipe:
+                pipe.xrange(key, min="-", max="+", count=1)
+                pipe.xrange(
+                    key, min=f"({last_stream_id}", max="+", count=self.replay_max + 1
+                )
+                oldest, entries = await pipe.execute()
+        except RedisError as e:
+            logger.error(f"Failed to replay stream of user {user_id}: {e}")
+            return [], True
+
+        # the client's last entry was trimmed, so may be the ones after it;
+        # with no stream left at all, it expired along with everything in it
+        if oldest:
+            truncated = parse_stream_id(_text(oldest[0][0])) > last_seen
+        else:
+            truncated = last_seen > (0, 0)
+        if len(entries) > self.replay_max:
+            entries = entries[: self.replay_max]
+            truncated = True
+        frames = [
+            splice_stream_id(_text(fields[b"f"]), _text(entry_id))
+            for entry_id, fields in entries
+        ]
+        stream_frames_replayed.inc(len(frames))
+        return frames, truncated
+
+    async def ensure_group(self):
+        try:
+            await redis_service.redis_client.xgroup_create(
+                self.node_stream, GROUP, id="0", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def claim_stale_entries(self, handler: StreamHandler) -> int:
+        """
+        Take over and deliver entries left pending for STREAM_CLAIM_IDLE_MS,
+        whichever consumer of the group (this one included) read them last
+        """
+        claimed = 0
+        start_id = "0-0"
+        while True:
+            response = await redis_service.redis_client.xautoclaim(
+                self.node_stream,
+                GROUP,
+                self.node_id,
+                min_idle_time=self.claim_idle_ms,
+                start_id=start_id,
+                count=self.read_count,
+            )
+            start_id = _text(response[0])
+            claimed += len(response[1])
+            await self._deliver(response[1], handler)
+            if start_id == "0-0":
+                break
+        if claimed:
+            logger.info(f"Claimed {claimed} stale entries of {self.node_stream}")
+        return claimed
+
+    async def run_consumer(self, handler: StreamHandler):
+        """Read this node's inbound stream until cancelled"""
+        loop = asyncio.get_running_loop()
+        group_ready = False
+        next_claim = 0.0
+        while True:
+            try:
+                if not group_ready:
+                    await self.ensure_group()
+                    group_ready = True
+                    next_claim = 0.0
+                # picks up what a previous reader left pending, and entries
+                # whose frames could not be written, every claim interval
+                if loop.time() >= next_claim:
+                    await self.claim_stale_entries(handler)
+                    next_claim = loop.time() + self.claim_idle_ms / 1000
+                    continue
+                response = await redis_service.redis_client.xreadgroup(
+                    GROUP,
+                    self.node_id,
+                    {self.node_stream: ">"},
+                    count=self.read_count,
+                    block=BLOCK_MS,
+                )
+            except ResponseError as e:
+                # NOGROUP: the stream expired or was deleted
+                logger.warning(f"Stream consumer on {self.node_stream}: {e}")
+                group_ready = False
+                await asyncio.sleep(1)
+                continue
+            except RedisError as e:
+                logger.error(f"Stream consumer error: {e}")
+                await asyncio.sleep(1)
+                continue
+
+            await self._deliver(response[0][1] if response else [], handler)
+
+    async def _deliver(self, entries: list, handler: StreamHandler):
+        """
+        Hand entries to the local sockets. An entry is acked once all of its
+        frames were written; one for users with no socket here is acked at
+        once, since they replay it from their own stream when they connect.
+        """
+        done = []
+        waiting: List[Tuple[bytes, List[asyncio.Future]]] = []
+        for entry_id, fields in entries:
+            if entry_id is None:
+                continue
+            sent: List[asyncio.Future] = []
+            # pending entries already trimmed from the stream come back empty
+            if fields:
+                try:
+                    for delivery in decode_envelope(fields[b"d"]):
+                        sent.extend(handler(delivery))
+                except (ValueError, KeyError) as e:
+                    logger.error(f"Invalid envelope in {self.node_stream}: {e}")
+            if sent:
+                waiting.append((entry_id, sent))
+            else:
+                done.append(entry_id)
+        await self._ack(done)
+        if waiting:
+            task = asyncio.create_task(self._ack_when_sent(waiting))
+            self.ack_tasks.add(task)
+            task.add_done_callback(self.ack_tasks.discard)
+
+    async def _ack_when_sent(self, waiting: List[Tuple[bytes, List[asyncio.Future]]]):
+        # give up before the entries become claimable again; unwritten ones
+        # stay pending and are retried by the next claim
+        await asyncio.wait(
+            [future for _, sent in waiting for future in sent],
+            timeout=self.claim_idle_ms / 2000,
+        )
+        await self._ack(
+            [
+                entry_id
+                for entry_id, sent in waiting
+                if all(future.done() and future.result() for future in sent)
+            ]
+        )
+
+    async def _ack(self, entry_ids: list):
+        if not entry_ids:
+            return
+        try:
+            await redis_service.redis_client.xack(self.node_stream, GROUP, *entry_ids)
+            stream_entries_acked.inc(len(entry_ids))
+        except RedisError as e:
+            logger.error(f"Failed to ack {len(entry_ids)} stream entries: {e}")
+
+
+stream_delivery = StreamDelivery(
+    node_id=settings.node_id,
+    user_maxlen=settings.user_stream_maxlen,
+    user_ttl=settings.user_stream_ttl_seconds,
+    node_maxlen=settings.node_stream_maxlen,
+    node_ttl=settings.node_stream_ttl_seconds,
+    read_count=settings.stream_read_count,
+    replay_max=settings.stream_replay_max,
+    claim_idle_ms=settings.stream_claim_idle_ms,
+)
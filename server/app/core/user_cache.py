@@ -0,0 +1,132 @@
+"""
+Cached user resolution for authenticated requests and the WebSocket handshake.
+
+Users are kept in an in-process TTL + LRU cache, optionally backed by Redis so
+a cold node can skip Postgres too. Nothing in the application changes a user
+row after registration, so entries are never invalidated and only expire by
+TTL (USER_CACHE_TTL_SECONDS, USER_CACHE_REDIS_TTL_SECONDS). A row edited by
+hand may be served stale for that long.
+"""
+
+import json
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from redis.exceptions import RedisError
+
+from core.config import settings
+from core.logger import logger
+from core.redis_service import redis_service
+from db.database import get_user_by_id, get_user_by_username
+
+# never cached: login verifies against a fresh row
+PRIVATE_FIELDS = ("hashed_password",)
+
+
+class UserCache:
+    def __init__(self, max_size: int, ttl: int, use_redis: bool, redis_ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.use_redis = use_redis
+        self.redis_ttl = redis_ttl
+        self.entries: "OrderedDict[int, Tuple[float, dict]]" = OrderedDict()
+        self.ids_by_username: Dict[str, int] = {}
+        self.hits: int = 0
+        self.misses: int = 0
+
+    def get_local(self, user_id: int) -> Optional[dict]:
+        entry = self.entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at < time.monotonic():
+            self.invalidate_local(user_id)
+            return None
+        self.entries.move_to_end(user_id)
+        return user
+
+    def put(self, user: dict) -> dict:
+        user = {k: v for k, v in user.items() if k not in PRIVATE_FIELDS}
+        self.entries[user["id"]] = (time.monotonic() + self.ttl, user)
+        self.entries.move_to_end(user["id"])
+        self.ids_by_username[user["username"]] = user["id"]
+        while len(self.entries) > self.max_size:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.ids_by_username.pop(evicted["username"], None)
+        return user
+
+    def invalidate_local(self, user_id: int):
+        entry = self.entries.pop(user_id, None)
+        if entry:
+            self.ids_by_username.pop(entry[1]["username"], None)
+
+    async def get_by_id(self, user_id: int) -> Optional[dict]:
+        user = self.get_local(user_id)
+        if user:
+            self.hits += 1
+            return user
+        self.misses += 1
+        user = await self._get_shared(user_id)
+        if user is None:
+            user = await get_user_by_id(user_id)
+            if user is None:
+                return None
+            user = self.put(user)
+            await self._set_shared(user)
+            return user
+        return self.put(user)
+
+    async def get_by_username(self, username: str) -> Optional[dict]:
+        user_id = self.ids_by_username.get(username)
+        if user_id is not None:
+            user = self.get_local(user_id)
+            if user:
+                self.hits += 1
+                return user
+        self.misses += 1
+        user = await get_user_by_username(username)
+        if user is None:
+            return None
+        user = self.put(user)
+        await self._set_shared(user)
+        return user
+
+    def _shared_key(self, user_id: int) -> str:
+        return f"user:{user_id}"
+
+    async def _get_shared(self, user_id: int) -> Optional[dict]:
+        if not self.use_redis or not redis_service.is_connected:
+            return None
+        try:
+            raw = await redis_service.redis_client.get(self._shared_key(user_id))
+        except RedisError as e:
+            logger.error(f"Failed to read shared cache for user {user_id}: {e}")
+            return None
+        if raw is None:
+            return None
+        user = json.loads(raw)
+        if user.get("created_at"):
+            user["created_at"] = datetime.fromisoformat(user["created_at"])
+        return user
+
+    async def _set_shared(self, user: dict):
+        if not self.use_redis or not redis_service.is_connected:
+            return
+        try:
+            await redis_service.redis_client.set(
+                self._shared_key(user["id"]),
+                json.dumps(user, default=lambda v: v.isoformat()),
+                ex=self.redis_ttl,
+            )
+        except RedisError as e:
+            logger.error(f"Failed to write shared cache for user {user['id']}: {e}")
+
+
+user_cache = UserCache(
+    max_size=settings.user_cache_size,
+    ttl=settings.user_cache_ttl_seconds,
+    use_redis=settings.user_cache_redis,
+    redis_ttl=settings.user_cache_redis_ttl_seconds,
+)
@@ -1,84 +1,236 @@
 from fastapi import WebSocket, WebSocketDisconnect
-from typing import Dict, Set
+from typing import Dict, List, Optional, Set, Tuple, Union
 from models.messages import Message_Response
+import asyncio
 import datetime
+import uuid
+from core.config import settings
 from core.logger import logger
+from core.codec import dumps
+
+
+class ClientConnection:
+    """
+    A connected socket with its own bounded send queue drained by a writer task,
+    so a slow client never blocks the task that is delivering to it. The queue
+    holds serialized frames, written with send_text as-is. A frame may come
+    with a future that resolves to True once it was written to the socket, or
+    to False if the connection goes away first.
+
+    A user may hold several connections (tabs, devices); each is one session.
+    """
+
+    def __init__(self, user_id: int, websocket: WebSocket):
+        self.user_id = user_id
+        self.session_id = uuid.uuid4().hex
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=settings.ws_send_queue_size)
+        self.writer_task: Optional[asyncio.Task] = None
+        self.closed: bool = False
+        self.above_high_water: bool = False
+        self.sent: int = 0
+
+    def start(self):
+        self.writer_task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        self.closed = True
+        if self.writer_task and self.writer_task is not asyncio.current_task():
+            self.writer_task.cancel()
+        # nothing queued will be written any more
+        while not self.queue.empty():
+            item = self.queue.get_nowait()
+            if isinstance(item, tuple):
+                _resolve(item[1], False)
+
+    def enqueue(
+        self, payload: Union[dict, str], sent: Optional[asyncio.Future] = None
+    ) -> bool:
+        """Queue a frame (or a dict to serialize) for this socket.
+        Returns False if it was not accepted."""
+        if self.closed:
+            return False
+        frame = payload if isinstance(payload, str) else dumps(payload)
+        try:
+            self.queue.put_nowait(frame if sent is None else (frame, sent))
+        except asyncio.QueueFull:
+            self.evict()
+            return False
+
+        depth = self.queue.qsize()
+        if depth >= settings.ws_send_queue_high_water:
+            if not self.above_high_water:
+                self.above_high_water = True
+                manager.high_water_events += 1
+                logger.warning(
+                    f"Slow consumer: user {self.user_id} session {self.session_id} "
+                    f"has {depth} queued frames"
+                )
+        else:
+            self.above_high_water = False
+        return True
+
+    def evict(self):
+        """Close a consumer that fell too far behind"""
+        if self.closed:
+            return
+        manager.evicted += 1
+        logger.warning(
+            f"Evicting slow consumer user {self.user_id} session {self.session_id} "
+            f"({self.queue.qsize()} frames queued)"
+        )
+        self.stop()
+        task = asyncio.create_task(
+            self.close(settings.ws_slow_consumer_close_code, "Slow consumer")
+        )
+        # the loop only keeps a weak reference to tasks
+        manager.closing.add(task)
+        task.add_done_callback(manager.closing.discard)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.stop()
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _writer(self):
+        sent = None
+        try:
+            while True:
+                frame = await self.queue.get()
+                if isinstance(frame, tuple):
+                    frame, sent = frame
+                await self.websocket.send_text(frame)
+                self.sent += 1
+                manager.frames_sent += 1
+                if sent is not None:
+                    _resolve(sent, True)
+                    sent = None
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Writer for user {self.user_id} stopped: {e}")
+            self.stop()
+        finally:
+            if sent is not None:
+                _resolve(sent, False)
+
+
+def _resolve(sent: asyncio.Future, written: bool):
+    if not sent.done():
+        sent.set_result(written)
 
 
 class ConnectionManager:
     def __init__(self):
-        self.active_connections: Dict[int, WebSocket] = {}
+        # user id -> session id -> connection
+        self.active_connections: Dict[int, Dict[str, ClientConnection]] = {}
         # self.user_friends: Dict[int, Set[int]] = {}
-
-    async def connect(self, user_id, websocket: WebSocket):
-        self.active_connections[user_id] = websocket
-        # await self.broadcast_status(user_id, "online")
-
-    async def disconnect(self, user_id):
-        if user_id in self.active_connections:
-            del self.active_connections[user_id]
-        # await self.broadcast_status(user_id, "offline")
+        self.frames_sent: int = 0
+        self.high_water_events: int = 0
+        self.evicted: int = 0
+        # close() tasks of evicted connections, kept alive until they finish
+        self.closing: Set[asyncio.Task] = set()
+
+    @property
+    def session_count(self) -> int:
+        return sum(len(sessions) for sessions in self.active_connections.values())
+
+    @property
+    def queued_frames(self) -> int:
+        return sum(
+            conn.queue.qsize()
+            for sessions in self.active_connections.values()
+            for conn in sessions.values()
+        )
+
+    async def connect(self, user_id, websocket: WebSocket) -> ClientConnection:
+        connection = ClientConnection(user_id, websocket)
+        connection.start()
+        self.active_connections.setdefault(user_id, {})[
+            connection.session_id
+        ] = connection
+        return connection
+
+    async def disconnect(self, user_id, session_id: str) -> bool:
+        """Drop one session. Returns True if the user has none left on this node."""
+        sessions = self.active_connections.get(user_id)
+        if sessions:
+            connection = sessions.pop(session_id, None)
+            if connection:
+                connection.stop()
+            if not sessions:
+                del self.active_connections[user_id]
+        # an evicted session was already removed by send_frame
+        return user_id not in self.active_connections
 
     async def send_private_message(self, reciever_id: int, msg: dict):
-        if reciever_id in self.active_connections:
-            try:
-                websocket = self.active_connections[reciever_id]
-                await websocket.send_json(
-                    {
-                        "type": "new_message",
-                        **msg,
-                    }
-                )
-                logger.debug(f"📨 Message sent to user {reciever_id}")
-                return True
-
-            except Exception as e:
-                logger.error(f"{e}")
-                await self.disconnect(reciever_id)
-                return False
+        return self.send_frame(reciever_id, dumps({"type": "new_message", **msg}))
+
+    def send_frame(
+        self,
+        user_id: int,
+        frame: str,
+        sent: Optional[List[asyncio.Future]] = None,
+    ) -> bool:
+        """
+        Queue an already serialized frame on every local session of a user.
+        With `sent`, a future per session is added to it that resolves to
+        whether the frame was written to that socket.
+        """
+        sessions = self.active_connections.get(user_id)
+        if not sessions:
+            return False
+        delivered = False
+        dropped = None
+        loop = asyncio.get_running_loop() if sent is not None else None
+        # the same frame string is queued on each session, nothing is copied
+        for connection in sessions.values():
+            future = loop.create_future() if loop else None
+            if connection.enqueue(frame, future):
+                delivered = True
+                if future is not None:
+                    sent.append(future)
+            else:
+                dropped = dropped or []
+                dropped.append(connection.session_id)
+        if dropped:
+            for session_id in dropped:
+                sessions.pop(session_id).stop()
+            if not sessions:
+                del self.active_connections[user_id]
+        if delivered:
+            logger.debug(f"📨 Frame queued for user {user_id}")
+        return delivered
+
+    def send_event(self, user_id: int, payload: dict) -> bool:
+        return self.send_frame(user_id, dumps(payload))
 
     def is_user_online(self, user_id: int) -> bool:
-        """Check if user is currently connected"""
+        """Check if user has at least one session on this node"""
         return user_id in self.active_connections
 
-    async def handle_redis_message(self, message_data: dict):
-        """Handle incoming Redis pub/sub messages"""
-        try:
-            message_type = message_data.get("type")
-            user_id = message_data.get("user_id")
-
-            if not user_id:
-                logger.warning("Redis message missing user_id")
-                return
-
-            # Check if user is connected to this container
+    async def handle_envelope(self, delivery: Tuple[List[int], str]):
+        """Forward a frame received on this node's channel to its local recipients"""
+        user_ids, frame = delivery
+        for user_id in user_ids:
             if user_id not in self.active_connections:
                 logger.debug(f"User {user_id} not connected to this container")
-                return
-
-            if message_type == "new_message":
-                # Extract message data (remove Redis-specific fields)
-                msg_data = {
-                    k: v
-                    for k, v in message_data.items()
-                    if k not in ["type", "user_id"]
-                }
-
-                # Send message to local WebSocket connection
-                success = await self.send_private_message(user_id, msg_data)
-
-                if success:
-                    logger.info(f"🔔 Redis message delivered to user {user_id}")
-                else:
-                    logger.warning(
-                        f"❌ Failed to deliver Redis message to user {user_id}"
-                    )
-
-            else:
-                logger.warning(f"Unknown Redis message type: {message_type}")
-
-        except Exception as e:
-            logger.error(f"Error handling Redis message: {e}", exc_info=True)
+                continue
+            if not self.send_frame(user_id, frame):
+                logger.warning(f"❌ Failed to deliver Redis message to user {user_id}")
+
+    def handle_stream_envelope(
+        self, delivery: Tuple[List[int], str]
+    ) -> List[asyncio.Future]:
+        """Queue a frame from this node's inbound stream for its local recipients;
+        returns a future per socket it was queued on (see core.streams)"""
+        user_ids, frame = delivery
+        sent: List[asyncio.Future] = []
+        for user_id in user_ids:
+            self.send_frame(user_id, frame, sent)
+        return sent
 
 
 manager = ConnectionManager()
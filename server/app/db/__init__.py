@@ -1,5 +1,6 @@
 from .database import (
     get_user_by_username,
+    get_user_by_id,
     get_user_by_email,
     init_db,
     db_connection,
@@ -8,6 +9,7 @@ from .database import (
 
 __all__ = [
     "get_user_by_username",
+    "get_user_by_id",
     "get_user_by_email",
     "init_db",
     "db_connection",
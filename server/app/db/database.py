@@ -4,6 +4,7 @@ from core.config import settings
 from typing import Optional
 from core.logger import logger
 import asyncpg
+from db.pool import pg_pool, USER_BY_ID, USER_BY_USERNAME, USER_BY_EMAIL
 
 db_connection = Database(settings.database_url, min_size=5, max_size=20)
 
@@ -39,6 +40,86 @@ async def create_database_if_not_exists():
         raise
 
 
+async def create_messages_table():
+    """
+    messages, range partitioned by month of created_at; partitions are
+    managed by db/partitions.py. On a database from before partitioning the
+    CREATE is a no-op and the rest upgrades the old table in place.
+    """
+    # a named sequence rather than SERIAL: a converted table keeps the old one
+    await db_connection.execute(
+        "CREATE SEQUENCE IF NOT EXISTS messages_id_seq AS INTEGER"
+    )
+    await db_connection.execute("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+            sender_id INTEGER NOT NULL,
+            reciever_id INTEGER NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            is_read BOOLEAN DEFAULT FALSE,
+            seq INTEGER,
+            search_vector TSVECTOR,
+
+            -- unique keys of a partitioned table must contain created_at
+            PRIMARY KEY (id, created_at),
+            CONSTRAINT fk_sender FOREIGN KEY (sender_id)
+                REFERENCES users(id) ON DELETE CASCADE,
+            CONSTRAINT fk_reciever FOREIGN KEY (reciever_id)
+                REFERENCES users(id) ON DELETE CASCADE
+        ) PARTITION BY RANGE (created_at)
+        """)
+    await db_connection.execute("ALTER SEQUENCE messages_id_seq OWNED BY messages.id")
+    logger.debug("Messages table created/verified")
+    # Create indexes for better query performance
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_reciever
+        ON messages(reciever_id, created_at DESC)
+        """)
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_sender
+        ON messages(sender_id, created_at DESC)
+        """)
+    # keyset pagination of a single conversation, see get_messages
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation
+        ON messages(
+            LEAST(sender_id, reciever_id),
+            GREATEST(sender_id, reciever_id),
+            created_at DESC,
+            id DESC
+        )
+        """)
+    # unread lookups for read receipts and inbox counters
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_unread
+        ON messages(reciever_id, sender_id, id)
+        WHERE NOT is_read
+        """)
+    # per-conversation sequence numbers, assigned by the message writer
+    await db_connection.execute("""
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS seq INTEGER
+        """)
+    # not UNIQUE: that would have to include created_at. The row lock on
+    # conversation_seqs already hands out every seq once.
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_conversation_seq
+        ON messages(LEAST(sender_id, reciever_id), GREATEST(sender_id, reciever_id), seq)
+        """)
+    # full-text search; search_vector is filled in by core.search_indexer
+    await db_connection.execute("""
+        ALTER TABLE messages ADD COLUMN IF NOT EXISTS search_vector TSVECTOR
+        """)
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_search
+        ON messages USING GIN (search_vector)
+        """)
+    await db_connection.execute("""
+        CREATE INDEX IF NOT EXISTS idx_messages_unindexed
+        ON messages(id) WHERE search_vector IS NULL
+        """)
+
+
 async def init_db():
     try:
         await db_connection.execute("""
@@ -51,32 +132,15 @@ async def init_db():
                 )
             """)
         logger.debug("Users table created/verified")
-        # message tables
+        await create_messages_table()
         await db_connection.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id SERIAL PRIMARY KEY,
-                sender_id INTEGER NOT NULL,
-                reciever_id INTEGER NOT NULL,
-                content TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT NOW(),
-                is_read BOOLEAN DEFAULT FALSE,
-                
-                CONSTRAINT fk_sender FOREIGN KEY (sender_id)
-                    REFERENCES users(id) ON DELETE CASCADE,
-                CONSTRAINT fk_reciever FOREIGN KEY (reciever_id)
-                    REFERENCES users(id) ON DELETE CASCADE
+            CREATE TABLE IF NOT EXISTS conversation_seqs (
+                low_user_id INTEGER NOT NULL,
+                high_user_id INTEGER NOT NULL,
+                last_seq INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (low_user_id, high_user_id)
             )
             """)
-        logger.debug("Messages table created/verified")
-        # Create indexes for better query performance
-        await db_connection.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_reciever
-            ON messages(reciever_id, created_at DESC)
-            """)
-        await db_connection.execute("""
-            CREATE INDEX IF NOT EXISTS idx_messages_sender
-            ON messages(sender_id, created_at DESC)
-            """)
         logger.debug("Database indexes created/verified")
         await db_connection.execute("""
                 CREATE TABLE IF NOT EXISTS friendships (
@@ -96,6 +160,19 @@ async def init_db():
             """)
 
         logger.debug("Friendships table init")
+        # people you may know, see db/suggestions.py
+        await db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS friend_suggestions (
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                candidate_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                mutual_count INTEGER NOT NULL,
+                PRIMARY KEY (user_id, candidate_id)
+            )
+            """)
+        await db_connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_friend_suggestions_rank
+            ON friend_suggestions(user_id, mutual_count DESC, candidate_id)
+            """)
         # conversations
         await db_connection.execute("""
                                     CREATE TABLE IF NOT EXISTS conversations (
@@ -107,6 +184,58 @@ async def init_db():
                                     is_read BOOLEAN DEFAULT FALSE)
                                     """)
         logger.debug("Conversations table init")
+        # inbox: one summary row per (user, conversation partner)
+        await db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS conversation_summaries (
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                other_user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                last_message_id INTEGER NOT NULL,
+                last_message TEXT NOT NULL,
+                last_message_time TIMESTAMP NOT NULL,
+                unread_count INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (user_id, other_user_id)
+            )
+            """)
+        await db_connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_conversation_summaries_inbox
+            ON conversation_summaries(user_id, last_message_time DESC)
+            """)
+        logger.debug("Conversation summaries table init")
+        # group chat
+        await db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS rooms (
+                id SERIAL PRIMARY KEY,
+                name TEXT NOT NULL,
+                owner_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            """)
+        await db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS room_members (
+                room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+                user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                joined_at TIMESTAMP DEFAULT NOW(),
+                PRIMARY KEY (room_id, user_id)
+            )
+            """)
+        await db_connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_room_members_user
+            ON room_members(user_id)
+            """)
+        await db_connection.execute("""
+            CREATE TABLE IF NOT EXISTS room_messages (
+                id SERIAL PRIMARY KEY,
+                room_id INTEGER NOT NULL REFERENCES rooms(id) ON DELETE CASCADE,
+                sender_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+                content TEXT NOT NULL,
+                created_at TIMESTAMP DEFAULT NOW()
+            )
+            """)
+        await db_connection.execute("""
+            CREATE INDEX IF NOT EXISTS idx_room_messages_room
+            ON room_messages(room_id, created_at DESC, id DESC)
+            """)
+        logger.debug("Rooms tables init")
 
         logger.info("✅ Database initialization complete")
     except Exception as e:
@@ -114,13 +243,9 @@ async def init_db():
         raise
 
 
-async def get_user_by_username(username: str) -> Optional[dict]:
+async def get_user_by_username(username: str) -> Optional[asyncpg.Record]:
     try:
-        row = await db_connection.fetch_one(
-            query="SELECT * FROM users WHERE username = :username",
-            values={"username": username},
-        )
-        return dict(row) if row else None
+        return await pg_pool.fetchrow(USER_BY_USERNAME, username)
     except Exception as e:
         logger.error(
             f"Error fetching user by username '{username}': {e}", exc_info=True
@@ -128,12 +253,17 @@ async def get_user_by_username(username: str) -> Optional[dict]:
         return None
 
 
-async def get_user_by_email(email: EmailStr) -> Optional[dict]:
+async def get_user_by_id(user_id: int) -> Optional[asyncpg.Record]:
     try:
-        row = await db_connection.fetch_one(
-            query="SELECT * FROM users WHERE email = :email", values={"email": email}
-        )
-        return dict(row) if row else None
+        return await pg_pool.fetchrow(USER_BY_ID, user_id)
+    except Exception as e:
+        logger.error(f"Error fetching user by id '{user_id}': {e}", exc_info=True)
+        return None
+
+
+async def get_user_by_email(email: EmailStr) -> Optional[asyncpg.Record]:
+    try:
+        return await pg_pool.fetchrow(USER_BY_EMAIL, email)
     except Exception as e:
         logger.error(f"Error fetching user by email '{email}': {e}", exc_info=True)
         return None
@@ -0,0 +1,34 @@
+"""
+Friend graph queries behind core.friend_cache.
+"""
+
+from typing import Dict, Iterable, List
+
+from db.database import db_connection
+
+
+async def get_relations(user_ids: Iterable[int]) -> Dict[int, List[dict]]:
+    """Accepted and blocked relations of each given user, in one query"""
+    user_ids = list(set(user_ids))
+    if not user_ids:
+        return {}
+    placeholders = ", ".join(f":user_id_{i}" for i in range(len(user_ids)))
+    values = {f"user_id_{i}": user_id for i, user_id in enumerate(user_ids)}
+    # two branches so each side can use idx_friendships_user / idx_friendships_friend
+    rows = await db_connection.fetch_all(
+        query=f"""
+            SELECT f.user_id AS owner_id, u.id, u.username, f.status, f.created_at
+            FROM friendships f JOIN users u ON u.id = f.friend_id
+            WHERE f.user_id IN ({placeholders}) AND f.status IN ('accepted', 'blocked')
+            UNION ALL
+            SELECT f.friend_id, u.id, u.username, f.status, f.created_at
+            FROM friendships f JOIN users u ON u.id = f.user_id
+            WHERE f.friend_id IN ({placeholders}) AND f.status IN ('accepted', 'blocked')
+        """,
+        values=values,
+    )
+    relations: Dict[int, List[dict]] = {user_id: [] for user_id in user_ids}
+    for row in rows:
+        row = dict(row)
+        relations[row.pop("owner_id")].append(row)
+    return relations
@@ -0,0 +1,124 @@
+"""
+Per-user conversation summaries backing the inbox (/messages/conversations).
+
+Each user has one row per conversation partner holding the last message
+preview and an unread counter, updated as messages are saved so the inbox
+never has to scan the messages table.
+"""
+
+from typing import Dict, Iterable, Tuple
+
+from core.logger import logger
+from db.database import db_connection
+
+PREVIEW_LENGTH = 200
+
+
+def summarize_messages(messages: Iterable) -> Dict[Tuple[int, int], dict]:
+    """Collapse saved messages into one summary change per (user, other user)"""
+    summaries: Dict[Tuple[int, int], dict] = {}
+    for message in messages:
+        sender_id, reciever_id = message["sender_id"], message["reciever_id"]
+        for user_id, other_user_id, unread in (
+            (sender_id, reciever_id, 0),
+            (reciever_id, sender_id, int(sender_id != reciever_id)),
+        ):
+            key = (user_id, other_user_id)
+            current = summaries.get(key)
+            if current is None:
+                current = summaries[key] = {"unread": 0, "last_message_id": 0}
+            current["unread"] += unread
+            if message["id"] > current["last_message_id"]:
+                current["last_message_id"] = message["id"]
+                current["last_message"] = message["content"][:PREVIEW_LENGTH]
+                current["last_message_time"] = message["created_at"]
+    return summaries
+
+
+UPSERT_SUMMARIES = """
+    INSERT INTO conversation_summaries AS s
+        (user_id, other_user_id, last_message_id, last_message,
+         last_message_time, unread_count)
+    SELECT * FROM unnest(
+        $1::integer[], $2::integer[], $3::integer[], $4::text[],
+        $5::timestamp[], $6::integer[]
+    )
+    ON CONFLICT (user_id, other_user_id) DO UPDATE SET
+        last_message = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+            THEN EXCLUDED.last_message ELSE s.last_message END,
+        last_message_time = CASE WHEN EXCLUDED.last_message_id > s.last_message_id
+            THEN EXCLUDED.last_message_time ELSE s.last_message_time END,
+        last_message_id = GREATEST(EXCLUDED.last_message_id, s.last_message_id),
+        unread_count = s.unread_count + EXCLUDED.unread_count
+"""
+
+
+async def update_conversation_summaries(conn, messages: Iterable):
+    """
+    Fold a batch of saved messages into the summary table with one upsert.
+    conn is the asyncpg connection of the insert's transaction, so a message
+    and its unread increment become visible together (see core.read_receipts).
+    """
+    summaries = summarize_messages(messages)
+    if not summaries:
+        return
+
+    # a fixed key order keeps concurrent upserts from deadlocking each other
+    keys = sorted(summaries)
+    await conn.execute(
+        UPSERT_SUMMARIES,
+        [user_id for user_id, _ in keys],
+        [other_user_id for _, other_user_id in keys],
+        [summaries[key]["last_message_id"] for key in keys],
+        [summaries[key]["last_message"] for key in keys],
+        [summaries[key]["last_message_time"] for key in keys],
+        [summaries[key]["unread"] for key in keys],
+    )
+
+
+async def delete_conversation_summaries(user_id: int, other_user_id: int):
+    await db_connection.execute(
+        query="""
+            DELETE FROM conversation_summaries
+            WHERE (user_id = :user_id AND other_user_id = :other_user_id)
+            OR (user_id = :other_user_id AND other_user_id = :user_id)
+        """,
+        values={"user_id": user_id, "other_user_id": other_user_id},
+    )
+
+
+async def rebuild_conversation_summaries():
+    """Recompute every summary from the messages table (backfill / repair)"""
+    async with db_connection.transaction():
+        await db_connection.execute("DELETE FROM conversation_summaries")
+        await db_connection.execute(f"""
+            INSERT INTO conversation_summaries
+                (user_id, other_user_id, last_message_id, last_message,
+                 last_message_time, unread_count)
+            SELECT DISTINCT ON (p.user_id, p.other_user_id)
+                p.user_id,
+                p.other_user_id,
+                p.id,
+                LEFT(p.content, {PREVIEW_LENGTH}),
+                p.created_at,
+                COALESCE(unread.total, 0)
+            FROM (
+                SELECT sender_id AS user_id, reciever_id AS other_user_id,
+                       id, content, created_at
+                FROM messages
+                UNION ALL
+                SELECT reciever_id, sender_id, id, content, created_at
+                FROM messages
+            ) p
+            LEFT JOIN (
+                SELECT reciever_id, sender_id, COUNT(*) AS total
+                FROM messages
+                WHERE NOT is_read AND sender_id <> reciever_id
+                GROUP BY reciever_id, sender_id
+            ) unread
+                ON unread.reciever_id = p.user_id AND unread.sender_id = p.other_user_id
+            ORDER BY p.user_id, p.other_user_id, p.created_at DESC, p.id DESC
+            """)
+    total = await db_connection.fetch_val("SELECT COUNT(*) FROM conversation_summaries")
+    logger.info(f"Rebuilt {total} conversation summaries")
+    return total
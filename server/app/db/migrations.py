@@ -0,0 +1,122 @@
+"""
+Versioned schema migrations.
+
+Applied versions are recorded in schema_migrations. `python migrate.py`
+applies the pending steps in order while holding an advisory lock, so
+replicas started together never run DDL concurrently; the application
+itself only checks that the database is at SCHEMA_VERSION.
+
+Version 1 is the idempotent init_db DDL, which also brings databases from
+before this runner up to date. New schema changes go into a new step at the
+end of MIGRATIONS; a step may run outside a transaction, so it must be safe
+to run again if it fails halfway.
+"""
+
+from datetime import date
+from typing import Awaitable, Callable, List, Tuple
+
+from asyncpg.exceptions import UndefinedTableError
+
+from core.logger import logger
+from db.database import db_connection, init_db
+from db.inbox import rebuild_conversation_summaries
+from db.partitions import messages_partitioned, partition_legacy_messages
+from db.sequences import backfill_message_seqs
+from db.suggestions import rebuild_friend_suggestions
+
+# (namespace, key) of the advisory lock, see core.message_partitions
+MIGRATION_LOCK = (1, 22)
+
+
+async def partition_messages():
+    if not await messages_partitioned():
+        await partition_legacy_messages(date.today())
+
+
+async def backfill_conversation_summaries():
+    if await db_connection.fetch_val("""
+        SELECT EXISTS (SELECT 1 FROM messages)
+        AND NOT EXISTS (SELECT 1 FROM conversation_summaries)
+        """):
+        await rebuild_conversation_summaries()
+
+
+async def backfill_seqs():
+    # messages saved before sequence numbers existed
+    if await db_connection.fetch_val(
+        "SELECT EXISTS (SELECT 1 FROM messages WHERE seq IS NULL)"
+    ):
+        await backfill_message_seqs()
+
+
+async def backfill_friend_suggestions():
+    if await db_connection.fetch_val("""
+        SELECT EXISTS (SELECT 1 FROM friendships WHERE status = 'accepted')
+        AND NOT EXISTS (SELECT 1 FROM friend_suggestions)
+        """):
+        await rebuild_friend_suggestions()
+
+
+MIGRATIONS: List[Tuple[int, str, Callable[[], Awaitable]]] = [
+    (1, "base schema", init_db),
+    (2, "partition messages by month", partition_messages),
+    (3, "backfill conversation summaries", backfill_conversation_summaries),
+    (4, "backfill message sequence numbers", backfill_seqs),
+    (5, "build friend suggestions", backfill_friend_suggestions),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_schema_version() -> int:
+    """Highest applied version; 0 for a database the runner never touched"""
+    try:
+        return await db_connection.fetch_val(
+            "SELECT COALESCE(MAX(version), 0) FROM schema_migrations"
+        )
+    except UndefinedTableError:
+        return 0
+
+
+async def apply_migrations() -> List[int]:
+    """Apply every pending step; returns the versions applied"""
+    applied = []
+    # one connection for the whole run, so the session lock holds throughout
+    async with db_connection.connection():
+        await db_connection.execute(
+            query="SELECT pg_advisory_lock(:namespace, :key)",
+            values=dict(zip(("namespace", "key"), MIGRATION_LOCK)),
+        )
+        try:
+            await db_connection.execute("""
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version INTEGER PRIMARY KEY,
+                    description TEXT NOT NULL,
+                    applied_at TIMESTAMP NOT NULL DEFAULT NOW()
+                )
+                """)
+            # read under the lock: another runner may have just finished
+            current = await get_schema_version()
+            for version, description, step in MIGRATIONS:
+                if version <= current:
+                    continue
+                logger.info(f"Applying migration {version}: {description}")
+                await step()
+                await db_connection.execute(
+                    query="""
+                        INSERT INTO schema_migrations (version, description)
+                        VALUES (:version, :description)
+                    """,
+                    values={"version": version, "description": description},
+                )
+                applied.append(version)
+        finally:
+            await db_connection.execute(
+                query="SELECT pg_advisory_unlock(:namespace, :key)",
+                values=dict(zip(("namespace", "key"), MIGRATION_LOCK)),
+            )
+    if applied:
+        logger.info(f"Schema migrated to version {SCHEMA_VERSION}")
+    else:
+        logger.info(f"Schema already at version {SCHEMA_VERSION}")
+    return applied
@@ -0,0 +1,183 @@
+"""
+Monthly range partitions of the messages table.
+
+messages is partitioned by created_at, one partition per calendar month
+(messages_y2026m01, ...), created ahead of time by core.message_partitions.
+Old months are removed by detaching or dropping whole partitions, never by
+row-by-row DELETEs. A database created before partitioning is converted by
+partition_legacy_messages: the old heap becomes the partition messages_legacy
+holding everything before the cutover month, so no rows are copied.
+"""
+
+import re
+from datetime import date
+from typing import List, Tuple
+
+from core.logger import logger
+from db.database import db_connection, create_messages_table
+
+LEGACY_PARTITION = "messages_legacy"
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def month_start(day: date, months: int = 0) -> date:
+    """First day of the month `months` after the one containing day"""
+    index = day.year * 12 + day.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"messages_y{month.year}m{month.month:02d}"
+
+
+async def messages_partitioned() -> bool:
+    return (
+        await db_connection.fetch_val(
+            "SELECT relkind::text FROM pg_class WHERE oid = to_regclass('messages')"
+        )
+        == "p"
+    )
+
+
+async def create_month_partition(month: date) -> bool:
+    """Create the partition for the month starting at `month`; False if it exists"""
+    name = partition_name(month)
+    if await db_connection.fetch_val(
+        query="SELECT to_regclass(:name) IS NOT NULL", values={"name": name}
+    ):
+        return False
+    # bounds are dates this module computed, never user input
+    await db_connection.execute(f"""
+        CREATE TABLE {name} PARTITION OF messages
+        FOR VALUES FROM ('{month.isoformat()}') TO ('{month_start(month, 1).isoformat()}')
+        """)
+    logger.info(f"Created message partition {name}")
+    return True
+
+
+async def ensure_message_partitions(today: date, months_ahead: int) -> int:
+    """Make sure the current month and the next months_ahead have partitions"""
+    start = month_start(today)
+    # after a conversion the legacy partition still covers the cutover month
+    legacy_end = dict(await list_message_partitions()).get(LEGACY_PARTITION)
+    created = 0
+    for months in range(months_ahead + 1):
+        month = month_start(start, months)
+        if legacy_end and month < legacy_end:
+            continue
+        if await create_month_partition(month):
+            created += 1
+    return created
+
+
+async def list_message_partitions() -> List[Tuple[str, date]]:
+    """(partition name, exclusive upper bound) of every partition, oldest first"""
+    rows = await db_connection.fetch_all("""
+        SELECT c.relname AS name, pg_get_expr(c.relpartbound, c.oid) AS bound
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('messages')
+        """)
+    partitions = []
+    for row in rows:
+        match = _UPPER_BOUND.search(row["bound"])
+        if match:
+            partitions.append((row["name"], date.fromisoformat(match.group(1)[:10])))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+async def expire_message_partitions(
+    today: date, retention_months: int, action: str
+) -> List[str]:
+    """
+    Detach or drop partitions that only hold messages older than
+    retention_months full months. Detached partitions stay as plain tables
+    for archival (e.g. pg_dump, then DROP TABLE).
+    """
+    cutoff = month_start(today, -retention_months)
+    expired = []
+    for name, upper_bound in await list_message_partitions():
+        if upper_bound > cutoff:
+            break
+        if action == "drop":
+            await db_connection.execute(f"DROP TABLE {name}")
+        else:
+            await db_connection.execute(f"ALTER TABLE messages DETACH PARTITION {name}")
+        logger.info(f"Message partition {name} expired ({action})")
+        expired.append(name)
+    return expired
+
+
+async def partition_legacy_messages(today: date):
+    """
+    Turn an unpartitioned messages table into the partition messages_legacy
+    of a new partitioned messages table, covering everything before next
+    month. The slow parts (validating created_at and building the indexes a
+    partition needs) run first without blocking writes; the swap itself only
+    changes catalog entries under a short exclusive lock. Messages keep
+    going to the old table until the swap, so do not run this in the last
+    minutes of a month.
+    """
+    cutover = month_start(today, 1).isoformat()
+
+    # created_at becomes part of the key, so it may not be NULL
+    await db_connection.execute(
+        "UPDATE messages SET created_at = 'epoch' WHERE created_at IS NULL"
+    )
+    await db_connection.execute(
+        "ALTER TABLE messages DROP CONSTRAINT IF EXISTS messages_legacy_bound"
+    )
+    await db_connection.execute(f"""
+        ALTER TABLE messages ADD CONSTRAINT messages_legacy_bound
+        CHECK (created_at IS NOT NULL AND created_at < '{cutover}') NOT VALID
+        """)
+    await db_connection.execute(
+        "ALTER TABLE messages VALIDATE CONSTRAINT messages_legacy_bound"
+    )
+    await db_connection.execute("""
+        CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_key
+        ON messages(id, created_at)
+        """)
+    # the partitioned index is not unique, see create_messages_table
+    await db_connection.execute("""
+        CREATE INDEX CONCURRENTLY IF NOT EXISTS messages_legacy_conversation_seq
+        ON messages(LEAST(sender_id, reciever_id), GREATEST(sender_id, reciever_id), seq)
+        """)
+
+    async with db_connection.transaction():
+        await db_connection.execute("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE")
+        await db_connection.execute(
+            f"ALTER TABLE messages RENAME TO {LEGACY_PARTITION}"
+        )
+        await db_connection.execute(
+            "DROP INDEX IF EXISTS idx_messages_conversation_seq"
+        )
+        # free the index names for the partitioned table; ATTACH reuses the
+        # old indexes because their definitions match
+        index_names = await db_connection.fetch_all(
+            query="""
+                SELECT indexname FROM pg_indexes
+                WHERE tablename = :table AND indexname LIKE 'idx_messages_%'
+            """,
+            values={"table": LEGACY_PARTITION},
+        )
+        for row in index_names:
+            await db_connection.execute(
+                f"ALTER INDEX {row['indexname']} RENAME TO legacy_{row['indexname']}"
+            )
+        await db_connection.execute(f"""
+            ALTER TABLE {LEGACY_PARTITION}
+                ALTER COLUMN created_at SET NOT NULL,
+                DROP CONSTRAINT messages_pkey,
+                ADD CONSTRAINT messages_legacy_pkey PRIMARY KEY USING INDEX messages_legacy_key
+            """)
+        await create_messages_table()
+        await db_connection.execute(f"""
+            ALTER TABLE messages ATTACH PARTITION {LEGACY_PARTITION}
+            FOR VALUES FROM (MINVALUE) TO ('{cutover}')
+            """)
+        await db_connection.execute(
+            f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT messages_legacy_bound"
+        )
+    logger.info(f"messages is now partitioned; older rows are in {LEGACY_PARTITION}")
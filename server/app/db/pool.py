@@ -0,0 +1,152 @@
+"""
+Raw asyncpg pool for the hot paths: saving messages, user lookups, a
+conversation page and the inbox.
+
+Everything else keeps using `databases` (db_connection). These queries skip
+its per-call named-parameter rewriting and Record wrapping. Each has a fixed
+SQL text with positional parameters, so asyncpg's statement cache prepares
+it once per connection and reuses the plan from then on. Batches are passed
+as arrays and expanded with unnest, so the statement text does not depend on
+the batch size. Rows come back as plain asyncpg Records.
+"""
+
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import asyncpg
+
+from core.config import settings
+from core.logger import logger
+
+USER_BY_ID = "SELECT * FROM users WHERE id = $1"
+USER_BY_USERNAME = "SELECT * FROM users WHERE username = $1"
+USER_BY_EMAIL = "SELECT * FROM users WHERE email = $1"
+
+# INSERT ... SELECT does not promise to insert (or number) rows in array
+# order, so each row takes its id up front and is returned with its ordinal
+INSERT_MESSAGES = """
+    WITH input AS (
+        SELECT nextval('messages_id_seq')::integer AS id, t.*
+        FROM unnest($1::integer[], $2::integer[], $3::text[], $4::integer[])
+            WITH ORDINALITY AS t(sender_id, reciever_id, content, seq, ord)
+    ), inserted AS (
+        INSERT INTO messages (id, sender_id, reciever_id, content, seq)
+        SELECT id, sender_id, reciever_id, content, seq FROM input
+        RETURNING id, sender_id, reciever_id, content, created_at, is_read, seq
+    )
+    SELECT inserted.*, input.ord
+    FROM inserted JOIN input USING (id)
+"""
+
+_CONVERSATION = """
+    SELECT id, sender_id, reciever_id, content, created_at, is_read, seq
+    FROM messages
+    WHERE LEAST(sender_id, reciever_id) = $1
+    AND GREATEST(sender_id, reciever_id) = $2
+"""
+CONVERSATION_PAGE = f"""{_CONVERSATION}
+    ORDER BY created_at DESC, id DESC
+    LIMIT $3 OFFSET $4
+"""
+# the plain created_at bound lets the planner skip partitions
+CONVERSATION_BEFORE = f"""{_CONVERSATION}
+    AND created_at <= $4
+    AND (created_at, id) < ($4, $5)
+    ORDER BY created_at DESC, id DESC
+    LIMIT $3
+"""
+CONVERSATION_AFTER = f"""{_CONVERSATION}
+    AND created_at >= $4
+    AND (created_at, id) > ($4, $5)
+    ORDER BY created_at ASC, id ASC
+    LIMIT $3
+"""
+
+INBOX = """
+    SELECT s.other_user_id, u.username, s.last_message, s.last_message_time,
+           s.unread_count
+    FROM conversation_summaries s
+    JOIN users u ON u.id = s.other_user_id
+    WHERE s.user_id = $1
+    ORDER BY s.last_message_time DESC
+    LIMIT $2 OFFSET $3
+"""
+
+
+class PgPool:
+    def __init__(self, host: str, port: int, min_size: int, max_size: int):
+        self.host = host
+        self.port = port
+        self.min_size = min_size
+        self.max_size = max_size
+        self.pool: Optional[asyncpg.Pool] = None
+
+    async def connect(self):
+        if self.pool is None:
+            self.pool = await asyncpg.create_pool(
+                host=self.host,
+                port=self.port,
+                user=settings.postgres_user,
+                password=settings.postgres_password,
+                database=settings.postgres_db,
+                min_size=self.min_size,
+                max_size=self.max_size,
+            )
+            logger.info(
+                f"Pool to {self.host}:{self.port} connected "
+                f"({self.min_size}-{self.max_size})"
+            )
+
+    async def disconnect(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def fetchrow(self, query: str, *args) -> Optional[asyncpg.Record]:
+        return await self.pool.fetchrow(query, *args)
+
+    async def fetch(self, query: str, *args) -> List[asyncpg.Record]:
+        return await self.pool.fetch(query, *args)
+
+    async def conversation_page(
+        self,
+        low_id: int,
+        high_id: int,
+        limit: int,
+        offset: int = 0,
+        before: Optional[Tuple[datetime, int]] = None,
+        after: Optional[Tuple[datetime, int]] = None,
+    ) -> List[asyncpg.Record]:
+        """Newest-first page of a conversation (oldest-first with `after`)"""
+        if before:
+            return await self.fetch(
+                CONVERSATION_BEFORE, low_id, high_id, limit, *before
+            )
+        if after:
+            return await self.fetch(CONVERSATION_AFTER, low_id, high_id, limit, *after)
+        return await self.fetch(CONVERSATION_PAGE, low_id, high_id, limit, offset)
+
+    async def inbox(
+        self, user_id: int, limit: int, offset: int
+    ) -> List[asyncpg.Record]:
+        return await self.fetch(INBOX, user_id, limit, offset)
+
+
+pg_pool = PgPool(
+    host=settings.postgres_host,
+    port=settings.postgres_port,
+    min_size=settings.db_pool_min_size,
+    max_size=settings.db_pool_max_size,
+)
+
+# read-only queries may go here instead, see core.replicas
+replica_pool: Optional[PgPool] = (
+    PgPool(
+        host=settings.replica_host,
+        port=settings.replica_port,
+        min_size=settings.db_pool_min_size,
+        max_size=settings.db_pool_max_size,
+    )
+    if settings.replica_host
+    else None
+)
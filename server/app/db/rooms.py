@@ -0,0 +1,108 @@
+"""
+Room (group chat) queries. Membership lives in room_members; messages are
+stored once per room in room_messages, not once per member.
+"""
+
+from typing import Iterable, List, Optional
+
+from db.database import db_connection
+
+
+async def create_room(name: str, owner_id: int, member_ids: Iterable[int]) -> dict:
+    """Create a room owned by owner_id, with the owner and member_ids joined"""
+    members = sorted({owner_id, *member_ids})
+    async with db_connection.transaction():
+        room = await db_connection.fetch_one(
+            query="""
+                INSERT INTO rooms (name, owner_id) VALUES (:name, :owner_id)
+                RETURNING id, name, owner_id, created_at
+            """,
+            values={"name": name, "owner_id": owner_id},
+        )
+        rows = []
+        values = {"room_id": room["id"]}
+        for i, user_id in enumerate(members):
+            rows.append(f"(:room_id, :user_id_{i})")
+            values[f"user_id_{i}"] = user_id
+        await db_connection.execute(
+            query=f"""
+                INSERT INTO room_members (room_id, user_id)
+                VALUES {", ".join(rows)}
+                ON CONFLICT DO NOTHING
+            """,
+            values=values,
+        )
+    return dict(room)
+
+
+async def get_room(room_id: int) -> Optional[dict]:
+    row = await db_connection.fetch_one(
+        query="SELECT id, name, owner_id, created_at FROM rooms WHERE id = :room_id",
+        values={"room_id": room_id},
+    )
+    return dict(row) if row else None
+
+
+async def get_user_rooms(user_id: int) -> List[dict]:
+    rows = await db_connection.fetch_all(
+        query="""
+            SELECT r.id, r.name, r.owner_id, r.created_at
+            FROM room_members m
+            JOIN rooms r ON r.id = m.room_id
+            WHERE m.user_id = :user_id
+            ORDER BY r.id
+        """,
+        values={"user_id": user_id},
+    )
+    return [dict(row) for row in rows]
+
+
+async def get_room_member_ids(room_id: int) -> List[int]:
+    rows = await db_connection.fetch_all(
+        query="SELECT user_id FROM room_members WHERE room_id = :room_id",
+        values={"room_id": room_id},
+    )
+    return [row["user_id"] for row in rows]
+
+
+async def count_room_members(room_id: int) -> int:
+    return await db_connection.fetch_val(
+        query="SELECT COUNT(*) FROM room_members WHERE room_id = :room_id",
+        values={"room_id": room_id},
+    )
+
+
+async def add_room_member(room_id: int, user_id: int) -> bool:
+    """Returns False if the user was already a member"""
+    row = await db_connection.fetch_one(
+        query="""
+            INSERT INTO room_members (room_id, user_id) VALUES (:room_id, :user_id)
+            ON CONFLICT DO NOTHING
+            RETURNING user_id
+        """,
+        values={"room_id": room_id, "user_id": user_id},
+    )
+    return row is not None
+
+
+async def remove_room_member(room_id: int, user_id: int) -> bool:
+    row = await db_connection.fetch_one(
+        query="""
+            DELETE FROM room_members WHERE room_id = :room_id AND user_id = :user_id
+            RETURNING user_id
+        """,
+        values={"room_id": room_id, "user_id": user_id},
+    )
+    return row is not None
+
+
+async def insert_room_message(room_id: int, sender_id: int, content: str) -> dict:
+    row = await db_connection.fetch_one(
+        query="""
+            INSERT INTO room_messages (room_id, sender_id, content)
+            VALUES (:room_id, :sender_id, :content)
+            RETURNING id, room_id, sender_id, content, created_at
+        """,
+        values={"room_id": room_id, "sender_id": sender_id, "content": content},
+    )
+    return dict(row)
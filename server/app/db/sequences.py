@@ -0,0 +1,101 @@
+"""
+Per-conversation message sequence numbers.
+
+Every 1:1 conversation has a counter in conversation_seqs. The message writer
+reserves a block of numbers for each conversation in a batch, inside the same
+transaction as the INSERT, so the row lock orders concurrent writers and a
+higher seq is never visible before a lower one. Clients use seq to ask for
+"everything after N" and to detect gaps.
+"""
+
+from typing import Dict, List, Sequence, Tuple
+
+from core.logger import logger
+from db.database import db_connection
+
+
+def conversation_key(sender_id: int, reciever_id: int) -> Tuple[int, int]:
+    return min(sender_id, reciever_id), max(sender_id, reciever_id)
+
+
+RESERVE_SEQS = """
+    INSERT INTO conversation_seqs AS c (low_user_id, high_user_id, last_seq)
+    SELECT * FROM unnest($1::integer[], $2::integer[], $3::integer[])
+    ON CONFLICT (low_user_id, high_user_id)
+    DO UPDATE SET last_seq = c.last_seq + EXCLUDED.last_seq
+    RETURNING low_user_id, high_user_id, last_seq
+"""
+
+
+async def reserve_seqs(conn, messages: Sequence[Tuple[int, int, str]]) -> List[int]:
+    """
+    Reserve the next sequence numbers for (sender_id, reciever_id, content)
+    messages, returned in message order. conn is the asyncpg connection of the
+    insert's transaction (see db.pool).
+    """
+    counts: Dict[Tuple[int, int], int] = {}
+    for sender_id, reciever_id, _ in messages:
+        key = conversation_key(sender_id, reciever_id)
+        counts[key] = counts.get(key, 0) + 1
+
+    # sorted keys: concurrent batches lock counter rows in the same order
+    keys = sorted(counts)
+    rows = await conn.fetch(
+        RESERVE_SEQS,
+        [low_id for low_id, _ in keys],
+        [high_id for _, high_id in keys],
+        [counts[key] for key in keys],
+    )
+
+    # first number of each reserved block
+    next_seq = {
+        (row["low_user_id"], row["high_user_id"]): row["last_seq"]
+        - counts[(row["low_user_id"], row["high_user_id"])]
+        + 1
+        for row in rows
+    }
+    seqs = []
+    for sender_id, reciever_id, _ in messages:
+        key = conversation_key(sender_id, reciever_id)
+        seqs.append(next_seq[key])
+        next_seq[key] += 1
+    return seqs
+
+
+async def backfill_message_seqs() -> int:
+    """Number messages saved without a seq, after any already numbered ones"""
+    async with db_connection.transaction():
+        await db_connection.execute(
+            "LOCK TABLE conversation_seqs IN SHARE ROW EXCLUSIVE MODE"
+        )
+        updated = await db_connection.fetch_val("""
+            WITH numbered AS (
+                SELECT m.id,
+                    COALESCE(c.last_seq, 0) + ROW_NUMBER() OVER (
+                        PARTITION BY LEAST(m.sender_id, m.reciever_id),
+                                     GREATEST(m.sender_id, m.reciever_id)
+                        ORDER BY m.created_at, m.id
+                    ) AS seq
+                FROM messages m
+                LEFT JOIN conversation_seqs c
+                    ON c.low_user_id = LEAST(m.sender_id, m.reciever_id)
+                    AND c.high_user_id = GREATEST(m.sender_id, m.reciever_id)
+                WHERE m.seq IS NULL
+            ), updated AS (
+                UPDATE messages m SET seq = numbered.seq
+                FROM numbered WHERE m.id = numbered.id
+                RETURNING 1
+            )
+            SELECT COUNT(*) FROM updated
+            """)
+        await db_connection.execute("""
+            INSERT INTO conversation_seqs (low_user_id, high_user_id, last_seq)
+            SELECT LEAST(sender_id, reciever_id), GREATEST(sender_id, reciever_id),
+                   MAX(seq)
+            FROM messages
+            GROUP BY 1, 2
+            ON CONFLICT (low_user_id, high_user_id)
+            DO UPDATE SET last_seq = GREATEST(conversation_seqs.last_seq, EXCLUDED.last_seq)
+            """)
+    logger.info(f"Assigned sequence numbers to {updated} messages")
+    return updated
@@ -0,0 +1,163 @@
+"""
+Precomputed friend suggestions ("people you may know").
+
+friend_suggestions holds, for every pair of users with at least one friend in
+common, how many friends they share. It is kept exact incrementally: when
+a-b becomes a friendship, b gains a as a mutual friend with every friend of
+a (and vice versa); when it ends, those counts go down again. Rows are not
+pruned when the pair itself becomes related, that filter is applied per page.
+"""
+
+from typing import List, Optional, Tuple
+
+from asyncpg import Record
+
+from core.logger import logger
+from db.database import db_connection
+from db.pool import PgPool
+
+FRIENDS_OF = """
+    SELECT friend_id AS id FROM friendships WHERE user_id = :{user} AND status = 'accepted'
+    UNION ALL
+    SELECT user_id FROM friendships WHERE friend_id = :{user} AND status = 'accepted'
+"""
+
+# pairs whose mutual count changes when the friendship a-b starts or ends
+AFFECTED_PAIRS = f"""
+    SELECT CAST(:b AS INTEGER) AS user_id, fa.id AS candidate_id
+        FROM ({FRIENDS_OF.format(user="a")}) fa WHERE fa.id <> :b
+    UNION ALL
+    SELECT fa.id, CAST(:b AS INTEGER)
+        FROM ({FRIENDS_OF.format(user="a")}) fa WHERE fa.id <> :b
+    UNION ALL
+    SELECT CAST(:a AS INTEGER), fb.id
+        FROM ({FRIENDS_OF.format(user="b")}) fb WHERE fb.id <> :a
+    UNION ALL
+    SELECT fb.id, CAST(:a AS INTEGER)
+        FROM ({FRIENDS_OF.format(user="b")}) fb WHERE fb.id <> :a
+"""
+
+
+async def lock_friendship_pair(user_id: int, friend_id: int):
+    """
+    Serialize friendship changes touching either user until the transaction
+    ends, so two concurrent accepts never both miss each other's new friend.
+    """
+    for key in sorted((user_id, friend_id)):
+        await db_connection.execute(
+            query="SELECT pg_advisory_xact_lock(CAST(:key AS BIGINT))",
+            values={"key": key},
+        )
+
+
+async def add_friendship_suggestions(user_id: int, friend_id: int):
+    """Count user_id and friend_id as a new mutual friend; call inside the
+    transaction that accepts the friendship, after lock_friendship_pair"""
+    await db_connection.execute(
+        query=f"""
+            INSERT INTO friend_suggestions AS s (user_id, candidate_id, mutual_count)
+            SELECT user_id, candidate_id, 1 FROM ({AFFECTED_PAIRS}) p
+            ORDER BY user_id, candidate_id
+            ON CONFLICT (user_id, candidate_id)
+            DO UPDATE SET mutual_count = s.mutual_count + 1
+        """,
+        values={"a": user_id, "b": friend_id},
+    )
+
+
+async def remove_friendship_suggestions(user_id: int, friend_id: int):
+    """Undo add_friendship_suggestions; call inside the transaction that ends
+    the friendship, after the row stopped being 'accepted'"""
+    values = {"a": user_id, "b": friend_id}
+    await db_connection.execute(
+        query=f"""
+            UPDATE friend_suggestions s SET mutual_count = s.mutual_count - 1
+            FROM ({AFFECTED_PAIRS}) p
+            WHERE s.user_id = p.user_id AND s.candidate_id = p.candidate_id
+        """,
+        values=values,
+    )
+    await db_connection.execute(
+        query="""
+            DELETE FROM friend_suggestions
+            WHERE (user_id IN (:a, :b) OR candidate_id IN (:a, :b))
+            AND mutual_count <= 0
+        """,
+        values=values,
+    )
+
+
+# read-only pages; positional so they run on either pool in db.pool
+SUGGESTIONS_PAGE = """
+    SELECT u.id, u.username, s.mutual_count
+    FROM friend_suggestions s
+    JOIN users u ON u.id = s.candidate_id
+    WHERE s.user_id = $1
+    AND ($3::integer IS NULL OR s.mutual_count < $3
+        OR (s.mutual_count = $3 AND s.candidate_id > $4))
+    AND NOT EXISTS (
+        SELECT 1 FROM friendships f
+        WHERE f.user_id = $1 AND f.friend_id = s.candidate_id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM friendships f
+        WHERE f.user_id = s.candidate_id AND f.friend_id = $1
+    )
+    ORDER BY s.mutual_count DESC, s.candidate_id
+    LIMIT $2
+"""
+
+FALLBACK_SUGGESTIONS = """
+    SELECT u.id, u.username, 0 AS mutual_count
+    FROM users u
+    WHERE u.id <> $1
+    AND u.id <> ALL($3::integer[])
+    AND NOT EXISTS (
+        SELECT 1 FROM friendships f
+        WHERE f.user_id = $1 AND f.friend_id = u.id
+    )
+    AND NOT EXISTS (
+        SELECT 1 FROM friendships f
+        WHERE f.user_id = u.id AND f.friend_id = $1
+    )
+    ORDER BY u.id DESC
+    LIMIT $2
+"""
+
+
+async def get_suggestions(
+    pool: PgPool, user_id: int, limit: int, after: Optional[Tuple[int, int]]
+) -> List[Record]:
+    """A page of candidates by mutual count, skipping users already related"""
+    cursor_count, cursor_id = after or (None, None)
+    return await pool.fetch(SUGGESTIONS_PAGE, user_id, limit, cursor_count, cursor_id)
+
+
+async def get_fallback_suggestions(
+    pool: PgPool, user_id: int, limit: int, exclude: List[int]
+) -> List[Record]:
+    """Newest unrelated users, for accounts with too few friends to rank"""
+    return await pool.fetch(FALLBACK_SUGGESTIONS, user_id, limit, exclude)
+
+
+async def rebuild_friend_suggestions() -> int:
+    """Recompute every mutual count from the friendships table"""
+    async with db_connection.transaction():
+        await db_connection.execute("DELETE FROM friend_suggestions")
+        await db_connection.execute("""
+            WITH edges AS (
+                SELECT user_id AS a, friend_id AS b FROM friendships
+                WHERE status = 'accepted'
+                UNION ALL
+                SELECT friend_id, user_id FROM friendships
+                WHERE status = 'accepted'
+            )
+            INSERT INTO friend_suggestions (user_id, candidate_id, mutual_count)
+            SELECT e1.b, e2.b, COUNT(*)
+            FROM edges e1
+            JOIN edges e2 ON e2.a = e1.a AND e2.b <> e1.b
+            GROUP BY e1.b, e2.b
+            """)
+    total = await db_connection.fetch_val("SELECT COUNT(*) FROM friend_suggestions")
+    logger.info(f"Rebuilt {total} friend suggestions")
+    return total
@@ -1,15 +1,32 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from api.auth import auth_router
 from api.friends import friends_router
 from api.websocket import websocket_router
 from api.message import message_router
-from db.database import init_db, db_connection, create_database_if_not_exists
+from api.metrics import metrics_router
+from api.rooms import rooms_router
+from db.database import db_connection
+from db.pool import pg_pool, replica_pool
+from core.replicas import read_router
+from db.migrations import SCHEMA_VERSION, apply_migrations, get_schema_version
 from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 from core.logger import logger
 from core.redis_service import redis_service
+from core.presence import presence_registry
+from core.websocket_engine import manager
+from core.message_writer import message_writer
+from core.search_indexer import search_indexer
+from core.message_partitions import partition_maintainer
+from core.hashing import password_hasher
+from core.read_receipts import read_receipts
+from core.rooms import room_service, ROOM_INVALIDATION_CHANNEL
+from core.friend_cache import friend_cache, FRIEND_INVALIDATION_CHANNEL
+from core.streams import stream_delivery
+from core.config import settings
+from core.metrics import http_request_latency
 import asyncio
-
+import time
 
 origins = [
     "http://localhost:3000",
@@ -27,16 +44,64 @@ origins = [
 async def lifespan(app: FastAPI):
     logger.info("starting the application")
     listener_task = None
+    heartbeat_task = None
+    stream_task = None
     try:
-        await create_database_if_not_exists()
+        # the default node id changes with the pid, which would orphan the
+        # inbound stream and its pending entries on every restart
+        if (
+            settings.delivery_backend == "streams"
+            and "node_id" not in settings.model_fields_set
+        ):
+            raise RuntimeError(
+                "DELIVERY_BACKEND=streams needs a NODE_ID that is unique per node "
+                "and stable across restarts"
+            )
         await db_connection.connect()
-        await init_db()
+        await pg_pool.connect()
+        if replica_pool:
+            await replica_pool.connect()
+            read_router.start()
+        # the schema is managed by migrate.py; startup only checks its version
+        schema_version = await get_schema_version()
+        if schema_version < SCHEMA_VERSION:
+            if not settings.auto_migrate:
+                raise RuntimeError(
+                    f"Database schema is at version {schema_version}, "
+                    f"expected {SCHEMA_VERSION}; run migrate.py"
+                )
+            await apply_migrations()
+        # the current month's partition must exist before the writer starts
+        await partition_maintainer.run_once(wait=True)
+        partition_maintainer.start()
         logger.info("db init bhayo hai ta ")
+        message_writer.start()
+        search_indexer.start()
 
         # Connect to Redis and start listener
         if await redis_service.connect():
+            # one inbound channel per node; presence routes messages to it
+            await redis_service.subscribe_to_channel(
+                presence_registry.node_channel, manager.handle_envelope, envelope=True
+            )
+            await redis_service.subscribe_to_channel(
+                ROOM_INVALIDATION_CHANNEL, room_service.handle_invalidation
+            )
+            await redis_service.subscribe_to_channel(
+                FRIEND_INVALIDATION_CHANNEL, friend_cache.handle_invalidation
+            )
             listener_task = asyncio.create_task(redis_service.start_message_listener())
-            logger.info("Redis connected and listener started")
+            heartbeat_task = asyncio.create_task(
+                presence_registry.run_heartbeat(manager.active_connections.keys)
+            )
+            if settings.delivery_backend == "streams":
+                stream_task = asyncio.create_task(
+                    stream_delivery.run_consumer(manager.handle_stream_envelope)
+                )
+                logger.info(f"Reading inbound stream {stream_delivery.node_stream}")
+            logger.info(
+                f"Redis connected and listener started on {presence_registry.node_channel}"
+            )
         else:
             logger.error("Failed to connect to Redis")
 
@@ -47,6 +112,20 @@ async def lifespan(app: FastAPI):
     yield
     logger.info("shutting application")
     try:
+        if heartbeat_task:
+            heartbeat_task.cancel()
+            try:
+                await heartbeat_task
+            except asyncio.CancelledError:
+                logger.info("Presence heartbeat cancelled")
+
+        if stream_task:
+            stream_task.cancel()
+            try:
+                await stream_task
+            except asyncio.CancelledError:
+                logger.info("Stream consumer cancelled")
+
         # Cancel Redis listener task
         if listener_task:
             listener_task.cancel()
@@ -54,14 +133,31 @@ async def lifespan(app: FastAPI):
                 await listener_task
             except asyncio.CancelledError:
                 logger.info("Redis listener cancelled")
+        await redis_service.dispatcher.stop()
+        await room_service.stop()
+
+        # Flush pending messages and read marks before Redis and the pool go
+        # away, so the last ones are still delivered
+        await message_writer.stop()
+        await read_receipts.stop()
 
         # Disconnect Redis
         await redis_service.disconnect()
         logger.info("Redis disconnected")
 
+        # Stop the remaining background jobs before the pool goes away
+        await search_indexer.stop()
+        await partition_maintainer.stop()
+
         # Disconnect database
+        await read_router.stop()
+        if replica_pool:
+            await replica_pool.disconnect()
+        await pg_pool.disconnect()
         await db_connection.disconnect()
         logger.info("database disconnected")
+
+        password_hasher.shutdown()
     except Exception as e:
         logger.error(f"shutting down: {e}", exc_info=True)
 
@@ -75,12 +171,36 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Before-Cursor", "X-After-Cursor", "X-Next-Cursor"],
 )
 
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        # label by route template so /conversations/{id} is one series
+        route = request.scope.get("route")
+        http_request_latency.observe(
+            time.perf_counter() - start,
+            request.method,
+            getattr(route, "path", "unmatched"),
+            str(status_code),
+        )
+
+
 app.include_router(auth_router)
 app.include_router(websocket_router)
 app.include_router(friends_router)
 app.include_router(message_router)
+app.include_router(rooms_router)
+if settings.metrics_enabled:
+    app.include_router(metrics_router)
 
 if __name__ == "__main__":
     import uvicorn
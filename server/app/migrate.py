@@ -1,18 +1,47 @@
+import argparse
 import asyncio
+from datetime import date
 
 from core.logger import logger
-from db.database import create_database_if_not_exists, db_connection, init_db
+from core.config import settings
+from db.database import create_database_if_not_exists, db_connection
+from db.inbox import rebuild_conversation_summaries
+from db.migrations import apply_migrations
+from db.partitions import ensure_message_partitions
+from db.suggestions import rebuild_friend_suggestions
 
 
-async def main():
+async def main(rebuild_inbox: bool = False, rebuild_suggestions: bool = False):
     await create_database_if_not_exists()
     await db_connection.connect()
     try:
-        await init_db()
+        await apply_migrations()
+        await ensure_message_partitions(date.today(), settings.message_partitions_ahead)
         logger.info("Migration complete")
+        if rebuild_inbox:
+            await rebuild_conversation_summaries()
+        if rebuild_suggestions:
+            await rebuild_friend_suggestions()
     finally:
         await db_connection.disconnect()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Create or upgrade the schema")
+    parser.add_argument(
+        "--rebuild-inbox",
+        action="store_true",
+        help="recompute conversation summaries from the messages table",
+    )
+    parser.add_argument(
+        "--rebuild-suggestions",
+        action="store_true",
+        help="recompute people-you-may-know from the friendships table",
+    )
+    args = parser.parse_args()
+    asyncio.run(
+        main(
+            rebuild_inbox=args.rebuild_inbox,
+            rebuild_suggestions=args.rebuild_suggestions,
+        )
+    )
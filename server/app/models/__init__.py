@@ -1,5 +1,12 @@
 from .users_model import CreateUserRequest, User, Token, TokenData
 from .friends import FriendsProfile, FriendRequest, FriendShipResponse
+from .rooms import (
+    RoomCreate,
+    RoomResponse,
+    RoomMemberAdd,
+    RoomMessageCreate,
+    RoomMessageResponse,
+)
 
 __all__ = [
     "CreateUserRequest",
@@ -9,4 +16,9 @@ __all__ = [
     "FriendsProfile",
     "FriendRequest",
     "FriendShipResponse",
+    "RoomCreate",
+    "RoomResponse",
+    "RoomMemberAdd",
+    "RoomMessageCreate",
+    "RoomMessageResponse",
 ]
@@ -25,3 +25,4 @@ class FriendsProfile(BaseModel):
 class PeopleYouMayKnow(BaseModel):
     id: int
     username: str
+    mutual_count: int = Field(default=0, description="friends in common")
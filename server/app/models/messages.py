@@ -1,5 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
+from typing import Dict, List, Optional
 
 
 class Message_Create(BaseModel):
@@ -7,6 +8,10 @@ class Message_Create(BaseModel):
     content: str
 
 
+class Message_Read(BaseModel):
+    last_read_id: int = Field(description="id of the newest message read", gt=0)
+
+
 class Message_Response(BaseModel):
     id: int
     sender_id: int
@@ -14,7 +19,28 @@ class Message_Response(BaseModel):
     content: str
     created_at: datetime
     is_read: bool
+    seq: Optional[int] = None
 
     class Config:
         from_attributes = True
         json_encoders = {datetime: lambda v: v.isoformat()}
+
+
+class Message_Search_Result(Message_Response):
+    snippet: str
+    rank: float
+
+
+class Message_Sync(BaseModel):
+    conversations: Dict[int, int] = Field(
+        description="other user id -> last seq the client has for that conversation"
+    )
+    limit: int = Field(
+        default=100, description="max messages returned per conversation", gt=0, le=500
+    )
+
+
+class Conversation_Sync(BaseModel):
+    messages: List[Message_Response]
+    last_seq: int
+    has_more: bool
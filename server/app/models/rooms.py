@@ -0,0 +1,33 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import List
+
+
+class RoomCreate(BaseModel):
+    name: str = Field(..., description="room name", min_length=1, max_length=100)
+    member_ids: List[int] = Field(
+        default_factory=list, description="users joined besides the creator"
+    )
+
+
+class RoomResponse(BaseModel):
+    id: int
+    name: str
+    owner_id: int
+    created_at: datetime
+
+
+class RoomMemberAdd(BaseModel):
+    user_id: int = Field(description="User ID to add to the room", gt=0)
+
+
+class RoomMessageCreate(BaseModel):
+    content: str = Field(..., min_length=1)
+
+
+class RoomMessageResponse(BaseModel):
+    id: int
+    room_id: int
+    sender_id: int
+    content: str
+    created_at: datetime
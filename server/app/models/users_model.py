@@ -1,4 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
+from typing import Optional
 
 
 class CreateUserRequest(BaseModel):
@@ -24,3 +25,4 @@ class Token(BaseModel):
 
 class TokenData(BaseModel):
     username: str
+    user_id: Optional[int] = None
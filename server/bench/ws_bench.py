@@ -0,0 +1,454 @@
+"""
+Load harness for the /ws path.
+
+Opens N authenticated WebSocket clients against a running server (or one it
+starts itself), drives a send pattern and reports end-to-end delivery latency,
+ack latency, throughput, server memory per connection and server CPU time
+per message as JSON.
+
+Patterns:
+    pair   clients are paired up and message their partner (1:1 chat)
+    hot    every client messages client 0 (hot recipient / group owner)
+    burst  every client sends --burst-size messages back to back, then idles
+
+Postgres and Redis must be reachable with the app's usual settings, e.g.
+`docker compose up postgres redis`. The server's per-user message rate limit
+would reject most of a burst, so --spawn starts it with the limit off (pass
+--rate-limit to keep it); start other servers with WS_RATE_LIMIT_ENABLED=false.
+Rejected sends are reported as "rate_limited", not as lost. Examples:
+
+    python bench/ws_bench.py --spawn --clients 200 --pattern pair --duration 30
+    python bench/ws_bench.py --url http://localhost:8080 --pattern hot \\
+        --baseline bench-results/main.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+APP_DIR = Path(__file__).resolve().parent.parent / "app"
+MARKER = "bench"
+
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "p50": None, "p90": None, "p99": None, "max": None}
+    ordered = sorted(samples)
+
+    def pick(q: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(statistics.fmean(ordered) * 1000, 3),
+        "p50": pick(0.50),
+        "p90": pick(0.90),
+        "p99": pick(0.99),
+        "max": round(ordered[-1] * 1000, 3),
+    }
+
+
+def read_rss_kb(pid: int) -> Optional[int]:
+    """Resident set size of a local process, from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+    return None
+
+
+def read_cpu_seconds(pid: int) -> Optional[float]:
+    """User + system CPU time of a local process, from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            # fields after the parenthesized command name; utime and stime
+            # are the 14th and 15th fields of the whole line
+            fields = stat.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Stats:
+    def __init__(self):
+        self.sent_at: Dict[str, float] = {}
+        self.delivery: List[float] = []
+        self.ack: List[float] = []
+        self.sent = 0
+        self.rate_limited = 0
+        self.errors: Dict[str, int] = {}
+        self.closed: Dict[int, int] = {}
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+class BenchClient:
+    def __init__(self, index: int, token: str, ws_url: str, stats: Stats):
+        self.index = index
+        self.token = token
+        self.ws_url = ws_url
+        self.stats = stats
+        self.user_id: Optional[int] = None
+        self.ws = None
+        self.reader: Optional[asyncio.Task] = None
+        # message key -> send time, in send order
+        self.pending_acks: Dict[str, float] = {}
+
+    async def connect(self, timeout: float) -> float:
+        start = time.perf_counter()
+        self.ws = await websockets.connect(self.ws_url, max_size=None)
+        await self.ws.send(json.dumps({"type": "auth", "content": self.token}))
+        while True:
+            frame = json.loads(await asyncio.wait_for(self.ws.recv(), timeout))
+            if frame.get("type") == "auth_success":
+                self.user_id = frame["user"]["id"]
+                break
+            if frame.get("type") == "error":
+                raise RuntimeError(f"auth failed: {frame.get('content')}")
+        self.reader = asyncio.create_task(self._read())
+        return time.perf_counter() - start
+
+    async def send(self, reciever_id: int, seq: int, padding: str):
+        key = f"{self.index}:{seq}"
+        content = f"{MARKER}:{key}:{padding}"
+        now = time.perf_counter()
+        self.stats.sent_at[key] = now
+        self.pending_acks[key] = now
+        self.stats.sent += 1
+        await self.ws.send(
+            json.dumps(
+                {"type": "message", "reciever_id": reciever_id, "content": content}
+            )
+        )
+
+    async def _read(self):
+        try:
+            async for raw in self.ws:
+                now = time.perf_counter()
+                frame = json.loads(raw)
+                kind = frame.get("type")
+                if kind == "new_message":
+                    parts = frame.get("content", "").split(":", 3)
+                    if len(parts) >= 3 and parts[0] == MARKER:
+                        sent = self.stats.sent_at.pop(f"{parts[1]}:{parts[2]}", None)
+                        if sent is not None:
+                            self.stats.delivery.append(now - sent)
+                elif kind == "message_sent":
+                    parts = frame.get("content", "").split(":", 3)
+                    if len(parts) >= 3 and parts[0] == MARKER:
+                        sent = self.pending_acks.pop(f"{parts[1]}:{parts[2]}", None)
+                        if sent is not None:
+                            self.stats.ack.append(now - sent)
+                elif kind == "error":
+                    self.stats.error(frame.get("content", "error"))
+                    if frame.get("code") == "rate_limited" and self.pending_acks:
+                        # frames are handled in order, so the oldest unacked
+                        # send is the one that was dropped
+                        key = next(iter(self.pending_acks))
+                        del self.pending_acks[key]
+                        self.stats.sent_at.pop(key, None)
+                        self.stats.rate_limited += 1
+        except websockets.ConnectionClosed as e:
+            code = e.rcvd.code if e.rcvd else 1006
+            self.stats.closed[code] = self.stats.closed.get(code, 0) + 1
+
+    async def close(self):
+        if self.ws:
+            await self.ws.close()
+        if self.reader:
+            await asyncio.gather(self.reader, return_exceptions=True)
+
+
+async def provision_users(
+    http: httpx.AsyncClient, count: int, prefix: str, password: str, concurrency: int
+) -> List[str]:
+    """Register (if needed) and log in bench users, returning access tokens"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int) -> str:
+        username = f"{prefix}{i}"
+        async with semaphore:
+            for attempt in range(10):
+                reg = await http.post(
+                    "/auth/register",
+                    json={
+                        "username": username,
+                        "email": f"{username}@example.com",
+                        "password": password,
+                    },
+                )
+                # 400 means the user exists from a previous run
+                if reg.status_code != 503:
+                    break
+                await asyncio.sleep(0.2 * (attempt + 1))
+            for attempt in range(10):
+                login = await http.post(
+                    "/auth/token", data={"username": username, "password": password}
+                )
+                if login.status_code == 200:
+                    return login.json()["access_token"]
+                if login.status_code != 503:
+                    raise RuntimeError(f"login failed for {username}: {login.text}")
+                await asyncio.sleep(0.2 * (attempt + 1))
+            raise RuntimeError(f"login kept failing for {username}")
+
+    return await asyncio.gather(*(one(i) for i in range(count)))
+
+
+def pick_recipient(pattern: str, client: BenchClient, clients: List[BenchClient]):
+    if pattern == "hot":
+        target = clients[0] if client.index != 0 else clients[1]
+    else:
+        partner = client.index ^ 1
+        target = clients[partner] if partner < len(clients) else clients[0]
+    return target.user_id
+
+
+async def drive(client: BenchClient, clients: List[BenchClient], args, deadline: float):
+    padding = "x" * args.message_size
+    recipient = pick_recipient(args.pattern, client, clients)
+    seq = 0
+    # spread start times so clients do not send in lockstep
+    await asyncio.sleep(random.random() / args.rate)
+    while time.perf_counter() < deadline:
+        if args.pattern == "burst":
+            for _ in range(args.burst_size):
+                await client.send(recipient, seq, padding)
+                seq += 1
+            await asyncio.sleep(args.burst_interval)
+        else:
+            await client.send(recipient, seq, padding)
+            seq += 1
+            await asyncio.sleep(1 / args.rate)
+
+
+def start_server(port: int, rate_limit: bool) -> subprocess.Popen:
+    env = {**os.environ, "PYTHONPATH": str(APP_DIR)}
+    if not rate_limit:
+        env["WS_RATE_LIMIT_ENABLED"] = "false"
+    return subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+        ],
+        cwd=APP_DIR,
+        env=env,
+    )
+
+
+async def wait_ready(http: httpx.AsyncClient, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if (await http.get("/openapi.json")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.25)
+    raise RuntimeError("server did not become ready")
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=APP_DIR, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(result: dict, baseline_path: str, max_regression: float) -> List[str]:
+    """Regressions of latency percentiles and throughput against a saved run"""
+    baseline = json.loads(Path(baseline_path).read_text())
+    failures = []
+    for section in ("delivery_latency_ms", "ack_latency_ms"):
+        for key in ("p50", "p99"):
+            old = baseline.get(section, {}).get(key)
+            new = result[section].get(key)
+            if old and new and new > old * (1 + max_regression):
+                failures.append(f"{section}.{key}: {old} -> {new}")
+    old = baseline.get("throughput_msgs_per_sec")
+    new = result["throughput_msgs_per_sec"]
+    if old and new < old * (1 - max_regression):
+        failures.append(f"throughput_msgs_per_sec: {old} -> {new}")
+    return failures
+
+
+async def run(args) -> int:
+    server = start_server(args.port, args.rate_limit) if args.spawn else None
+    base_url = f"http://127.0.0.1:{args.port}" if args.spawn else args.url
+    ws_url = base_url.replace("http", "ws", 1) + "/ws"
+    server_pid = server.pid if server else args.server_pid
+    stats = Stats()
+    clients: List[BenchClient] = []
+    try:
+        async with httpx.AsyncClient(base_url=base_url, timeout=60) as http:
+            await wait_ready(http)
+            tokens = await provision_users(
+                http, args.clients, args.user_prefix, args.password, args.concurrency
+            )
+
+            rss_before = read_rss_kb(server_pid) if server_pid else None
+            clients = [
+                BenchClient(i, token, ws_url, stats) for i, token in enumerate(tokens)
+            ]
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def connect(client: BenchClient):
+                async with semaphore:
+                    return await client.connect(args.timeout)
+
+            connect_times = await asyncio.gather(*(connect(c) for c in clients))
+            await asyncio.sleep(1)
+            rss_after = read_rss_kb(server_pid) if server_pid else None
+
+            cpu_before = read_cpu_seconds(server_pid) if server_pid else None
+            start = time.perf_counter()
+            deadline = start + args.duration
+            await asyncio.gather(*(drive(c, clients, args, deadline) for c in clients))
+            # let in-flight messages land before counting
+            drain_deadline = time.perf_counter() + args.drain
+            while stats.sent_at and time.perf_counter() < drain_deadline:
+                await asyncio.sleep(0.1)
+            elapsed = time.perf_counter() - start
+            cpu_after = read_cpu_seconds(server_pid) if server_pid else None
+
+            metrics = None
+            if args.scrape_metrics:
+                response = await http.get("/metrics")
+                if response.status_code == 200:
+                    metrics = response.text
+    finally:
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+        if server:
+            server.terminate()
+            server.wait(timeout=30)
+
+    per_connection_kb = None
+    if rss_before is not None and rss_after is not None:
+        per_connection_kb = round((rss_after - rss_before) / len(clients), 2)
+    cpu_per_message_ms = None
+    if cpu_before is not None and cpu_after is not None and stats.delivery:
+        cpu_per_message_ms = round(
+            (cpu_after - cpu_before) * 1000 / len(stats.delivery), 3
+        )
+
+    result = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("password", "output", "baseline")
+        },
+        "clients": len(clients),
+        "sent": stats.sent,
+        "delivered": len(stats.delivery),
+        "lost": len(stats.sent_at),
+        "rate_limited": stats.rate_limited,
+        "duration_sec": round(elapsed, 3),
+        "throughput_msgs_per_sec": round(len(stats.delivery) / elapsed, 2),
+        "connect_latency_ms": percentiles(connect_times),
+        "delivery_latency_ms": percentiles(stats.delivery),
+        "ack_latency_ms": percentiles(stats.ack),
+        "server_rss_kb": {"before": rss_before, "after": rss_after},
+        "server_rss_kb_per_connection": per_connection_kb,
+        "server_cpu_ms_per_message": cpu_per_message_ms,
+        "errors": stats.errors,
+        "close_codes": stats.closed,
+    }
+    if metrics is not None:
+        result["server_metrics"] = metrics
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(result, indent=2))
+    summary = {k: v for k, v in result.items() if k not in ("config", "server_metrics")}
+    print(json.dumps(summary, indent=2))
+    print(f"results written to {output}")
+
+    if args.baseline:
+        failures = compare(result, args.baseline, args.max_regression)
+        if failures:
+            print("regressions against baseline:")
+            for failure in failures:
+                print(f"  {failure}")
+            return 1
+    return 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the /ws message path")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument(
+        "--spawn", action="store_true", help="start uvicorn for the app locally"
+    )
+    parser.add_argument("--port", type=int, default=8765, help="port used by --spawn")
+    parser.add_argument(
+        "--rate-limit",
+        action="store_true",
+        help="keep the per-user message rate limit on in the --spawn server",
+    )
+    parser.add_argument(
+        "--server-pid", type=int, help="pid of a local server, for RSS sampling"
+    )
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--pattern", choices=("pair", "hot", "burst"), default="pair")
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--rate", type=float, default=5, help="messages/sec per client")
+    parser.add_argument("--burst-size", type=int, default=50)
+    parser.add_argument("--burst-interval", type=float, default=2, help="seconds")
+    parser.add_argument("--message-size", type=int, default=64, help="padding bytes")
+    parser.add_argument("--drain", type=float, default=5, help="seconds")
+    parser.add_argument("--timeout", type=float, default=10, help="auth timeout")
+    parser.add_argument(
+        "--concurrency", type=int, default=32, help="parallel logins/connects"
+    )
+    parser.add_argument("--user-prefix", default="bench_user_")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument(
+        "--scrape-metrics",
+        action="store_true",
+        help="embed the server's /metrics output in the result",
+    )
+    parser.add_argument(
+        "--output",
+        default=f"bench-results/ws_bench-{datetime.now():%Y%m%d-%H%M%S}.json",
+    )
+    parser.add_argument("--baseline", help="previous result file to compare against")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="allowed fractional slowdown before exiting non-zero",
+    )
+    args = parser.parse_args()
+    if args.clients < 2:
+        parser.error("--clients must be at least 2")
+    return args
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run(parse_args())))